@@ -110,13 +110,14 @@ def after_request(response):
         response.headers.add('Strict-Transport-Security', 'max-age=31536000')
 
     if not flask.request.path.startswith('/event'):
-        monitoring.insert_point('requests', {
+        url_rule = flask.request.url_rule
+        tags = {
             'host': settings.local.host.name,
-        }, {
-            'path': flask.request.path,
-            'remote_ip': utils.get_remote_addr(),
-            'response_time': int((time.time() - flask.g.start) * 1000),
-        })
+            'path': url_rule.rule if url_rule else 'unknown',
+        }
+        monitoring.add_counter('requests', tags, 'count')
+        monitoring.add_timing('requests', tags, 'response_time',
+            int((time.time() - flask.g.start) * 1000))
 
     return response
 
@@ -0,0 +1,133 @@
+from pritunl.constants import *
+from pritunl import settings
+from pritunl import mongo
+from pritunl import plugins
+from pritunl import monitoring
+from pritunl import logger
+
+import collections
+import threading
+import pymongo
+import sys
+
+audit_queue = collections.deque()
+writer_running = False
+_queue_lock = threading.Lock()
+_stats = {
+    'queued': 0,
+    'written': 0,
+    'dropped': 0,
+    'inline': 0,
+    'errors': 0,
+}
+
+def _count(field, value=1):
+    _stats[field] += value
+    monitoring.add_counter('audit', {
+        'host': settings.local.host.name,
+    }, field, value)
+
+def _get_failed(batch, error):
+    # Duplicate key errors are from an earlier write that was reported as
+    # failed, those documents are already written
+    write_errors = error.details.get('writeErrors') or []
+    return [batch[x['index']] for x in write_errors
+        if x.get('code') != 11000]
+
+def _write(batch):
+    try:
+        mongo.get_collection('users_audit').insert_many(
+            [doc for doc, _ in batch], ordered=False)
+    except pymongo.errors.BulkWriteError as error:
+        if _get_failed(batch, error):
+            raise
+
+def _send_events(batch):
+    for _, event_kwargs in batch:
+        try:
+            plugins.event('audit_event', **event_kwargs)
+        except:
+            logger.exception('Failed to send audit plugin event', 'audit')
+
+def _requeue(batch):
+    _queue_lock.acquire()
+    try:
+        audit_queue.extendleft(reversed(batch))
+        overflow = len(audit_queue) - settings.app.audit_buffer_size
+        for _ in xrange(max(0, overflow)):
+            audit_queue.pop()
+        if overflow > 0:
+            _count('dropped', overflow)
+    finally:
+        _queue_lock.release()
+
+def add(doc, event_kwargs):
+    if writer_running:
+        _queue_lock.acquire()
+        try:
+            if len(audit_queue) < settings.app.audit_buffer_size:
+                audit_queue.append((doc, event_kwargs))
+                _count('queued')
+                return
+
+            overflow = settings.app.audit_overflow
+            if overflow == 'drop_oldest':
+                audit_queue.popleft()
+                audit_queue.append((doc, event_kwargs))
+                _count('dropped')
+                return
+            elif overflow == 'drop_newest':
+                _count('dropped')
+                return
+        finally:
+            _queue_lock.release()
+
+        _count('inline')
+
+    _write([(doc, event_kwargs)])
+    _count('written')
+    _send_events([(doc, event_kwargs)])
+
+def flush():
+    while True:
+        _queue_lock.acquire()
+        try:
+            batch = []
+            while audit_queue and \
+                    len(batch) < settings.app.audit_batch_size:
+                batch.append(audit_queue.popleft())
+        finally:
+            _queue_lock.release()
+
+        if not batch:
+            return
+
+        exc_info = None
+        failed = []
+        try:
+            _write(batch)
+        except pymongo.errors.BulkWriteError as error:
+            exc_info = sys.exc_info()
+            failed = _get_failed(batch, error)
+        except:
+            _requeue(batch)
+            _count('errors')
+            raise
+
+        if failed:
+            failed_ids = set(id(x) for x in failed)
+            batch = [x for x in batch if id(x) not in failed_ids]
+            _requeue(failed)
+            _count('errors')
+
+        if batch:
+            _count('written', len(batch))
+            _send_events(batch)
+
+        if exc_info:
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+def get_stats():
+    stats = _stats.copy()
+    stats['pending'] = len(audit_queue)
+    return stats
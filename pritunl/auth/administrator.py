@@ -10,6 +10,8 @@ from pritunl import logger
 from pritunl import journal
 from pritunl import plugins
 from pritunl import sso
+from pritunl import messenger
+from pritunl import monitoring
 
 import base64
 import os
@@ -19,6 +21,9 @@ import datetime
 import hmac
 import pymongo
 import struct
+import time
+import threading
+import collections
 
 class Administrator(mongo.MongoObject):
     fields = {
@@ -133,12 +138,26 @@ class Administrator(mongo.MongoObject):
             hash_func = hash_password_v2
         elif hash_ver == '3':
             hash_func = hash_password_v3
+        elif hash_ver == '4':
+            hash_func = hash_password_v4
         else:
             raise ValueError('Unknown hash version')
 
         test_hash = base64.b64encode(hash_func(pass_salt, test_pass))
         return utils.const_compare(pass_hash, test_hash)
 
+    def rehash_password(self, password):
+        pass_hash = generate_hash_password_v4(password)
+
+        self.collection.update({
+            '_id': self.id,
+            'password': self.password,
+        }, {'$set': {
+            'password': pass_hash,
+        }})
+        self.password = pass_hash
+        self.changed.discard('password')
+
     def auth_check(self, password, otp_code=None, yubico_key=None,
             remote_addr=None):
         if not self.test_password(password):
@@ -157,6 +176,9 @@ class Administrator(mongo.MongoObject):
             )
             return False
 
+        if not self.password.startswith('4$'):
+            self.rehash_password(password)
+
         if self.otp_auth and not self.verify_otp_code(otp_code):
             journal.entry(
                 journal.ADMIN_AUTH_FAILURE,
@@ -282,6 +304,7 @@ class Administrator(mongo.MongoObject):
                 '$slice': -settings.app.session_limit,
             },
         }})
+        clear_admin_cache(self.id)
         return session_id
 
     def commit(self, *args, **kwargs):
@@ -289,11 +312,7 @@ class Administrator(mongo.MongoObject):
             if not self.password:
                 raise ValueError('Password is empty')
 
-            salt = base64.b64encode(os.urandom(8))
-            pass_hash = base64.b64encode(
-                hash_password_v3(salt, self.password))
-            pass_hash = '3$%s$%s' % (salt, pass_hash)
-            self.password = pass_hash
+            self.password = generate_hash_password_v4(self.password)
 
             if self.default and self.exists:
                 self.default = None
@@ -305,6 +324,11 @@ class Administrator(mongo.MongoObject):
             self.generate_secret()
 
         mongo.MongoObject.commit(self, *args, **kwargs)
+        clear_admin_cache(self.id)
+
+    def remove(self):
+        mongo.MongoObject.remove(self)
+        clear_admin_cache(self.id)
 
     def audit_event(self, event_type, event_msg, remote_addr=None):
         if settings.app.auditing != ALL:
@@ -359,12 +383,209 @@ class Administrator(mongo.MongoObject):
 
         return events
 
+_cache = {}
+_cache_lock = threading.Lock()
+_nonces = {}
+_nonce_queue = collections.deque()
+_nonce_lock = threading.Lock()
+nonce_writer_running = False
+_stats = {
+    'hit': 0,
+    'miss': 0,
+    'invalidated': 0,
+    'nonce_replay': 0,
+    'nonce_queued': 0,
+    'nonce_written': 0,
+    'nonce_duplicate': 0,
+}
+
+def _count(field, value=1):
+    _stats[field] += value
+    monitoring.add_counter('auth', {
+        'host': settings.local.host.name,
+    }, field, value)
+
+def _cache_get(key):
+    if not settings.app.admin_session_cache_ttl:
+        return
+
+    _cache_lock.acquire()
+    try:
+        entry = _cache.get(key)
+        if entry and entry[0] < time.time():
+            _cache.pop(key, None)
+            entry = None
+    finally:
+        _cache_lock.release()
+
+    if entry:
+        _count('hit')
+        return entry[2]
+    _count('miss')
+
+def _cache_set(key, admin_id, value):
+    ttl = settings.app.admin_session_cache_ttl
+    if not ttl:
+        return
+
+    cur_time = time.time()
+
+    _cache_lock.acquire()
+    try:
+        if len(_cache) >= settings.app.admin_session_cache_size:
+            for cache_key, entry in _cache.items():
+                if entry[0] < cur_time:
+                    _cache.pop(cache_key, None)
+            if len(_cache) >= settings.app.admin_session_cache_size:
+                _cache.clear()
+
+        _cache[key] = (cur_time + ttl, admin_id, value)
+    finally:
+        _cache_lock.release()
+
+def _clear_cache(admin_id):
+    _cache_lock.acquire()
+    try:
+        if admin_id is None:
+            count = len(_cache)
+            _cache.clear()
+        else:
+            keys = [key for key, entry in _cache.items()
+                if entry[1] == admin_id]
+            count = len(keys)
+            for key in keys:
+                _cache.pop(key, None)
+    finally:
+        _cache_lock.release()
+
+    if count:
+        _count('invalidated', count)
+
+def clear_admin_cache(admin_id=None):
+    _clear_cache(admin_id)
+    messenger.publish('administrators', admin_id)
+
+def on_admin_msg(msg):
+    _clear_cache(msg['message'])
+
+def _get_cached_user(key, admin_id, load):
+    doc = _cache_get(key)
+    if doc:
+        return Administrator(doc=doc.copy())
+
+    administrator = load()
+    if administrator:
+        _cache_set(key, admin_id or administrator.id, administrator.export())
+    return administrator
+
+def _insert_nonce(auth_token, auth_nonce):
+    try:
+        Administrator.nonces_collection.insert({
+            'token': auth_token,
+            'nonce': auth_nonce,
+            'timestamp': utils.now(),
+        })
+    except pymongo.errors.DuplicateKeyError:
+        return False
+    return True
+
+def check_nonce(auth_token, auth_nonce):
+    if not settings.app.auth_nonce_async or not nonce_writer_running:
+        return _insert_nonce(auth_token, auth_nonce)
+
+    key = (auth_token, auth_nonce)
+    cur_time = time.time()
+
+    _nonce_lock.acquire()
+    try:
+        expire = _nonces.get(key)
+        if expire and expire > cur_time:
+            replay = True
+        elif len(_nonces) < settings.app.auth_nonce_cache_size:
+            replay = False
+            _nonces[key] = cur_time + settings.app.auth_time_window * 2
+            _nonce_queue.append({
+                'token': auth_token,
+                'nonce': auth_nonce,
+                'timestamp': utils.now(),
+            })
+        else:
+            replay = None
+    finally:
+        _nonce_lock.release()
+
+    if replay is None:
+        return _insert_nonce(auth_token, auth_nonce)
+    elif replay:
+        _count('nonce_replay')
+        return False
+
+    _count('nonce_queued')
+    return True
+
+def flush_nonces():
+    cur_time = time.time()
+
+    _nonce_lock.acquire()
+    try:
+        docs = list(_nonce_queue)
+        _nonce_queue.clear()
+        for key, expire in _nonces.items():
+            if expire < cur_time:
+                _nonces.pop(key, None)
+    finally:
+        _nonce_lock.release()
+
+    if not docs:
+        return
+
+    try:
+        Administrator.nonces_collection.insert_many(docs, ordered=False)
+    except pymongo.errors.BulkWriteError as error:
+        write_errors = error.details.get('writeErrors') or []
+        duplicates = len([x for x in write_errors if x.get('code') == 11000])
+        if duplicates != len(write_errors):
+            _requeue_nonces([docs[x['index']] for x in write_errors
+                if x.get('code') != 11000])
+            raise
+
+        _count('nonce_duplicate', duplicates)
+        logger.warning('Auth nonce already used on another host', 'auth',
+            count=duplicates,
+        )
+
+        if len(docs) > duplicates:
+            _count('nonce_written', len(docs) - duplicates)
+        return
+    except:
+        _requeue_nonces(docs)
+        raise
+
+    _count('nonce_written', len(docs))
+
+def _requeue_nonces(docs):
+    _nonce_lock.acquire()
+    try:
+        _nonce_queue.extendleft(reversed(docs))
+    finally:
+        _nonce_lock.release()
+
+def get_cache_stats():
+    stats = _stats.copy()
+    lookups = stats['hit'] + stats['miss']
+    stats['hit_rate'] = float(stats['hit']) / lookups if lookups else 0.0
+    stats['cached'] = len(_cache)
+    stats['nonce_cached'] = len(_nonces)
+    stats['nonce_pending'] = len(_nonce_queue)
+    return stats
+
 def clear_session(id, session_id):
     Administrator.collection.update({
         '_id': id,
     }, {'$pull': {
         'sessions': session_id,
     }})
+    clear_admin_cache(id)
 
 def get_user(id, session_id):
     if not session_id:
@@ -406,7 +627,8 @@ def check_session(csrf_check):
         except ValueError:
             return False
 
-        administrator = find_user(token=auth_token)
+        administrator = _get_cached_user(('token', auth_token), None,
+            lambda: find_user(token=auth_token))
         if not administrator:
             return False
 
@@ -429,13 +651,7 @@ def check_session(csrf_check):
         if not utils.const_compare(auth_signature, auth_test_signature):
             return False
 
-        try:
-            Administrator.nonces_collection.insert({
-                'token': auth_token,
-                'nonce': auth_nonce,
-                'timestamp': utils.now(),
-            })
-        except pymongo.errors.DuplicateKeyError:
+        if not check_nonce(auth_token, auth_nonce):
             return False
     else:
         if not flask.session:
@@ -456,10 +672,14 @@ def check_session(csrf_check):
 
         if csrf_check:
             csrf_token = flask.request.headers.get('Csrf-Token', None)
-            if not validate_token(admin_id, csrf_token):
-                return False
-
-        administrator = get_user(admin_id, session_id)
+            csrf_key = ('csrf', admin_id, csrf_token)
+            if not _cache_get(csrf_key):
+                if not validate_token(admin_id, csrf_token):
+                    return False
+                _cache_set(csrf_key, admin_id, True)
+
+        administrator = _get_cached_user(('session', admin_id, session_id),
+            admin_id, lambda: get_user(admin_id, session_id))
         if not administrator:
             return False
 
@@ -522,6 +742,8 @@ def reset_password():
             'super_user': {'$ne': False},
         })
 
+    clear_admin_cache()
+
     default_admin = Administrator(
         username=DEFAULT_USERNAME,
     )
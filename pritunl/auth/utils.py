@@ -3,77 +3,105 @@ from pritunl import settings
 import base64
 import hashlib
 import os
+import signal
+import threading
+import multiprocessing
 
-def hash_password_v0(salt, password):
-    pass_hash = hashlib.sha512()
-    pass_hash.update(password[:settings.app.password_len_limit])
-    pass_hash.update(base64.b64decode(salt))
-    return pass_hash.digest()
+PBKDF2_ITERATIONS = 100000
 
-def hash_password_v1(salt, password):
+_pool = None
+_pool_lock = threading.Lock()
+
+def _hash_iter(salt, value, rounds):
     pass_hash = hashlib.sha512()
-    pass_hash.update(password[:settings.app.password_len_limit])
+    pass_hash.update(value)
     pass_hash.update(base64.b64decode(salt))
     hash_digest = pass_hash.digest()
 
-    for i in xrange(5):
+    for _ in xrange(rounds):
         pass_hash = hashlib.sha512()
         pass_hash.update(hash_digest)
         hash_digest = pass_hash.digest()
 
     return hash_digest
 
-def hash_password_v2(salt, password):
-    pass_hash = hashlib.sha512()
-    pass_hash.update(password[:settings.app.password_len_limit])
-    pass_hash.update(base64.b64decode(salt))
-    hash_digest = pass_hash.digest()
+def _hash_pbkdf2(salt, value):
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return hashlib.pbkdf2_hmac('sha512', value, base64.b64decode(salt),
+        PBKDF2_ITERATIONS)
+
+def _init_worker():
+    # Workers inherit the server exit handlers, restore the defaults so
+    # terminating the pool does not hang
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+def init_verify_pool():
+    global _pool
+
+    processes = settings.app.hash_verify_processes
+    if not processes:
+        return
+
+    _pool_lock.acquire()
+    try:
+        if not _pool:
+            _pool = multiprocessing.Pool(processes, _init_worker)
+    finally:
+        _pool_lock.release()
+
+def _run_hash_iter(salt, value, rounds):
+    # Iterated hashes run in python and hold the GIL, offload them to
+    # the verify pool when available
+    if _pool and rounds >= 1024:
+        return _pool.apply_async(_hash_iter, (salt, value, rounds)).get(
+            settings.app.hash_verify_timeout)
+    return _hash_iter(salt, value, rounds)
+
+def _run_hash_pbkdf2(salt, value):
+    if _pool:
+        return _pool.apply_async(_hash_pbkdf2, (salt, value)).get(
+            settings.app.hash_verify_timeout)
+    return _hash_pbkdf2(salt, value)
 
-    for _ in xrange(10):
-        pass_hash = hashlib.sha512()
-        pass_hash.update(hash_digest)
-        hash_digest = pass_hash.digest()
+def hash_password_v0(salt, password):
+    return _run_hash_iter(salt,
+        password[:settings.app.password_len_limit], 0)
 
-    return hash_digest
+def hash_password_v1(salt, password):
+    return _run_hash_iter(salt,
+        password[:settings.app.password_len_limit], 5)
 
-def hash_password_v3(salt, password):
-    pass_hash = hashlib.sha512()
-    pass_hash.update(password[:settings.app.password_len_limit])
-    pass_hash.update(base64.b64decode(salt))
-    hash_digest = pass_hash.digest()
+def hash_password_v2(salt, password):
+    return _run_hash_iter(salt,
+        password[:settings.app.password_len_limit], 10)
 
-    for _ in xrange(100000):
-        pass_hash = hashlib.sha512()
-        pass_hash.update(hash_digest)
-        hash_digest = pass_hash.digest()
+def hash_password_v3(salt, password):
+    return _run_hash_iter(salt,
+        password[:settings.app.password_len_limit], 100000)
 
-    return hash_digest
+def hash_password_v4(salt, password):
+    return _run_hash_pbkdf2(salt,
+        password[:settings.app.password_len_limit])
 
 def hash_pin_v1(salt, pin):
-    pass_hash = hashlib.sha512()
-    pass_hash.update(pin[:settings.app.password_len_limit])
-    pass_hash.update(base64.b64decode(salt))
-    hash_digest = pass_hash.digest()
-
-    for _ in xrange(1024):
-        pass_hash = hashlib.sha512()
-        pass_hash.update(hash_digest)
-        hash_digest = pass_hash.digest()
-
-    return hash_digest
+    return _run_hash_iter(salt,
+        pin[:settings.app.password_len_limit], 1024)
 
 def hash_pin_v2(salt, pin):
-    pass_hash = hashlib.sha512()
-    pass_hash.update(pin[:settings.app.password_len_limit])
-    pass_hash.update(base64.b64decode(salt))
-    hash_digest = pass_hash.digest()
+    return _run_hash_iter(salt,
+        pin[:settings.app.password_len_limit], 100000)
 
-    for _ in xrange(100000):
-        pass_hash = hashlib.sha512()
-        pass_hash.update(hash_digest)
-        hash_digest = pass_hash.digest()
+def hash_pin_v3(salt, pin):
+    return _run_hash_pbkdf2(salt, pin[:settings.app.password_len_limit])
 
-    return hash_digest
+def generate_hash_password_v4(password):
+    salt = base64.b64encode(os.urandom(16))
+    pass_hash = base64.b64encode(hash_password_v4(salt, password))
+    pass_hash = '4$%s$%s' % (salt, pass_hash)
+
+    return pass_hash
 
 def generate_hash_pin_v2(pin):
     salt = base64.b64encode(os.urandom(8))
@@ -81,3 +109,10 @@ def generate_hash_pin_v2(pin):
     pin_hash = '2$%s$%s' % (salt, pin_hash)
 
     return pin_hash
+
+def generate_hash_pin_v3(pin):
+    salt = base64.b64encode(os.urandom(16))
+    pin_hash = base64.b64encode(hash_pin_v3(salt, pin))
+    pin_hash = '3$%s$%s' % (salt, pin_hash)
+
+    return pin_hash
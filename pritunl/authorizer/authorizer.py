@@ -19,6 +19,31 @@ import pymongo
 
 _states = tunldb.TunlDB()
 
+_whitelist = None
+
+def _get_whitelist():
+    global _whitelist
+
+    whitelist = _whitelist
+    if whitelist is None:
+        whitelist = []
+        for network_str in settings.app.sso_whitelist or []:
+            try:
+                whitelist.append(ipaddress.IPNetwork(network_str))
+            except (ipaddress.AddressValueError, ValueError):
+                logger.warning('Invalid whitelist network', 'authorize',
+                    network=network_str,
+                )
+        _whitelist = whitelist
+
+    return whitelist
+
+def _on_whitelist_change(changes):
+    global _whitelist
+    _whitelist = None
+
+settings.watch('app', ('sso_whitelist',), _on_whitelist_change)
+
 class Authorizer(object):
     def __init__(self, svr, usr, remote_ip, platform, device_id, device_name,
             mac_addr, password, auth_password, auth_token, auth_nonce,
@@ -172,18 +197,11 @@ class Authorizer(object):
                 self.has_token = True
 
     def _check_whitelist(self):
-        if settings.app.sso_whitelist:
+        whitelist = _get_whitelist()
+        if whitelist:
             remote_ip = ipaddress.IPAddress(self.remote_ip)
 
-            for network_str in settings.app.sso_whitelist:
-                try:
-                    network = ipaddress.IPNetwork(network_str)
-                except (ipaddress.AddressValueError, ValueError):
-                    logger.warning('Invalid whitelist network', 'authorize',
-                        network=network_str,
-                    )
-                    continue
-
+            for network in whitelist:
                 if remote_ip in network:
                     self.whitelisted = True
                     break
@@ -6,13 +6,43 @@ from pritunl import logger
 import time
 import json
 import redis
+import threading
+
+PUBLISH_SCRIPT = """
+if redis.call('HEXISTS', KEYS[2], ARGV[2]) == 1 then
+    return 0
+end
+local seq = redis.call('INCR', KEYS[3])
+redis.call('ZADD', KEYS[1], seq, ARGV[1])
+redis.call('HSET', KEYS[2], ARGV[2], seq)
+local cap = tonumber(ARGV[3])
+local old = redis.call('ZRANGE', KEYS[1], 0, -(cap + 2))
+if #old > 0 then
+    redis.call('ZREMRANGEBYRANK', KEYS[1], 0, -(cap + 2))
+    for _, member in ipairs(old) do
+        redis.call('HDEL', KEYS[2], string.sub(member, 1, 24))
+    end
+end
+local ttl = tonumber(ARGV[4])
+if ttl > 0 then
+    for i = 1, 3 do
+        redis.call('EXPIRE', KEYS[i], ttl)
+    end
+end
+redis.call('PUBLISH', ARGV[5], ARGV[6])
+return 1
+"""
 
 _set = set
 _client = None
+_publish_script = None
 has_cache = False
+publish_queue = utils.NoneQueue()
+publisher_running = False
 
 def init():
     global _client
+    global _publish_script
     global has_cache
 
     redis_uri = settings.app.redis_uri
@@ -30,6 +60,7 @@ def init():
         socket_timeout=settings.app.redis_timeout,
         socket_connect_timeout=settings.app.redis_timeout,
     )
+    _publish_script = _client.register_script(PUBLISH_SCRIPT)
 
 def get(key):
     return _client.get(key)
@@ -73,35 +104,68 @@ def rpush(key, *vals, **kwargs):
 def remove(key):
     return  _client.delete(key)
 
+def _log_key(channel):
+    return channel + ':log'
+
+def _ids_key(channel):
+    return channel + ':ids'
+
+def _seq_key(channel):
+    return channel + ':seq'
+
+def _encode_msg(message, extra):
+    doc = {
+        '_id': utils.ObjectId(),
+        'message': message,
+        'timestamp': utils.now(),
+    }
+    if extra:
+        for key, val in extra.items():
+            doc[key] = val
+
+    # Log members are prefixed with the ObjectId to allow cursor lookups
+    # and trimming without decoding the payload
+    doc_id = str(doc['_id'])
+    data = json.dumps(doc, default=utils.json_default)
+
+    return doc_id, data
+
+def _decode_msg(member):
+    return json.loads(member[25:], object_hook=utils.json_object_hook_handler)
+
+def publish_batch(msgs):
+    # The publish script skips message ids already in the channel log so a
+    # retry after a partial failure does not deliver duplicates
+    pipe = _client.pipeline(transaction=False)
+
+    for channels, doc_id, data, cap, ttl in msgs:
+        member = doc_id + ':' + data
+        for channel in channels:
+            _publish_script(
+                keys=[_log_key(channel), _ids_key(channel),
+                    _seq_key(channel)],
+                args=[member, doc_id, cap, ttl or 0, channel, data],
+                client=pipe,
+            )
+
+    pipe.execute()
+
 def publish(channels, message, extra=None, cap=50, ttl=300):
     if isinstance(channels, str):
         channels = [channels]
 
-    for channel in channels:
-        doc = {
-            '_id': utils.ObjectId(),
-            'message': message,
-            'timestamp': utils.now(),
-        }
-        if extra:
-            for key, val in extra.items():
-                doc[key] = val
-
-        doc = json.dumps(doc, default=utils.json_default)
+    doc_id, data = _encode_msg(message, extra)
+    msg = (channels, doc_id, data, cap, ttl)
 
-        pipe = _client.pipeline()
-        pipe.lpush(channel, doc)
-        pipe.ltrim(channel, 0, cap)
-        if ttl:
-            pipe.expire(channel, ttl)
-        pipe.publish(channel, doc)
-        pipe.execute()
+    if publisher_running:
+        publish_queue.put(msg)
+    else:
+        publish_batch([msg])
 
 def get_cursor_id(channel):
-    msg = _client.lindex(channel, 0)
-    if msg:
-        doc = json.loads(msg, object_hook=utils.json_object_hook_handler)
-        return doc['_id']
+    members = _client.zrevrange(_log_key(channel), 0, 0)
+    if members:
+        return utils.ObjectId(members[0][:24])
 
 @interrupter_generator
 def subscribe(channels, cursor_id=None, timeout=None, yield_delay=None,
@@ -130,26 +194,16 @@ def subscribe(channels, cursor_id=None, timeout=None, yield_delay=None,
                 raise TypeError(
                     'Cannot specify cursor_id with multiple channels')
 
-            found = False
-            past = []
             duplicates = _set()
-            history = _client.lrange(channels[0], 0, -1)
-            for msg in history:
-                doc = json.loads(
-                    msg,
-                    object_hook=utils.json_object_hook_handler,
-                )
-                if doc['_id'] == cursor_id:
-                    found = True
-                    break
-                doc['channel'] = channels[0]
-                past.append(doc)
-                duplicates.add(doc['_id'])
-
-                yield
+            seq = _client.hget(_ids_key(channels[0]), str(cursor_id))
+            if seq:
+                history = _client.zrangebyscore(_log_key(channels[0]),
+                    '(' + seq, '+inf')
+                for member in history:
+                    doc = _decode_msg(member)
+                    doc['channel'] = channels[0]
+                    duplicates.add(doc['_id'])
 
-            if found:
-                for doc in reversed(past):
                     yield doc
 
         yield
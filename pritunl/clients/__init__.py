@@ -1 +1,2 @@
-from pritunl.clients.clients import Clients, on_port_forwarding, on_client
+from pritunl.clients.clients import Clients, on_port_forwarding, on_client, \
+    on_event
@@ -9,6 +9,7 @@ from pritunl import settings
 from pritunl import event
 from pritunl import docdb
 from pritunl import callqueue
+from pritunl import scheduler
 from pritunl import objcache
 from pritunl import host
 from pritunl import authorizer
@@ -35,6 +36,7 @@ from cryptography.hazmat.primitives.asymmetric import padding
 _limiter = limiter.Limiter('vpn', 'peer_limit', 'peer_limit_timeout')
 _port_listeners = {}
 _client_listeners = {}
+_event_listeners = {}
 
 class Clients(object):
     def __init__(self, svr, instance, instance_com):
@@ -52,6 +54,9 @@ class Clients(object):
         self.obj_cache = objcache.ObjCache()
         self.client_routes = set()
         self.client_routes6 = set()
+        self.conf_cache = {}
+        self.conf_cache_lock = threading.Lock()
+        self.conf_link_ids = set()
 
         self.clients = docdb.DocDb(
             'user_id',
@@ -106,152 +111,212 @@ class Clients(object):
                 self.obj_cache.set(org_id, org)
         return org
 
-    def generate_client_conf(self, platform, client_id, virt_address,
-            virt_address6, user, reauth):
+    def clear_conf_cache(self):
+        self.conf_cache_lock.acquire()
+        try:
+            self.conf_cache = {}
+        finally:
+            self.conf_cache_lock.release()
+
+    def _get_conf_cache(self, key, generate):
+        ttl = settings.vpn.client_conf_cache_ttl
+        cur_time = time.time()
+
+        self.conf_cache_lock.acquire()
+        try:
+            cache = self.conf_cache.get(key)
+        finally:
+            self.conf_cache_lock.release()
+
+        if cache and cur_time - cache[0] < ttl:
+            return cache[1]
+
+        value = generate()
+
+        if ttl:
+            self.conf_cache_lock.acquire()
+            try:
+                self.conf_cache[key] = (cur_time, value)
+            finally:
+                self.conf_cache_lock.release()
+
+        return value
+
+    def _generate_link_client_conf(self, link_server_id):
         client_conf = ''
 
-        network_gateway = utils.get_network_gateway(self.server.network)
-        network_gateway6 = utils.get_network_gateway(self.server.network6)
+        link_usr_svr = self.server.get_link_server(link_server_id,
+            fields=('_id', 'wg', 'network', 'network_wg',
+                'network_start', 'network_end', 'local_networks',
+                'organizations', 'routes', 'links', 'ipv6'))
 
-        if user.link_server_id:
-            link_usr_svr = self.server.get_link_server(user.link_server_id,
-                fields=('_id', 'wg', 'network', 'network_wg',
-                    'network_start', 'network_end', 'local_networks',
-                    'organizations', 'routes', 'links', 'ipv6'))
+        for route in link_usr_svr.get_routes(include_default=False):
+            network = route['network']
+            metric = route.get('metric')
+            if metric:
+                metric_def = ' default %s' % metric
+            else:
+                metric_def = ''
+
+            if route['net_gateway']:
+                continue
+
+            netmap = route.get('nat_netmap')
+            if netmap:
+                network = netmap
+
+            if ':' in network:
+                client_conf += 'iroute-ipv6 %s%s\n' % (
+                    network, metric_def)
+            else:
+                client_conf += 'iroute %s %s%s\n' % (
+                    utils.parse_network(network) + (metric_def,))
+
+        return client_conf
+
+    def _generate_client_conf_head(self, platform):
+        client_conf = ''
+
+        if self.server.inactive_timeout:
+            client_conf += 'push "inactive %d"\n' % \
+                self.server.inactive_timeout
+
+        if self.server.is_route_all():
+            client_conf += 'push "redirect-gateway def1"\n'
+
+            if self.server.ipv6 or (settings.vpn.ipv6_route_all and (
+                    platform == 'android' or platform == 'ios')):
+                if platform == 'chrome':
+                    client_conf += 'push "redirect-gateway ipv6"\n'
+                    client_conf += 'push "redirect-gateway-ipv6 def1"\n'
+                else:
+                    client_conf += 'push "redirect-gateway ipv6"\n'
+                    client_conf += 'push "redirect-gateway-ipv6 def1"\n'
+                    client_conf += 'push "route-ipv6 2000::/3"\n'
+
+        if self.server.dns_mapping:
+            client_conf += 'push "dhcp-option DNS %s"\n' % (
+                utils.get_network_gateway(self.server.network))
+
+        if not self.server.dns_mapping or \
+                settings.vpn.dns_mapping_push_all:
+            for dns_server in self.server.dns_servers:
+                client_conf += 'push "dhcp-option DNS %s"\n' % \
+                    dns_server
+
+        if self.server.search_domain:
+            for domain in self.server.search_domain.split(','):
+                client_conf += 'push "dhcp-option DOMAIN %s"\n' % (
+                    domain.strip())
+
+        return client_conf
+
+    def _generate_client_conf_tail(self, platform):
+        client_conf = ''
+
+        for network_link in self.server.network_links:
+            if ':' in network_link:
+                client_conf += 'push "route-ipv6 %s"\n' % network_link
+            else:
+                client_conf += 'push "route %s %s"\n' % (
+                    utils.parse_network(network_link))
 
-            for route in link_usr_svr.get_routes(include_default=False):
+        for link_svr in self.server.iter_links():
+            self.conf_link_ids.add(link_svr.id)
+            for route in link_svr.get_routes(
+                    include_default=False):
                 network = route['network']
                 metric = route.get('metric')
                 if metric:
                     metric_def = ' default %s' % metric
+                    metric = ' %s' % metric
                 else:
                     metric_def = ''
-
-                if route['net_gateway']:
-                    continue
+                    metric = ''
 
                 netmap = route.get('nat_netmap')
                 if netmap:
                     network = netmap
 
-                if ':' in network:
-                    client_conf += 'iroute-ipv6 %s%s\n' % (
-                        network, metric_def)
+                if route['net_gateway']:
+                    if ':' in network:
+                        client_conf += \
+                            'push "route-ipv6 %s net_gateway%s"\n' % (
+                            network, metric)
+                    else:
+                        client_conf += \
+                            'push "route %s %s net_gateway%s"\n' % (
+                            utils.parse_network(network) + (metric,))
                 else:
-                    client_conf += 'iroute %s %s%s\n' % (
-                        utils.parse_network(network) + (metric_def,))
-        else:
-            if self.server.inactive_timeout:
-                client_conf += 'push "inactive %d"\n' % \
-                    self.server.inactive_timeout
+                    if ':' in network:
+                        client_conf += 'push "route-ipv6 %s%s"\n' % (
+                            network, metric_def)
+                    else:
+                        client_conf += 'push "route %s %s%s"\n' % (
+                            utils.parse_network(network) + (metric_def,))
 
-            if self.server.is_route_all():
-                client_conf += 'push "redirect-gateway def1"\n'
+            if link_svr.replicating and link_svr.vxlan:
+                client_conf += 'push "route %s %s"\n' % \
+                    utils.parse_network(vxlan.get_vxlan_net(link_svr.id))
+                if link_svr.ipv6:
+                    client_conf += 'push "route-ipv6 %s"\n' % \
+                        vxlan.get_vxlan_net6(link_svr.id)
 
-                if self.server.ipv6 or (settings.vpn.ipv6_route_all and (
-                        platform == 'android' or platform == 'ios')):
-                    if platform == 'chrome':
-                        client_conf += 'push "redirect-gateway ipv6"\n'
-                        client_conf += 'push "redirect-gateway-ipv6 def1"\n'
-                    else:
-                        client_conf += 'push "redirect-gateway ipv6"\n'
-                        client_conf += 'push "redirect-gateway-ipv6 def1"\n'
-                        client_conf += 'push "route-ipv6 2000::/3"\n'
+        if platform == 'android':
+            client_conf += 'push "route %s %s"\n' % (
+                utils.parse_network(self.server.network))
 
-            if self.server.dns_mapping:
-                client_conf += 'push "dhcp-option DNS %s"\n' % (
-                    utils.get_network_gateway(self.server.network))
+            if self.server.ipv6:
+                client_conf += 'push "route-ipv6 %s"\n' % (
+                    self.server.network6)
 
-            if not self.server.dns_mapping or \
-                    settings.vpn.dns_mapping_push_all:
-                for dns_server in self.server.dns_servers:
-                    client_conf += 'push "dhcp-option DNS %s"\n' % \
-                        dns_server
+        return client_conf
 
-            if self.server.search_domain:
-                for domain in self.server.search_domain.split(','):
-                    client_conf += 'push "dhcp-option DOMAIN %s"\n' % (
-                        domain.strip())
+    def generate_client_conf(self, platform, client_id, virt_address,
+            virt_address6, user, reauth):
+        if user.link_server_id:
+            return self._get_conf_cache(
+                ('link', user.link_server_id),
+                lambda: self._generate_link_client_conf(user.link_server_id),
+            )
 
-            network_links = user.get_network_links()
-            for network_link in network_links:
-                if self.reserve_iroute(client_id, network_link, True):
-                    if ':' in network_link:
-                        utils.add_route6(
-                            network_link,
-                            network_gateway6.split('/')[0],
-                            self.instance.interface,
-                        )
-                        client_conf += 'iroute-ipv6 %s\n' % network_link
-                    else:
-                        utils.add_route(
-                            network_link,
-                            network_gateway.split('/')[0],
-                            self.instance.interface,
-                        )
-                        client_conf += 'iroute %s %s\n' % \
-                            utils.parse_network(network_link)
+        network_gateway = utils.get_network_gateway(self.server.network)
+        network_gateway6 = utils.get_network_gateway(self.server.network6)
 
-            if network_links and not reauth:
-                thread = threading.Thread(target=self.iroute_ping_thread,
-                    args=(client_id, virt_address.split('/')[0]))
-                thread.daemon = True
-                thread.start()
+        client_conf = self._get_conf_cache(
+            ('head', platform),
+            lambda: self._generate_client_conf_head(platform),
+        )
 
-            for network_link in self.server.network_links:
+        network_links = user.get_network_links()
+        for network_link in network_links:
+            if self.reserve_iroute(client_id, network_link, True):
                 if ':' in network_link:
-                    client_conf += 'push "route-ipv6 %s"\n' % network_link
+                    utils.add_route6(
+                        network_link,
+                        network_gateway6.split('/')[0],
+                        self.instance.interface,
+                    )
+                    client_conf += 'iroute-ipv6 %s\n' % network_link
                 else:
-                    client_conf += 'push "route %s %s"\n' % (
-                        utils.parse_network(network_link))
-
-            for link_svr in self.server.iter_links():
-                for route in link_svr.get_routes(
-                        include_default=False):
-                    network = route['network']
-                    metric = route.get('metric')
-                    if metric:
-                        metric_def = ' default %s' % metric
-                        metric = ' %s' % metric
-                    else:
-                        metric_def = ''
-                        metric = ''
-
-                    netmap = route.get('nat_netmap')
-                    if netmap:
-                        network = netmap
-
-                    if route['net_gateway']:
-                        if ':' in network:
-                            client_conf += \
-                                'push "route-ipv6 %s net_gateway%s"\n' % (
-                                network, metric)
-                        else:
-                            client_conf += \
-                                'push "route %s %s net_gateway%s"\n' % (
-                                utils.parse_network(network) + (metric,))
-                    else:
-                        if ':' in network:
-                            client_conf += 'push "route-ipv6 %s%s"\n' % (
-                                network, metric_def)
-                        else:
-                            client_conf += 'push "route %s %s%s"\n' % (
-                                utils.parse_network(network) + (metric_def,))
-
-                if link_svr.replicating and link_svr.vxlan:
-                    client_conf += 'push "route %s %s"\n' % \
-                        utils.parse_network(vxlan.get_vxlan_net(link_svr.id))
-                    if link_svr.ipv6:
-                        client_conf += 'push "route-ipv6 %s"\n' % \
-                            vxlan.get_vxlan_net6(link_svr.id)
+                    utils.add_route(
+                        network_link,
+                        network_gateway.split('/')[0],
+                        self.instance.interface,
+                    )
+                    client_conf += 'iroute %s %s\n' % \
+                        utils.parse_network(network_link)
 
-            if platform == 'android':
-                client_conf += 'push "route %s %s"\n' % (
-                    utils.parse_network(self.server.network))
+        if network_links and not reauth:
+            thread = threading.Thread(target=self.iroute_ping_thread,
+                args=(client_id, virt_address.split('/')[0]))
+            thread.daemon = True
+            thread.start()
 
-                if self.server.ipv6:
-                    client_conf += 'push "route-ipv6 %s"\n' % (
-                        self.server.network6)
+        client_conf += self._get_conf_cache(
+            ('tail', platform),
+            lambda: self._generate_client_conf_tail(platform),
+        )
 
         return client_conf
 
@@ -472,6 +537,64 @@ class Clients(object):
 
         return reserved
 
+    def kill_client(self, client_id):
+        if len(client_id) > 32:
+            self.instance.disconnect_wg(client_id)
+        else:
+            self.instance_com.client_kill(client_id)
+
+    def reconnect_user(self, user_id, callback, *args):
+        if self.server.replicating:
+            # if self.server.route_clients:
+            #     docs = self.collection.find({
+            #         'user_id': user_id,
+            #         'server_id': self.server.id,
+            #     })
+            #
+            #     for doc in docs:
+            #         messenger.publish('client', {
+            #             'state': False,
+            #             'server_id': self.server.id,
+            #             'virt_address': doc['virt_address'],
+            #             'virt_address6': doc['virt_address6'],
+            #             'host_address': doc['host_address'],
+            #             'host_address6': doc['host_address6'],
+            #         })
+
+            messenger.publish('instance', [
+                'user_reconnect',
+                user_id,
+                settings.local.host_id,
+                self.server.id,
+            ])
+
+        client_ids = [x['id'] for x in self.clients.find({
+            'user_id': user_id,
+        })]
+        if not client_ids:
+            callback(*args)
+            return
+
+        # Existing clients are killed 2 seconds apart without blocking
+        # the call queue, the callback runs after the last kill to keep
+        # the single device limit
+        def kill(i):
+            try:
+                self.kill_client(client_ids[i])
+            except:
+                logger.exception('Failed to kill client', 'clients',
+                    server_id=self.server.id,
+                    instance_id=self.instance.id,
+                    client_id=client_ids[i],
+                )
+
+            if i + 1 < len(client_ids):
+                scheduler.call_later(2, kill, i + 1)
+            else:
+                self.call_queue.put(callback, *args)
+
+        scheduler.call_later(2, kill, 0)
+
     def remove_iroutes(self, client_id):
         primary_reconnect = set()
         secondary_reconnect = set()
@@ -499,19 +622,13 @@ class Clients(object):
             self.iroutes_lock.release()
 
         for client_id in primary_reconnect:
-            if len(client_id) > 32:
-                self.instance.disconnect_wg(client_id)
-            else:
-                self.instance_com.client_kill(client_id)
-
-        if primary_reconnect:
-            time.sleep(5)
+            self.kill_client(client_id)
 
         for client_id in secondary_reconnect:
-            if len(client_id) > 32:
-                self.instance.disconnect_wg(client_id)
+            if primary_reconnect:
+                scheduler.call_later(5, self.kill_client, client_id)
             else:
-                self.instance_com.client_kill(client_id)
+                self.kill_client(client_id)
 
         if primary_reconnect or secondary_reconnect:
             self.instance_com.push_output('Gateway link ' +
@@ -853,38 +970,6 @@ class Clients(object):
                     'Too many devices')
                 return
 
-            if not self.server.multi_device:
-                if self.server.replicating:
-                    # if self.server.route_clients:
-                    #     docs = self.collection.find({
-                    #         'user_id': user_id,
-                    #         'server_id': self.server.id,
-                    #     })
-                    #
-                    #     for doc in docs:
-                    #         messenger.publish('client', {
-                    #             'state': False,
-                    #             'server_id': self.server.id,
-                    #             'virt_address': doc['virt_address'],
-                    #             'virt_address6': doc['virt_address6'],
-                    #             'host_address': doc['host_address'],
-                    #             'host_address6': doc['host_address6'],
-                    #         })
-
-                    messenger.publish('instance', [
-                        'user_reconnect',
-                        user_id,
-                        settings.local.host_id,
-                        self.server.id,
-                    ])
-
-                for clnt in self.clients.find({'user_id': user_id}):
-                    time.sleep(2)
-                    if len(clnt['id']) > 32:
-                        self.instance.disconnect_wg(clnt['id'])
-                    else:
-                        self.instance_com.client_kill(clnt['id'])
-
             if not virt_address:
                 self.instance_com.send_client_deny(client_id, key_id,
                     'Unable to assign ip address')
@@ -999,22 +1084,6 @@ class Clients(object):
                 self.instance.disconnect_wg(wg_public_key)
                 return False, 'Too many devices'
 
-            if not self.server.multi_device:
-                if self.server.replicating:
-                    messenger.publish('instance', [
-                        'user_reconnect',
-                        user_id,
-                        settings.local.host_id,
-                        self.server.id,
-                    ])
-
-                for clnt in self.clients.find({'user_id': user_id}):
-                    time.sleep(2)
-                    if len(clnt['id']) > 32:
-                        self.instance.disconnect_wg(clnt['id'])
-                    else:
-                        self.instance_com.client_kill(clnt['id'])
-
             if not virt_address:
                 self.instance.disconnect_wg(wg_public_key)
                 return False, 'Unable to assign ip address'
@@ -1224,7 +1293,7 @@ class Clients(object):
                     'User is not valid')
                 return
 
-            def callback(allow, reason=None):
+            def respond(allow, reason=None):
                 try:
                     if allow:
                         self.allow_client(client_data, org, user, reauth)
@@ -1270,6 +1339,21 @@ class Clients(object):
                         instance_id=self.instance.id,
                     )
 
+            def callback(allow, reason=None):
+                if not allow or reauth or self.server.multi_device:
+                    respond(allow, reason)
+                    return
+
+                try:
+                    self.reconnect_user(user_id, respond, allow, reason)
+                except:
+                    logger.exception(
+                        'Error reconnecting user', 'server',
+                        server_id=self.server.id,
+                        instance_id=self.instance.id,
+                    )
+                    respond(False, 'exception')
+
             auth = authorizer.Authorizer(
                 svr=self.server,
                 usr=user,
@@ -1327,12 +1411,10 @@ class Clients(object):
             if connect_callback_once(False, 'Authorization timed out'):
                 self.instance.disconnect_wg(wg_public_key)
 
-        thread = threading.Timer(30, timeout_callback)
-        thread.daemon = True
-        thread.start()
+        thread = scheduler.call_later(30, timeout_callback)
 
         try:
-            def callback(allow, reason=None):
+            def respond(allow, reason=None):
                 try:
                     if allow:
                         allow, data = self.allow_client_wg(
@@ -1391,6 +1473,21 @@ class Clients(object):
                         instance_id=self.instance.id,
                     )
 
+            def callback(allow, reason=None):
+                if not allow or self.server.multi_device:
+                    respond(allow, reason)
+                    return
+
+                try:
+                    self.reconnect_user(user.id, respond, allow, reason)
+                except:
+                    logger.exception(
+                        'Error reconnecting user', 'server',
+                        server_id=self.server.id,
+                        instance_id=self.instance.id,
+                    )
+                    respond(False, 'exception')
+
             auth = authorizer.Authorizer(
                 svr=self.server,
                 usr=user,
@@ -1468,8 +1565,21 @@ class Clients(object):
 
         client_addr = virt_address.split('/')[0]
         client_addr6 = virt_address6.split('/')[0]
-
-        if usr.client_to_client:
+        iptables = self.instance.iptables
+
+        if usr.client_to_client and iptables.ipset:
+            rules.append([
+                'ipset',
+                iptables.ipset_name('cc'),
+                client_addr,
+            ])
+            if self.server.ipv6:
+                rules6.append([
+                    'ipset',
+                    iptables.ipset_name('cc', True),
+                    client_addr6,
+                ])
+        elif usr.client_to_client:
             for chain in ('INPUT', 'OUTPUT', 'FORWARD'):
                 rules.append([
                     chain,
@@ -1545,17 +1655,30 @@ class Clients(object):
             '--comment', 'pritunl-%s' % self.server.id,
         ]
 
-        forward2_base_rule = [
-            'FORWARD',
-            '-s', client_addr,
-            '-i', self.instance.interface,
-            '-m', 'conntrack',
-            '--ctstate','RELATED,ESTABLISHED',
-            '-j', 'ACCEPT',
-        ] + extra_args
-        rules.append(forward2_base_rule)
-        if self.server.ipv6:
-            rules6.append(forward2_base_rule)
+        if iptables.ipset:
+            rules.append([
+                'ipset',
+                iptables.ipset_name('pf'),
+                client_addr,
+            ])
+            if self.server.ipv6:
+                rules6.append([
+                    'ipset',
+                    iptables.ipset_name('pf', True),
+                    client_addr6,
+                ])
+        else:
+            forward2_base_rule = [
+                'FORWARD',
+                '-s', client_addr,
+                '-i', self.instance.interface,
+                '-m', 'conntrack',
+                '--ctstate','RELATED,ESTABLISHED',
+                '-j', 'ACCEPT',
+            ] + extra_args
+            rules.append(forward2_base_rule)
+            if self.server.ipv6:
+                rules6.append(forward2_base_rule)
 
         for data in usr.port_forwarding:
             proto = data.get('protocol')
@@ -1617,6 +1740,22 @@ class Clients(object):
                     rules6.append(rule)
 
 
+                if iptables.ipset:
+                    forward_port = '%s:%s' % (
+                        proto, (port or dport).replace(':', '-'))
+                    rules.append([
+                        'ipset',
+                        iptables.ipset_name('pfp'),
+                        '%s,%s' % (client_addr, forward_port),
+                    ])
+                    if self.server.ipv6:
+                        rules6.append([
+                            'ipset',
+                            iptables.ipset_name('pfp', True),
+                            '%s,%s' % (client_addr6, forward_port),
+                        ])
+                    continue
+
                 rule = forward_base_args + [
                     '-p', proto,
                     '-m', proto,
@@ -1634,6 +1773,7 @@ class Clients(object):
 
         client_addr = virt_address.split('/')[0]
         client_addr6 = virt_address6.split('/')[0]
+        iptables = self.instance.iptables
 
         if not usr.port_forwarding:
             return rules, rules6
@@ -1664,17 +1804,30 @@ class Clients(object):
             '--comment', 'pritunl-%s' % self.server.id,
         ]
 
-        forward2_base_rule = [
-            'FORWARD',
-            '-s', client_addr,
-            '-i', self.instance.interface_wg,
-            '-m', 'conntrack',
-            '--ctstate','RELATED,ESTABLISHED',
-            '-j', 'ACCEPT',
-        ] + extra_args
-        rules.append(forward2_base_rule)
-        if self.server.ipv6:
-            rules6.append(forward2_base_rule)
+        if iptables.ipset:
+            rules.append([
+                'ipset',
+                iptables.ipset_name('pf'),
+                client_addr,
+            ])
+            if self.server.ipv6:
+                rules6.append([
+                    'ipset',
+                    iptables.ipset_name('pf', True),
+                    client_addr6,
+                ])
+        else:
+            forward2_base_rule = [
+                'FORWARD',
+                '-s', client_addr,
+                '-i', self.instance.interface_wg,
+                '-m', 'conntrack',
+                '--ctstate','RELATED,ESTABLISHED',
+                '-j', 'ACCEPT',
+            ] + extra_args
+            rules.append(forward2_base_rule)
+            if self.server.ipv6:
+                rules6.append(forward2_base_rule)
 
         for data in usr.port_forwarding:
             proto = data.get('protocol')
@@ -1736,6 +1889,22 @@ class Clients(object):
                     rules6.append(rule)
 
 
+                if iptables.ipset:
+                    forward_port = '%s:%s' % (
+                        proto, (port or dport).replace(':', '-'))
+                    rules.append([
+                        'ipset',
+                        iptables.ipset_name('pfp'),
+                        '%s,%s' % (client_addr, forward_port),
+                    ])
+                    if self.server.ipv6:
+                        rules6.append([
+                            'ipset',
+                            iptables.ipset_name('pfp', True),
+                            '%s,%s' % (client_addr6, forward_port),
+                        ])
+                    continue
+
                 rule = forward_base_args + [
                     '-p', proto,
                     '-m', proto,
@@ -1750,17 +1919,13 @@ class Clients(object):
     def set_iptables_rules(self, rules, rules6):
         if rules or rules6:
             self.instance.enable_iptables_tun_nat()
-            for rule in rules:
-                self.instance.iptables.add_rule(rule)
-            for rule6 in rules6:
-                self.instance.iptables.add_rule6(rule6)
+            self.instance.iptables.add_rules(rules)
+            self.instance.iptables.add_rules(rules6, ipv6=True)
 
     def clear_iptables_rules(self, rules, rules6):
         if rules or rules6:
-            for rule in rules:
-                self.instance.iptables.remove_rule(rule)
-            for rule6 in rules6:
-                self.instance.iptables.remove_rule6(rule6)
+            self.instance.iptables.remove_rules(rules)
+            self.instance.iptables.remove_rules(rules6, ipv6=True)
 
     def _connected(self, client_id):
         client = self.clients.find_id(client_id)
@@ -2371,9 +2536,22 @@ class Clients(object):
 
             utils.del_route6(virt_address6)
 
+    def on_event(self, event_type, resource_id):
+        if event_type not in (SERVER_ROUTES_UPDATED, SERVER_LINKS_UPDATED):
+            return
+
+        # Tail configs include the routes of linked servers
+        if resource_id == self.server.id or \
+                resource_id in self.conf_link_ids or \
+                ('link', resource_id) in self.conf_cache or \
+                any(x.get('server_id') == resource_id
+                    for x in self.server.links):
+            self.clear_conf_cache()
+
     def start(self):
         _port_listeners[self.instance.id] = self.on_port_forwarding
         _client_listeners[self.instance.id] = self.on_client
+        _event_listeners[self.instance.id] = self.on_event
         host.global_servers.add(self.instance.id)
 
         if self.server.dns_mapping:
@@ -2388,6 +2566,7 @@ class Clients(object):
     def stop(self):
         _port_listeners.pop(self.instance.id, None)
         _client_listeners.pop(self.instance.id, None)
+        _event_listeners.pop(self.instance.id, None)
 
         try:
             host.global_servers.remove(self.instance.id)
@@ -2423,3 +2602,8 @@ def on_client(msg):
             msg['message']['host_address'],
             msg['message']['host_address6'],
         )
+
+def on_event(msg):
+    event_type, resource_id = msg['message']
+    for listener in _event_listeners.values():
+        listener(event_type, resource_id)
@@ -3,8 +3,19 @@ from pritunl import messenger
 from pritunl import utils
 
 import time
+import threading
+import collections
+
+HUB_BUFFER = 2048
 
 event_queue = utils.NoneQueue()
+_hub_cond = threading.Condition()
+_hub_running = False
+_hub_floor = None
+_hub_floor_seq = 0
+_hub_seq = 0
+_hub_buffer = collections.deque()
+_hub_ids = {}
 
 class Event(object):
     def __init__(self, type, resource_id=None, delay=None):
@@ -15,15 +26,133 @@ class Event(object):
 
         messenger.publish('events', (type, resource_id))
 
-def get_events(cursor=None, yield_app_server=False):
+def hub_reset(cursor_id):
+    global _hub_running
+    global _hub_floor
+    global _hub_floor_seq
+
+    _hub_cond.acquire()
+    try:
+        _hub_running = True
+        _hub_floor = cursor_id
+        _hub_floor_seq = _hub_seq
+        _hub_buffer.clear()
+        _hub_ids.clear()
+        _hub_cond.notify_all()
+    finally:
+        _hub_cond.release()
+
+def hub_stop():
+    global _hub_running
+
+    _hub_cond.acquire()
+    try:
+        _hub_running = False
+        _hub_cond.notify_all()
+    finally:
+        _hub_cond.release()
+
+def hub_dispatch(doc):
+    global _hub_floor
+    global _hub_floor_seq
+    global _hub_seq
+
+    if doc.get('message') is None:
+        return
+
+    _hub_cond.acquire()
+    try:
+        if doc['_id'] in _hub_ids:
+            return
+
+        # Message ids are generated on the publishing host and do not
+        # follow publish order with redis, buffered docs are ordered by
+        # arrival instead
+        if len(_hub_buffer) >= HUB_BUFFER:
+            seq, old_doc = _hub_buffer.popleft()
+            _hub_ids.pop(old_doc['_id'], None)
+            _hub_floor = old_doc['_id']
+            _hub_floor_seq = seq
+
+        _hub_seq += 1
+        _hub_buffer.append((_hub_seq, doc))
+        _hub_ids[doc['_id']] = _hub_seq
+        _hub_cond.notify_all()
+    finally:
+        _hub_cond.release()
+
+def _hub_collect(cursor):
+    if not _hub_running:
+        return None
+
+    if cursor == _hub_floor:
+        cursor_seq = _hub_floor_seq
+    else:
+        cursor_seq = _hub_ids.get(cursor)
+        if cursor_seq is None:
+            return None
+
+    docs = []
+    for seq, doc in reversed(_hub_buffer):
+        if seq <= cursor_seq:
+            break
+        docs.append(doc)
+    docs.reverse()
+    return docs
+
+def _hub_get_events(cursor, timeout, yield_delay, yield_app_server):
+    start = time.time()
+
+    _hub_cond.acquire()
+    try:
+        if not _hub_running:
+            return None
+
+        if cursor is None:
+            if _hub_buffer:
+                cursor = _hub_buffer[-1][1]['_id']
+            elif _hub_floor is not None:
+                cursor = _hub_floor
+            else:
+                return None
+
+        docs = _hub_collect(cursor)
+        if docs is None:
+            return None
+
+        while not docs:
+            remaining = timeout - (time.time() - start)
+            if remaining <= 0 or check_global_interrupt():
+                break
+            if yield_app_server and check_app_server_interrupt():
+                break
+
+            _hub_cond.wait(min(remaining, 0.5))
+
+            docs = _hub_collect(cursor)
+            if docs is None:
+                return None
+
+        if docs and yield_delay:
+            _hub_cond.release()
+            try:
+                time.sleep(yield_delay)
+            finally:
+                _hub_cond.acquire()
+
+            docs = _hub_collect(cursor)
+            if docs is None:
+                return None
+    finally:
+        _hub_cond.release()
+
+    return [doc.copy() for doc in docs]
+
+def _format_events(docs):
     events = []
     events_dict = {}
 
-    if yield_app_server and check_app_server_interrupt():
-        return events
-
-    for event in messenger.subscribe('events', cursor_id=cursor,
-            timeout=10, yield_delay=0.02, yield_app_server=yield_app_server):
+    for event in docs:
         event_type, resource_id = event.pop('message')
         if (event_type, resource_id) in events_dict:
             old_event = events_dict[(event_type, resource_id)]
@@ -42,3 +171,14 @@ def get_events(cursor=None, yield_app_server=False):
         events.append(event)
 
     return events
+
+def get_events(cursor=None, yield_app_server=False):
+    if yield_app_server and check_app_server_interrupt():
+        return []
+
+    docs = _hub_get_events(cursor, 10, 0.02, yield_app_server)
+    if docs is None:
+        docs = messenger.subscribe('events', cursor_id=cursor,
+            timeout=10, yield_delay=0.02, yield_app_server=yield_app_server)
+
+    return _format_events(docs)
@@ -8,6 +8,9 @@ class BaseError(Exception):
 class PluginMissing(BaseError):
     pass
 
+class PluginTimeout(BaseError):
+    pass
+
 
 class ServerStop(BaseError):
     pass
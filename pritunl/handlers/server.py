@@ -81,8 +81,7 @@ def _check_network_private(test_network):
     test_start = test_net.network
     test_end = test_net.broadcast
 
-    for network in settings.vpn.safe_priv_subnets:
-        network = ipaddress.IPNetwork(network)
+    for network in utils.get_safe_priv_subnets():
         net_start = network.network
         net_end = network.broadcast
 
@@ -5,6 +5,10 @@ from pritunl import organization
 from pritunl import app
 from pritunl import auth
 from pritunl import mongo
+from pritunl import plugins
+from pritunl import sso
+from pritunl import transaction
+from pritunl import tombstone
 from pritunl import __version__
 
 @app.app.route('/status', methods=['GET'])
@@ -118,3 +122,33 @@ def status_get():
     if settings.app.demo_mode:
         utils.demo_set_cache(resp)
     return utils.jsonify(resp)
+
+@app.app.route('/status/plugins', methods=['GET'])
+@auth.session_auth
+def status_plugins_get():
+    return utils.jsonify(plugins.get_stats())
+
+@app.app.route('/status/auth', methods=['GET'])
+@auth.session_auth
+def status_auth_get():
+    return utils.jsonify(auth.get_cache_stats())
+
+@app.app.route('/status/sso', methods=['GET'])
+@auth.session_auth
+def status_sso_get():
+    return utils.jsonify(sso.get_stats())
+
+@app.app.route('/status/proc', methods=['GET'])
+@auth.session_auth
+def status_proc_get():
+    return utils.jsonify(utils.get_proc_stats())
+
+@app.app.route('/status/transaction', methods=['GET'])
+@auth.session_auth
+def status_transaction_get():
+    return utils.jsonify(transaction.get_stats())
+
+@app.app.route('/status/gc', methods=['GET'])
+@auth.session_auth
+def status_gc_get():
+    return utils.jsonify(tombstone.get_stats())
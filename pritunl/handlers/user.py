@@ -269,7 +269,7 @@ def _create_user(users, org, user_data, remote_addr, pool):
                 'error_msg': PIN_TOO_SHORT_MSG,
             }, 400)
 
-        pin = auth.generate_hash_pin_v2(pin)
+        pin = auth.generate_hash_pin_v3(pin)
 
     if bypass_secondary:
         if pin:
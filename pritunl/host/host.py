@@ -8,6 +8,7 @@ from pritunl import mongo
 from pritunl import logger
 from pritunl import event
 from pritunl import journal
+from pritunl import tombstone
 
 class Host(mongo.MongoObject):
     fields = {
@@ -200,4 +201,5 @@ class Host(mongo.MongoObject):
         self.user_collection.remove({
             'resource_id': self.id,
         })
+        tombstone.add(tombstone.HOST, self.id)
         mongo.MongoObject.remove(self)
@@ -4,13 +4,15 @@ from pritunl.helpers import *
 from pritunl import settings
 from pritunl import mongo
 from pritunl import utils
+from pritunl import rollup
 
-import pymongo
 import os
 import json
 import random
 import datetime
 
+_rollup = rollup.Rollup('hosts_usage', 'host_id')
+
 class HostUsage(object):
     def __init__(self, host_id):
         self.host_id = host_id
@@ -23,96 +25,52 @@ class HostUsage(object):
         cpu_usage = round(cpu_usage, 4)
         mem_usage = round(mem_usage, 4)
 
-        bulk = self.collection.initialize_unordered_bulk_op()
-
-        for period in ('1m', '5m', '30m', '2h', '1d'):
-            spec = {
-                'host_id': self.host_id,
-                'period': period,
-                'timestamp': usage_utils.get_period_timestamp(
-                    period, timestamp),
-            }
-            doc = {'$inc': {
-                'count': 1,
-                'cpu': cpu_usage,
-                'mem': mem_usage,
-            }}
-            rem_spec = {
-                'host_id': self.host_id,
-                'period': period,
-                'timestamp': {
-                    '$lt': usage_utils.get_period_max_timestamp(
-                        period, timestamp),
-                },
-            }
-
-            bulk.find(spec).upsert().update(doc)
-            bulk.find(rem_spec).remove()
-
-        bulk.execute()
+        _rollup.add(self.host_id, timestamp, {
+            'count': 1,
+            'cpu': cpu_usage,
+            'mem': mem_usage,
+        })
 
     def get_period(self, period):
         date_end = usage_utils.get_period_timestamp(period, utils.now())
+        date_start = date_end - rollup.PERIOD_RANGES[period][0]
 
-        if period == '1m':
-            date_start = date_end - datetime.timedelta(hours=6)
-            date_step = datetime.timedelta(minutes=1)
-        elif period == '5m':
-            date_start = date_end - datetime.timedelta(days=1)
-            date_step = datetime.timedelta(minutes=5)
-        elif period == '30m':
-            date_start = date_end - datetime.timedelta(days=7)
-            date_step = datetime.timedelta(minutes=30)
-        elif period == '2h':
-            date_start = date_end - datetime.timedelta(days=30)
-            date_step = datetime.timedelta(hours=2)
-        elif period == '1d':
-            date_start = date_end - datetime.timedelta(days=365)
-            date_step = datetime.timedelta(days=1)
-        date_cur = date_start
-
-        data = {
-            'cpu': [],
-            'mem': [],
+        spec = {
+            'host_id': self.host_id,
+            'period': period,
+            'timestamp': {'$gte': date_start},
+        }
+        project = {
+            '_id': False,
+            'timestamp': True,
+            'count': True,
+            'cpu': True,
+            'mem': True,
         }
 
-        results = self.collection.aggregate([
-            {'$match': {
-                'host_id': self.host_id,
-                'period': period,
-            }},
-            {'$project': {
-                'timestamp': True,
-                'cpu': {'$divide': ['$cpu', '$count']},
-                'mem': {'$divide': ['$mem', '$count']},
-            }},
-            {'$sort': {
-                'timestamp': pymongo.ASCENDING,
-            }}
-        ])
-
-        for doc in results:
-            if date_cur > doc['timestamp']:
-                continue
-
-            while date_cur < doc['timestamp']:
-                timestamp = int(date_cur.strftime('%s'))
-                data['cpu'].append((timestamp, 0))
-                data['mem'].append((timestamp, 0))
-                date_cur += date_step
-
-            timestamp = int(doc['timestamp'].strftime('%s'))
-            data['cpu'].append((timestamp, doc['cpu']))
-            data['mem'].append((timestamp, doc['mem']))
-            date_cur += date_step
-
-        while date_cur <= date_end:
-            timestamp = int(date_cur.strftime('%s'))
-            data['cpu'].append((timestamp, 0))
-            data['mem'].append((timestamp, 0))
-            date_cur += date_step
-
-        return data
+        points = {}
+        for doc in self.collection.find(spec, project):
+            points[doc['timestamp']] = doc
+
+        pending = _rollup.get_pending(self.host_id, period)
+        if pending:
+            timestamp, values = pending
+            doc = points.setdefault(timestamp, {
+                'count': 0,
+                'cpu': 0,
+                'mem': 0,
+            })
+            doc['count'] += values.get('count', 0)
+            doc['cpu'] += values.get('cpu', 0)
+            doc['mem'] += values.get('mem', 0)
+
+        for doc in points.itervalues():
+            count = doc['count'] or 1
+            doc['cpu'] /= float(count)
+            doc['mem'] /= float(count)
+
+        return rollup.get_series(period, date_end, points.iteritems(),
+            ('cpu', 'mem'))
 
     def get_period_random(self, period):
         date = utils.now()
@@ -10,6 +10,7 @@ from pritunl import logger
 from pritunl import mongo
 
 import collections
+import threading
 import random
 import socket
 import math
@@ -182,5 +183,70 @@ def deinit():
 
     logger.LogEntry(message='Web server stopped.')
 
+_placements = collections.defaultdict(list)
+_placements_lock = threading.Lock()
+
+def _get_host_load(doc, pending):
+    return (doc.get('cpu_usage') or 0) * settings.vpn.placement_cpu_weight + \
+        (doc.get('mem_usage') or 0) * settings.vpn.placement_mem_weight + \
+        ((doc.get('server_count') or 0) + pending) * \
+            settings.vpn.placement_server_weight + \
+        (doc.get('device_count') or 0) * \
+            settings.vpn.placement_device_weight
+
+def _get_pending_placements(host_id, ping_timestamp):
+    # Placements made after the last host ping are not yet included in the
+    # reported server count
+    placements = _placements.get(host_id)
+    if not placements:
+        return 0
+
+    if ping_timestamp:
+        placements[:] = [x for x in placements if x > ping_timestamp]
+    if not placements:
+        _placements.pop(host_id, None)
+    return len(placements)
+
 def get_prefered_hosts(hosts, replica_count):
-    return random.sample(hosts, min(replica_count, len(hosts)))
+    replica_count = min(replica_count, len(hosts))
+    if not replica_count:
+        return []
+
+    loads = {}
+    docs = list(Host.collection.find({
+        '_id': {'$in': list(hosts)},
+        'status': ONLINE,
+    }, {
+        '_id': True,
+        'cpu_usage': True,
+        'mem_usage': True,
+        'server_count': True,
+        'device_count': True,
+        'ping_timestamp': True,
+    }))
+
+    if not docs:
+        return random.sample(hosts, replica_count)
+
+    _placements_lock.acquire()
+    try:
+        for doc in docs:
+            loads[doc['_id']] = _get_host_load(doc, _get_pending_placements(
+                doc['_id'], doc.get('ping_timestamp')))
+
+        # Shuffle first so equally loaded hosts are picked at random,
+        # offline hosts are only used to fill remaining replicas
+        hosts = random.sample(hosts, len(hosts))
+        hosts.sort(key=lambda x: (x not in loads, loads.get(x, 0)))
+        prefered_hosts = hosts[:replica_count]
+
+        # Count the placement locally until the host reports its own
+        # server count so concurrent starts spread across hosts
+        timestamp = utils.now()
+        for host_id in prefered_hosts:
+            if host_id in loads:
+                _placements[host_id].append(timestamp)
+    finally:
+        _placements_lock.release()
+
+    return prefered_hosts
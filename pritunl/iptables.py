@@ -7,6 +7,8 @@ import subprocess
 import time
 import threading
 import collections
+import hashlib
+import shlex
 try:
     import iptc
     LIB_IPTABLES = True
@@ -44,6 +46,9 @@ class Iptables(object):
         self.ipv6 = False
         self.cleared = False
         self.restrict_routes = False
+        self.ipset = False
+        self._ipsets = []
+        self._fingerprints = {}
 
     def add_route(self, network, nat=False, nat_interface=None):
         if self.cleared:
@@ -75,10 +80,100 @@ class Iptables(object):
     def add_netmap(self, network, mapping):
         self._netmaps[mapping] = network
 
+    def ipset_name(self, kind, ipv6=False):
+        return 'pritunl_%s%s_%s' % (kind, '6' if ipv6 else '',
+            str(self.id)[-12:])
+
+    def _ipset_cmd(self, args):
+        _global_lock.acquire()
+        try:
+            utils.check_output_logged(['ipset'] + args)
+        finally:
+            _global_lock.release()
+
+    def _ipset_batch(self, action, rules):
+        if len(rules) == 1:
+            self._ipset_cmd([action, rules[0][1], rules[0][2], '-exist'])
+            return
+
+        _global_lock.acquire()
+        try:
+            utils.ipset_restore(['%s %s %s' % (action, x[1], x[2])
+                for x in rules])
+        finally:
+            _global_lock.release()
+
+    def _ipset_create(self, name, set_type, ipv6=False):
+        self._ipset_cmd([
+            'create', name, set_type,
+            'family', 'inet6' if ipv6 else 'inet',
+            '-exist',
+        ])
+        self._ipsets.append(name)
+
+    def init_ipsets(self):
+        if self.cleared or not self.ipset:
+            return
+
+        families = [(False, self.virt_network, self.add_rule)]
+        if self.ipv6:
+            families.append((True, self.virt_network6, self.add_rule6))
+
+        for ipv6, network, add_rule in families:
+            client_set = self.ipset_name('cc', ipv6)
+            forward_set = self.ipset_name('pf', ipv6)
+            forward_port_set = self.ipset_name('pfp', ipv6)
+
+            self._ipset_create(client_set, 'hash:ip', ipv6)
+            self._ipset_create(forward_set, 'hash:ip', ipv6)
+            self._ipset_create(forward_port_set, 'hash:ip,port', ipv6)
+
+            # Rules are inserted at the top of the chain in reverse order
+            for chain in ('INPUT', 'OUTPUT', 'FORWARD'):
+                add_rule([
+                    chain,
+                    '-m', 'set', '--match-set', client_set, 'dst',
+                    '-j', 'DROP',
+                ])
+                add_rule([
+                    chain,
+                    '-m', 'set', '--match-set', client_set, 'src',
+                    '-j', 'DROP',
+                ])
+                add_rule([
+                    chain,
+                    '-m', 'set', '--match-set', client_set, 'dst',
+                    '-s', network,
+                    '-j', 'ACCEPT',
+                ])
+                add_rule([
+                    chain,
+                    '-m', 'set', '--match-set', client_set, 'src',
+                    '-d', network,
+                    '-j', 'ACCEPT',
+                ])
+
+            add_rule([
+                'FORWARD',
+                '-m', 'set', '--match-set', forward_port_set, 'dst,dst',
+                '-j', 'ACCEPT',
+            ])
+            add_rule([
+                'FORWARD',
+                '-m', 'set', '--match-set', forward_set, 'src',
+                '-m', 'conntrack',
+                '--ctstate', 'RELATED,ESTABLISHED',
+                '-j', 'ACCEPT',
+            ])
+
     def add_rule(self, rule):
         if self.cleared:
             return
 
+        if rule[0] == 'ipset':
+            self._ipset_cmd(['add', rule[1], rule[2], '-exist'])
+            return
+
         self._lock.acquire()
         try:
             self._other.append(rule)
@@ -91,6 +186,10 @@ class Iptables(object):
         if self.cleared:
             return
 
+        if rule[0] == 'ipset':
+            self._ipset_cmd(['add', rule[1], rule[2], '-exist'])
+            return
+
         self._lock.acquire()
         try:
             self._other6.append(rule)
@@ -103,6 +202,10 @@ class Iptables(object):
         if self.cleared:
             return
 
+        if rule[0] == 'ipset':
+            self._ipset_cmd(['del', rule[1], rule[2], '-exist'])
+            return
+
         self._lock.acquire()
         try:
             self._other.remove(rule)
@@ -118,6 +221,10 @@ class Iptables(object):
         if self.cleared:
             return
 
+        if rule[0] == 'ipset':
+            self._ipset_cmd(['del', rule[1], rule[2], '-exist'])
+            return
+
         self._lock.acquire()
         try:
             self._other6.remove(rule)
@@ -129,6 +236,76 @@ class Iptables(object):
         finally:
             self._lock.release()
 
+    def add_rules(self, rules, ipv6=False):
+        if self.cleared or not rules:
+            return
+
+        ipset_rules = [x for x in rules if x[0] == 'ipset']
+        rules = [x for x in rules if x[0] != 'ipset']
+
+        if ipset_rules:
+            self._ipset_batch('add', ipset_rules)
+
+        if not rules:
+            return
+
+        if settings.vpn.lib_iptables and LIB_IPTABLES:
+            for rule in rules:
+                if ipv6:
+                    self.add_rule6(rule)
+                else:
+                    self.add_rule(rule)
+            return
+
+        self._lock.acquire()
+        try:
+            if ipv6:
+                self._other6.extend(rules)
+            else:
+                self._other.extend(rules)
+
+            _, present = self._snapshot_rules(ipv6)
+            self._batch_iptables_rules_cmd('-I',
+                self._get_missing_rules(rules, present), ipv6)
+        finally:
+            self._lock.release()
+
+    def remove_rules(self, rules, ipv6=False):
+        if self.cleared or not rules:
+            return
+
+        ipset_rules = [x for x in rules if x[0] == 'ipset']
+        rules = [x for x in rules if x[0] != 'ipset']
+
+        if ipset_rules:
+            self._ipset_batch('del', ipset_rules)
+
+        if not rules:
+            return
+
+        if settings.vpn.lib_iptables and LIB_IPTABLES:
+            for rule in rules:
+                if ipv6:
+                    self.remove_rule6(rule)
+                else:
+                    self.remove_rule(rule)
+            return
+
+        self._lock.acquire()
+        try:
+            other = self._other6 if ipv6 else self._other
+            for rule in rules:
+                try:
+                    other.remove(rule)
+                except ValueError:
+                    logger.warning('Lost %s rule' % (
+                        'ip6tables' if ipv6 else 'iptables'), 'iptables',
+                        rule=rule,
+                    )
+            self._batch_iptables_rules_cmd('-D', rules, ipv6)
+        finally:
+            self._lock.release()
+
     def _generate_input(self):
         if self._accept_all:
             if settings.vpn.lib_iptables and LIB_IPTABLES:
@@ -1066,6 +1243,72 @@ class Iptables(object):
         finally:
             _global_lock.release()
 
+    def _restore_iptables_rules_cmd(self, action, rules, ipv6=False):
+        tables = collections.OrderedDict()
+
+        for rule in rules:
+            rule = self._parse_rule(rule)
+            table = 'filter'
+            args = []
+
+            i = 1
+            while i < len(rule):
+                if rule[i] == '-t':
+                    table = rule[i + 1]
+                    i += 2
+                    continue
+                arg = rule[i]
+                if not arg or ' ' in arg or '"' in arg:
+                    arg = '"%s"' % arg.replace('"', '\\"')
+                args.append(arg)
+                i += 1
+
+            tables.setdefault(table, []).append(
+                ' '.join([action, rule[0]] + args))
+
+        # Each table is restored on its own so a failed table can be
+        # retried rule by rule without duplicating committed tables
+        failed = []
+        for table, lines in tables.items():
+            _global_lock.acquire()
+            try:
+                utils.iptables_restore(
+                    ['*' + table] + lines + ['COMMIT'],
+                    ipv6=ipv6,
+                    timeout=settings.vpn.iptables_restore_timeout,
+                )
+            except subprocess.CalledProcessError:
+                failed.append(table)
+            finally:
+                _global_lock.release()
+
+        return failed
+
+    def _batch_iptables_rules_cmd(self, action, rules, ipv6=False):
+        if not rules:
+            return
+
+        if len(rules) > 1:
+            failed = self._restore_iptables_rules_cmd(action, rules, ipv6)
+            if not failed:
+                return
+            rules = [x for x in rules
+                if self._get_rule_table(x) in failed]
+
+        for rule in rules:
+            if action == '-I':
+                self._insert_iptables_rule_cmd(rule, ipv6)
+            elif action == '-A':
+                self._append_iptables_rule_cmd(rule, ipv6)
+            else:
+                self._remove_iptables_rule_cmd(rule, ipv6)
+
+    def _get_rule_table(self, rule):
+        for i, arg in enumerate(rule):
+            if arg == '-t' and i + 1 < len(rule):
+                return rule[i + 1]
+        return 'filter'
+
     def _insert_iptables_rule_cmd(self, rule, ipv6=False):
         rule = self._parse_rule(rule)
 
@@ -1227,6 +1470,26 @@ class Iptables(object):
             if not self._accept:
                 return
 
+            if tables is None and not log:
+                _, present = self._snapshot_rules()
+                if self.ipv6:
+                    _, present6 = self._snapshot_rules(ipv6=True)
+
+                self._batch_iptables_rules_cmd('-I',
+                    self._get_missing_rules(self._accept, present))
+                if self.ipv6:
+                    self._batch_iptables_rules_cmd('-I',
+                        self._get_missing_rules(self._accept6, present6),
+                        ipv6=True)
+                if self.restrict_routes:
+                    self._batch_iptables_rules_cmd('-A',
+                        self._get_missing_rules(self._drop, present))
+                    if self.ipv6:
+                        self._batch_iptables_rules_cmd('-A',
+                            self._get_missing_rules(self._drop6, present6),
+                            ipv6=True)
+                return
+
             for rule in self._accept:
                 if not self._exists_iptables_rule(rule, tables=tables):
                     if log:
@@ -1285,6 +1548,152 @@ class Iptables(object):
         finally:
             self._lock.release()
 
+    def _normalize_rule(self, table, rule):
+        chain = rule[0]
+        options = []
+        option = None
+        negate = False
+
+        for arg in rule[1:]:
+            if arg == '!':
+                negate = True
+            elif arg.startswith('-') and not arg[1:].isdigit():
+                option = [('!' if negate else '') + arg]
+                options.append(option)
+                negate = False
+            elif option is not None:
+                if arg.endswith('/32') or arg.endswith('/128'):
+                    arg = arg.rsplit('/', 1)[0]
+                option.append(arg)
+
+        normalized = []
+        for option in options:
+            if option[0] == '-t':
+                table = option[1]
+                continue
+            normalized.append(tuple(option))
+
+        return table, chain, tuple(sorted(normalized))
+
+    def _snapshot_rules(self, ipv6=False):
+        _global_lock.acquire()
+        try:
+            output = utils.check_output_logged(
+                ['ip6tables-save' if ipv6 else 'iptables-save'])
+        finally:
+            _global_lock.release()
+
+        comment = 'pritunl-%s' % self.id
+        table = None
+        lines = []
+        rules = collections.Counter()
+
+        for line in output.splitlines():
+            if line.startswith('*'):
+                table = line[1:].strip()
+            elif line.startswith('-A ') and comment in line:
+                lines.append('%s %s' % (table, line))
+                rules[self._normalize_rule(table, shlex.split(line)[1:])] += 1
+
+        return lines, rules
+
+    def _get_missing_rules(self, rules, present):
+        # Rules already in the snapshot are skipped to keep adding rules
+        # idempotent, present counts are consumed for repeated rules
+        missing = []
+        for rule in rules:
+            key = self._normalize_rule('filter', self._parse_rule(rule))
+            if present[key] > 0:
+                present[key] -= 1
+            else:
+                missing.append(rule)
+        return missing
+
+    def _check_iptables_rule_cmd(self, rule, ipv6=False):
+        rule = self._parse_rule(rule)
+
+        _global_lock.acquire()
+        try:
+            utils.check_call_silent(
+                ['ip6tables' if ipv6 else 'iptables', '-C'] + rule,
+            )
+            return True
+        except subprocess.CalledProcessError:
+            return False
+        finally:
+            _global_lock.release()
+
+    def _reconcile_rules(self, expected, ipv6, log):
+        lines, present = self._snapshot_rules(ipv6)
+
+        fingerprint = hashlib.sha1()
+        for line in sorted(lines):
+            fingerprint.update(line + '\n')
+        for rule, _ in expected:
+            fingerprint.update('\0'.join(rule) + '\n')
+        fingerprint = fingerprint.hexdigest()
+
+        if self._fingerprints.get(ipv6) == fingerprint:
+            return
+
+        missing = []
+        for rule, append in expected:
+            key = self._normalize_rule('filter', self._parse_rule(rule))
+            if present[key] > 0:
+                present[key] -= 1
+            else:
+                missing.append((rule, append))
+
+        for rule, append in missing:
+            # Formatting differences from iptables-save are confirmed
+            # with a direct check before adding the rule again
+            if self._check_iptables_rule_cmd(rule, ipv6):
+                continue
+
+            if log:
+                logger.error(
+                    'Unexpected loss of %s rule, adding again...' % (
+                        'ip6tables' if ipv6 else 'iptables'),
+                    'instance',
+                    rule=rule,
+                )
+
+            if append:
+                self._append_iptables_rule_cmd(rule, ipv6)
+            else:
+                self._insert_iptables_rule_cmd(rule, ipv6)
+
+        if missing:
+            self._fingerprints.pop(ipv6, None)
+        else:
+            self._fingerprints[ipv6] = fingerprint
+
+    def reconcile_rules(self, log=False):
+        if self.cleared:
+            return
+
+        if settings.vpn.lib_iptables and LIB_IPTABLES:
+            self.upsert_rules(log=log)
+            return
+
+        self._lock.acquire()
+        try:
+            if not self._accept:
+                return
+
+            expected = [(x, False) for x in self._accept + self._other]
+            if self.restrict_routes:
+                expected += [(x, True) for x in self._drop]
+            self._reconcile_rules(expected, False, log)
+
+            if self.ipv6:
+                expected = [(x, False) for x in self._accept6 + self._other6]
+                if self.restrict_routes:
+                    expected += [(x, True) for x in self._drop6]
+                self._reconcile_rules(expected, True, log)
+        finally:
+            self._lock.release()
+
     def clear_rules(self):
         if self.cleared:
             return
@@ -1326,12 +1735,19 @@ class Iptables(object):
                         self._remove_iptables_rule(rule, ipv6=True,
                             tables=tables)
 
+            for name in self._ipsets:
+                try:
+                    self._ipset_cmd(['destroy', name])
+                except subprocess.CalledProcessError:
+                    pass
+
             self._accept = None
             self._accept6 = None
             self._other = None
             self._other6 = None
             self._drop = None
             self._drop6 = None
+            self._ipsets = None
 
             # tables['nat'].commit()
             # tables['nat6'].commit()
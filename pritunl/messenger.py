@@ -5,8 +5,86 @@ from pritunl import utils
 
 import pymongo
 import time
+import threading
+import collections
 
-def publish(channels, message, extra=None, transaction=None):
+BROKER_BUFFER = 1000
+
+publish_queue = utils.NoneQueue()
+publisher_running = False
+_broker_lock = threading.Lock()
+_broker_floor = None
+_broker_buffer = collections.deque()
+_broker_subs = collections.defaultdict(set)
+
+def broker_reset(cursor_id):
+    global _broker_floor
+
+    _broker_lock.acquire()
+    try:
+        _broker_floor = cursor_id
+        _broker_buffer.clear()
+    finally:
+        _broker_lock.release()
+
+def broker_dispatch(doc):
+    global _broker_floor
+
+    doc.pop('nonce', None)
+    channel = doc.get('channel')
+
+    _broker_lock.acquire()
+    try:
+        if len(_broker_buffer) >= BROKER_BUFFER:
+            _broker_floor = _broker_buffer.popleft()['_id']
+        _broker_buffer.append(doc)
+
+        if doc.get('message') is None:
+            return
+
+        for sub_queue in _broker_subs.get(channel, ()):
+            sub_queue.put(doc.copy())
+    finally:
+        _broker_lock.release()
+
+def _broker_register(channels, cursor_id):
+    _broker_lock.acquire()
+    try:
+        # Cursors older then the buffer must be read from the database
+        if _broker_floor is None or (cursor_id and
+                cursor_id < _broker_floor):
+            return
+
+        sub_queue = utils.NoneQueue()
+
+        if cursor_id:
+            for doc in _broker_buffer:
+                if doc['channel'] in channels and \
+                        doc['_id'] > cursor_id and \
+                        doc.get('message') is not None:
+                    sub_queue.put(doc.copy())
+
+        for channel in channels:
+            _broker_subs[channel].add(sub_queue)
+
+        return sub_queue
+    finally:
+        _broker_lock.release()
+
+def _broker_unregister(channels, sub_queue):
+    _broker_lock.acquire()
+    try:
+        for channel in channels:
+            subs = _broker_subs.get(channel)
+            if subs is None:
+                continue
+            subs.discard(sub_queue)
+            if not subs:
+                _broker_subs.pop(channel, None)
+    finally:
+        _broker_lock.release()
+
+def publish(channels, message, extra=None, transaction=None, block=False):
     if cache.has_cache:
         return cache.publish(channels, message, extra=extra)
 
@@ -50,13 +128,18 @@ def publish(channels, message, extra=None, transaction=None):
     else:
         if isinstance(channels, str):
             doc['channel'] = channels
-            collection.insert(doc, manipulate=False)
+            docs = [doc]
         else:
             docs = []
             for channel in channels:
                 doc_copy = doc.copy()
                 doc_copy['channel'] = channel
                 docs.append(doc_copy)
+
+        # Publisher runner will write queued docs in a single insert
+        if publisher_running and not block:
+            publish_queue.put(docs)
+        else:
             collection.insert(docs, manipulate=False)
 
 def get_cursor_id(channels):
@@ -82,7 +165,7 @@ def get_cursor_id(channels):
             if i:
                 raise
             else:
-                publish(channels, None)
+                publish(channels, None, block=True)
 
 @interrupter_generator
 def subscribe(channels, cursor_id=None, timeout=None, yield_delay=None,
@@ -94,8 +177,47 @@ def subscribe(channels, cursor_id=None, timeout=None, yield_delay=None,
             yield msg
         return
 
-    collection = mongo.get_collection('messages')
+    if isinstance(channels, str):
+        sub_channels = {channels}
+    else:
+        sub_channels = set(channels)
+
     start_time = time.time()
+    sub_queue = _broker_register(sub_channels, cursor_id)
+    if sub_queue is not None:
+        try:
+            yield
+
+            while True:
+                doc = sub_queue.get(timeout=0.5)
+                if doc is not None:
+                    if cursor_id and doc['_id'] <= cursor_id:
+                        continue
+
+                    yield doc
+
+                    if yield_delay:
+                        time.sleep(yield_delay)
+
+                        while True:
+                            doc = sub_queue.get(block=False)
+                            if doc is None:
+                                return
+                            if cursor_id and doc['_id'] <= cursor_id:
+                                continue
+                            yield doc
+
+                if yield_app_server and check_app_server_interrupt():
+                    return
+
+                if timeout and time.time() - start_time >= timeout:
+                    return
+
+                yield
+        finally:
+            _broker_unregister(sub_channels, sub_queue)
+
+    collection = mongo.get_collection('messages')
     cursor_id = cursor_id or get_cursor_id(channels)
 
     while True:
@@ -1,58 +1,244 @@
 from pritunl.monitoring.utils import get_servers
+from pritunl.monitoring.aggregate import Aggregator
 
+from pritunl.influxdb.line_protocol import make_lines
 from pritunl import influxdb
-from pritunl import utils
 from pritunl import settings
 from pritunl import logger
 
 import threading
+import collections
+import time
+import sys
+import os
 
-_queue = []
-_queue_lock = threading.Lock()
+_lines = collections.deque()
+_lines_lock = threading.Lock()
+_spill_lock = threading.Lock()
+_aggregator = Aggregator()
 _client = None
+_database = None
 _cur_influxdb_uri = None
+_dropped = 0
+_reported_dropped = 0
+
+def _get_key(measurement, tags):
+    return (settings.app.influxdb_prefix + measurement,
+        tuple(sorted(tags.items())))
+
+def _encode_lines(points):
+    return make_lines({
+        'points': points,
+    }, precision='ms').encode('utf-8').splitlines()
+
+def _enforce_cap():
+    # Must be called with the lines lock, returns the overflow lines to be
+    # passed to _spill after the lock is released
+    overflow = len(_lines) - settings.app.influxdb_buffer_size
+    if overflow <= 0:
+        return None
+    return [_lines.popleft() for _ in xrange(overflow)]
+
+def _spill(lines):
+    global _dropped
+
+    if not lines:
+        return
+
+    spill_path = settings.app.influxdb_spill_path
+    if spill_path:
+        _spill_lock.acquire()
+        try:
+            try:
+                spill_size = os.path.getsize(spill_path)
+            except OSError:
+                spill_size = 0
+
+            if spill_size < settings.app.influxdb_spill_size:
+                with open(spill_path, 'a') as spill_file:
+                    os.chmod(spill_path, 0600)
+                    spill_file.write('\n'.join(lines) + '\n')
+                return
+        except:
+            logger.exception('Failed to spill monitoring data', 'monitoring',
+                spill_path=spill_path,
+            )
+        finally:
+            _spill_lock.release()
+
+    _lines_lock.acquire()
+    try:
+        _dropped += len(lines)
+    finally:
+        _lines_lock.release()
 
 def insert_point(measurement, tags, fields):
-    _queue_lock.acquire()
+    overflow = None
+
+    _lines_lock.acquire()
     try:
         if not _client:
             return
 
-        _queue.append({
+        _lines.extend(_encode_lines([{
             'measurement': settings.app.influxdb_prefix + measurement,
             'tags': tags,
-            'time': utils.now(),
+            'time': int(time.time() * 1000),
             'fields': fields,
-        })
+        }]))
+        overflow = _enforce_cap()
+    finally:
+        _lines_lock.release()
+
+    _spill(overflow)
+
+def add_counter(measurement, tags, field, value=1):
+    _lines_lock.acquire()
+    try:
+        if not _client:
+            return
+        _aggregator.add_counter(_get_key(measurement, tags), field, value)
+    finally:
+        _lines_lock.release()
+
+def set_gauge(measurement, tags, field, value):
+    _lines_lock.acquire()
+    try:
+        if not _client:
+            return
+        _aggregator.set_gauge(_get_key(measurement, tags), field, value)
     finally:
-        _queue_lock.release()
+        _lines_lock.release()
+
+def add_timing(measurement, tags, field, value):
+    _lines_lock.acquire()
+    try:
+        if not _client:
+            return
+        _aggregator.add_timing(_get_key(measurement, tags), field, value)
+    finally:
+        _lines_lock.release()
+
+def _write_lines(client, database, lines):
+    client.request(
+        url='write',
+        method='POST',
+        params={
+            'db': database,
+            'precision': 'ms',
+        },
+        data='\n'.join(lines) + '\n',
+        expected_response_code=204,
+        headers={
+            'Content-type': 'application/octet-stream',
+        },
+    )
+
+def _write_spill(client, database):
+    spill_path = settings.app.influxdb_spill_path
+    if not spill_path:
+        return
+
+    # A send file left by a failed send is finished before the next spill
+    # file is taken so its data is not overwritten
+    send_path = spill_path + '.send'
+    _spill_lock.acquire()
+    try:
+        if not os.path.isfile(send_path):
+            if not os.path.isfile(spill_path):
+                return
+            os.rename(spill_path, send_path)
+    finally:
+        _spill_lock.release()
+
+    with open(send_path, 'r') as spill_file:
+        lines = spill_file.read().splitlines()
+
+    batch_size = settings.app.influxdb_buffer_size
+    for i in xrange(0, len(lines), batch_size):
+        _write_lines(client, database, lines[i:i + batch_size])
+
+        # Remove sent batches so a failure does not resend them
+        remaining = lines[i + batch_size:]
+        if remaining:
+            temp_path = send_path + '.tmp'
+            with open(temp_path, 'w') as temp_file:
+                os.chmod(temp_path, 0600)
+                temp_file.write('\n'.join(remaining) + '\n')
+            os.rename(temp_path, send_path)
+
+    os.remove(send_path)
 
 def write_queue():
-    global _queue
+    global _aggregator
+    global _lines
+    global _reported_dropped
 
-    _queue_lock.acquire()
+    timestamp = int(time.time() * 1000)
+
+    _lines_lock.acquire()
     try:
-        if not _queue:
+        if not _client:
             return
-        queue = _queue
-        _queue = []
         client = _client
+        database = _database
+
+        if len(_aggregator):
+            aggregator = _aggregator
+            _aggregator = Aggregator()
+            _lines.extend(_encode_lines(aggregator.rollup(timestamp)))
+
+        dropped = _dropped - _reported_dropped
+        if dropped:
+            _reported_dropped = _dropped
+            _lines.extend(_encode_lines([{
+                'measurement': settings.app.influxdb_prefix + 'monitoring',
+                'tags': {
+                    'host': settings.local.host.name,
+                },
+                'time': timestamp,
+                'fields': {
+                    'dropped': dropped,
+                },
+            }]))
+
+        overflow = _enforce_cap()
+
+        if not _lines:
+            lines = None
+        else:
+            lines = list(_lines)
+            _lines = collections.deque()
     finally:
-        _queue_lock.release()
+        _lines_lock.release()
+
+    _spill(overflow)
+
+    if dropped:
+        logger.warning('Monitoring buffer full, dropped points',
+            'monitoring',
+            dropped=dropped,
+        )
 
-    if client:
+    if lines:
         try:
-            client.write_points(queue)
+            _write_lines(client, database, lines)
         except:
-            _queue_lock.acquire()
+            exc_info = sys.exc_info()
+            _lines_lock.acquire()
             try:
-                _queue = queue + _queue
+                _lines.extendleft(reversed(lines))
+                overflow = _enforce_cap()
             finally:
-                _queue_lock.release()
-            raise
+                _lines_lock.release()
+            _spill(overflow)
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+    _write_spill(client, database)
 
 def connect():
     global _client
+    global _database
     global _cur_influxdb_uri
 
     influxdb_uri = settings.app.influxdb_uri
@@ -60,11 +246,11 @@ def connect():
         return
 
     if not influxdb_uri:
-        _queue_lock.acquire()
+        _lines_lock.acquire()
         try:
             _client = None
         finally:
-            _queue_lock.release()
+            _lines_lock.release()
         _cur_influxdb_uri = influxdb_uri
         return
 
@@ -89,6 +275,7 @@ def connect():
             password=password,
             database=database,
         )
+    _database = database
 
     _cur_influxdb_uri = influxdb_uri
 
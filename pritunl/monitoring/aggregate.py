@@ -0,0 +1,108 @@
+import bisect
+
+HISTOGRAM_BOUNDS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500,
+    5000, 10000, 30000)
+HISTOGRAM_PERCENTILES = (50, 90, 99)
+
+class Histogram(object):
+    __slots__ = ('buckets', 'count', 'total', 'min', 'max')
+
+    def __init__(self):
+        self.buckets = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.buckets[bisect.bisect_left(HISTOGRAM_BOUNDS, value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        rank = self.count * percent / 100.
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                if i < len(HISTOGRAM_BOUNDS):
+                    return min(HISTOGRAM_BOUNDS[i], self.max)
+                return self.max
+        return self.max
+
+    def export(self, field):
+        fields = {
+            field + '_count': self.count,
+            field + '_mean': float(self.total) / self.count,
+            field + '_min': self.min,
+            field + '_max': self.max,
+        }
+        for percent in HISTOGRAM_PERCENTILES:
+            fields['%s_p%d' % (field, percent)] = self.percentile(percent)
+        return fields
+
+class Aggregator(object):
+    def __init__(self):
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+
+    def __len__(self):
+        return len(self._counters) + len(self._gauges) + \
+            len(self._histograms)
+
+    def add_counter(self, key, field, value):
+        fields = self._counters.get(key)
+        if fields is None:
+            self._counters[key] = {field: value}
+        else:
+            fields[field] = fields.get(field, 0) + value
+
+    def set_gauge(self, key, field, value):
+        fields = self._gauges.get(key)
+        if fields is None:
+            self._gauges[key] = {field: value}
+        else:
+            fields[field] = value
+
+    def add_timing(self, key, field, value):
+        fields = self._histograms.get(key)
+        if fields is None:
+            fields = {}
+            self._histograms[key] = fields
+
+        histogram = fields.get(field)
+        if histogram is None:
+            histogram = Histogram()
+            fields[field] = histogram
+
+        histogram.add(value)
+
+    def rollup(self, timestamp):
+        series = {}
+
+        for key, fields in self._counters.iteritems():
+            series.setdefault(key, {}).update(fields)
+
+        for key, fields in self._gauges.iteritems():
+            series.setdefault(key, {}).update(fields)
+
+        for key, fields in self._histograms.iteritems():
+            point_fields = series.setdefault(key, {})
+            for field, histogram in fields.iteritems():
+                point_fields.update(histogram.export(field))
+
+        points = []
+        for (measurement, tags), fields in series.iteritems():
+            points.append({
+                'measurement': measurement,
+                'tags': dict(tags),
+                'time': timestamp,
+                'fields': fields,
+            })
+
+        return points
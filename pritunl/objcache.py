@@ -1,25 +1,51 @@
+from pritunl import scheduler
+
 import threading
+import time
 
 class ObjCache(object):
     def __init__(self, ttl=60):
         self._ttl = ttl
         self._data = {}
-        self._timers = {}
+        self._lock = threading.Lock()
+        self._reaper = None
 
     def remove(self, key):
         self._data.pop(key, None)
 
-    def set(self, key, val):
-        cur_timer = self._timers.pop(key, None)
-        if cur_timer:
-            cur_timer.cancel()
+    def _reap(self):
+        self._lock.acquire()
+        try:
+            self._reaper = None
+            cur_time = time.time()
+            next_expire = None
+
+            for key, (expire, _) in self._data.items():
+                if expire <= cur_time:
+                    self._data.pop(key, None)
+                elif next_expire is None or expire < next_expire:
+                    next_expire = expire
 
-        timer = threading.Timer(self._ttl, self.remove, (key,))
-        timer.daemon = True
-        self._timers[key] = timer
-        timer.start()
+            if next_expire is not None:
+                self._reaper = scheduler.call_later(
+                    next_expire - cur_time, self._reap)
+        finally:
+            self._lock.release()
+
+    def set(self, key, val):
+        self._data[key] = (time.time() + self._ttl, val)
 
-        self._data[key] = val
+        self._lock.acquire()
+        try:
+            if not self._reaper:
+                self._reaper = scheduler.call_later(self._ttl, self._reap)
+        finally:
+            self._lock.release()
 
     def get(self, key):
-        return self._data.get(key)
+        data = self._data.get(key)
+        if not data:
+            return None
+        if data[0] <= time.time():
+            return None
+        return data[1]
@@ -7,6 +7,7 @@ from pritunl import queue
 from pritunl import pooler
 from pritunl import user
 from pritunl import utils
+from pritunl import tombstone
 
 import uuid
 import math
@@ -390,6 +391,7 @@ class Organization(mongo.MongoObject):
             'organizations': self.id,
         }})
 
+        tombstone.add(tombstone.ORGANIZATION, self.id)
         mongo.MongoObject.remove(self)
         user_collection.remove({
             'org_id': self.id,
@@ -87,6 +87,12 @@ def audit_event(host_id, host_name, user_id, org_id, timestamp, type,
         remote_addr, message, **kwargs):
     pass
 
+# Any of the asynchronous events above can also be received in batches by
+# adding _batch to the function name. The events argument is a list of dicts
+# with the same keyword arguments as the single event function.
+def audit_event_batch(events):
+    pass
+
 # [SYNCHRONOUS] Called after a user has authenticated with SSO when
 # loging into the web console. Must return True or False to accept auth
 # request and an organization name or None. If an organization name is
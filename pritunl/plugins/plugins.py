@@ -6,23 +6,47 @@ from pritunl.helpers import *
 from pritunl import callqueue
 from pritunl import settings
 from pritunl import logger
+from pritunl import monitoring
 
 import imp
 import os
+import sys
+import time
+import threading
+import collections
+
+EVENT_TYPES = (
+    'user_connection',
+    'user_connected',
+    'user_disconnected',
+    'log_entry',
+    'audit_event',
+)
 
 _queue = None
+_caller_queue = None
 _has_plugins = False
 _handlers = {}
+_pending = {}
+_pending_lock = threading.Lock()
+_draining = collections.defaultdict(int)
+_dropped = collections.defaultdict(int)
+_stats = {}
+_stats_lock = threading.Lock()
 
 def init():
     global _queue
+    global _caller_queue
     global _has_plugins
     global _handlers
 
-    _queue = callqueue.CallQueue(maxsize=settings.app.plugin_queue_size)
+    _queue = callqueue.CallQueue()
     _queue.start(settings.app.plugin_queue_threads)
+    _caller_queue = callqueue.CallQueue()
+    _caller_queue.start(settings.app.plugin_caller_threads)
     _has_plugins = True
     call_types = set(get_functions(example).keys())
+    call_types.update(x + '_batch' for x in EVENT_TYPES)
 
     modules = []
     plugin_dir = settings.app.plugin_directory
@@ -62,28 +86,213 @@ def init():
             else:
                 _handlers[call_type].append(handler)
 
-def _event(event_type, **kwargs):
-    for handler in _handlers[event_type]:
-        try:
-            handler(**kwargs)
-        except:
-            logger.exception('Error in plugin handler', 'plugins',
-                handler=event_type,
-            )
+def _record(call_type, handler, elapsed, error=False, timeout=False):
+    key = (handler.__module__, call_type)
+    elapsed = int(elapsed * 1000)
+
+    _stats_lock.acquire()
+    try:
+        stats = _stats.get(key)
+        if not stats:
+            stats = {
+                'count': 0,
+                'errors': 0,
+                'timeouts': 0,
+                'total_time': 0,
+                'max_time': 0,
+            }
+            _stats[key] = stats
+
+        stats['count'] += 1
+        stats['total_time'] += elapsed
+        stats['max_time'] = max(stats['max_time'], elapsed)
+        if error:
+            stats['errors'] += 1
+        if timeout:
+            stats['timeouts'] += 1
+    finally:
+        _stats_lock.release()
+
+    host = getattr(settings.local, 'host', None)
+    tags = {
+        'host': host.name if host else None,
+        'plugin': handler.__module__,
+        'type': call_type,
+    }
+    monitoring.add_timing('plugins', tags, 'duration', elapsed)
+    if error:
+        monitoring.add_counter('plugins', tags, 'errors')
+    if timeout:
+        monitoring.add_counter('plugins', tags, 'timeouts')
+
+def _call_handler(call_type, handler, *args, **kwargs):
+    start = time.time()
+    try:
+        value = handler(*args, **kwargs)
+    except:
+        _record(call_type, handler, time.time() - start, error=True)
+        raise
+    _record(call_type, handler, time.time() - start)
+    return value
+
+def _drain(event_type):
+    finished = False
+    try:
+        while True:
+            _pending_lock.acquire()
+            try:
+                pending = _pending[event_type]
+                batch = []
+                while pending and \
+                        len(batch) < settings.app.plugin_batch_size:
+                    batch.append(pending.popleft())
+
+                if not batch:
+                    _draining[event_type] -= 1
+                    finished = True
+                    return
+            finally:
+                _pending_lock.release()
+
+            for handler in _handlers.get(event_type + '_batch', []):
+                try:
+                    _call_handler(event_type, handler, batch)
+                except:
+                    logger.exception('Error in plugin handler', 'plugins',
+                        handler=event_type + '_batch',
+                    )
+
+            for handler in _handlers.get(event_type, []):
+                for kwargs in batch:
+                    try:
+                        _call_handler(event_type, handler, **kwargs)
+                    except:
+                        logger.exception('Error in plugin handler',
+                            'plugins',
+                            handler=event_type,
+                        )
+    finally:
+        if not finished:
+            _pending_lock.acquire()
+            try:
+                _draining[event_type] -= 1
+            finally:
+                _pending_lock.release()
 
 def event(event_type, **kwargs):
     if not settings.local.sub_plan or \
             'enterprise' not in settings.local.sub_plan:
         return
-    if not _has_plugins or event_type not in _handlers:
+    if not _has_plugins or (event_type not in _handlers and
+            event_type + '_batch' not in _handlers):
         return
-    _queue.put(_event, event_type, **kwargs)
+
+    _pending_lock.acquire()
+    try:
+        pending = _pending.get(event_type)
+        if pending is None:
+            pending = collections.deque()
+            _pending[event_type] = pending
+
+        if len(pending) >= settings.app.plugin_queue_size:
+            _dropped[event_type] += 1
+            if settings.app.plugin_overflow == 'drop_newest':
+                return
+            pending.popleft()
+        pending.append(kwargs)
+
+        # Running drains will pick up the event
+        if _draining[event_type] >= settings.app.plugin_queue_threads:
+            return
+        _draining[event_type] += 1
+    finally:
+        _pending_lock.release()
+
+    _queue.put(_drain, event_type)
 
 def caller(caller_type, **kwargs):
     if not _has_plugins or caller_type not in _handlers:
         return
 
-    returns = []
-    for handler in _handlers[caller_type]:
-        returns.append(handler(**kwargs))
-    return returns
+    timeout = settings.app.plugin_caller_timeout
+    if not timeout:
+        returns = []
+        for handler in _handlers[caller_type]:
+            returns.append(_call_handler(caller_type, handler, **kwargs))
+        return returns
+
+    state = {
+        'handler': None,
+        'returns': [],
+        'exc_info': None,
+        'cancelled': False,
+    }
+    done = threading.Event()
+
+    def _run():
+        # Skip calls that timed out while waiting for a free thread
+        if state['cancelled']:
+            return
+
+        try:
+            for handler in _handlers[caller_type]:
+                state['handler'] = handler
+                state['returns'].append(
+                    _call_handler(caller_type, handler, **kwargs))
+            state['handler'] = None
+        except:
+            state['exc_info'] = sys.exc_info()
+        finally:
+            done.set()
+
+    _caller_queue.put(_run)
+
+    if not done.wait(timeout):
+        state['cancelled'] = True
+        handler = state['handler']
+        if handler:
+            _record(caller_type, handler, timeout, timeout=True)
+        logger.error('Plugin handler timed out', 'plugins',
+            handler=caller_type,
+            plugin=handler.__module__ if handler else None,
+            timeout=timeout,
+        )
+        raise PluginTimeout('Plugin %s handler timed out' % caller_type)
+
+    if state['exc_info']:
+        exc_info = state['exc_info']
+        raise exc_info[0], exc_info[1], exc_info[2]
+
+    return state['returns']
+
+def get_stats():
+    handlers = []
+
+    _stats_lock.acquire()
+    try:
+        for (module, call_type), stats in _stats.items():
+            handlers.append({
+                'plugin': module,
+                'type': call_type,
+                'count': stats['count'],
+                'errors': stats['errors'],
+                'timeouts': stats['timeouts'],
+                'avg_time': stats['total_time'] / stats['count'],
+                'max_time': stats['max_time'],
+            })
+    finally:
+        _stats_lock.release()
+
+    _pending_lock.acquire()
+    try:
+        pending = dict((x, len(y)) for x, y in _pending.items())
+        dropped = dict(_dropped)
+    finally:
+        _pending_lock.release()
+
+    return {
+        'handlers': sorted(handlers,
+            key=lambda x: (x['plugin'], x['type'])),
+        'pending': pending,
+        'dropped': dropped,
+    }
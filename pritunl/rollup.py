@@ -0,0 +1,234 @@
+from pritunl import settings
+from pritunl import mongo
+from pritunl import logger
+
+import threading
+import datetime
+import time
+import array
+
+PERIODS = ('1m', '5m', '30m', '2h', '1d')
+PERIOD_RANGES = {
+    '1m': (datetime.timedelta(hours=6), datetime.timedelta(minutes=1)),
+    '5m': (datetime.timedelta(days=1), datetime.timedelta(minutes=5)),
+    '30m': (datetime.timedelta(days=7), datetime.timedelta(minutes=30)),
+    '2h': (datetime.timedelta(days=30), datetime.timedelta(hours=2)),
+    '1d': (datetime.timedelta(days=365), datetime.timedelta(days=1)),
+}
+
+def get_period_timestamp(period, timestamp):
+    timestamp -= datetime.timedelta(microseconds=timestamp.microsecond,
+            seconds=timestamp.second)
+
+    if period == '1m':
+        return timestamp
+    elif period == '5m':
+        return timestamp - datetime.timedelta(
+            minutes=timestamp.minute % 5)
+    elif period == '30m':
+        return timestamp - datetime.timedelta(
+            minutes=timestamp.minute % 30)
+    elif period == '2h':
+        return timestamp - datetime.timedelta(
+            hours=timestamp.hour % 2, minutes=timestamp.minute)
+    elif period == '1d':
+        return timestamp - datetime.timedelta(
+            hours=timestamp.hour, minutes=timestamp.minute)
+
+def get_period_max_timestamp(period, timestamp):
+    timestamp -= datetime.timedelta(microseconds=timestamp.microsecond,
+            seconds=timestamp.second)
+
+    if period == '1m':
+        return timestamp - datetime.timedelta(hours=6)
+    elif period == '5m':
+        return timestamp - datetime.timedelta(
+            minutes=timestamp.minute % 5) - datetime.timedelta(days=1)
+    elif period == '30m':
+        return timestamp - datetime.timedelta(
+            minutes=timestamp.minute % 30) - datetime.timedelta(days=7)
+    elif period == '2h':
+        return timestamp - datetime.timedelta(
+            hours=timestamp.hour % 2,
+            minutes=timestamp.minute) - datetime.timedelta(days=30)
+    elif period == '1d':
+        return timestamp - datetime.timedelta(
+            hours=timestamp.hour,
+            minutes=timestamp.minute) - datetime.timedelta(days=365)
+
+_rollups = []
+
+class Rollup(object):
+    def __init__(self, collection_name, id_field):
+        self._collection_name = collection_name
+        self._id_field = id_field
+        self._buckets = {}
+        self._failed = {}
+        self._lock = threading.Lock()
+        _rollups.append(self)
+
+    @property
+    def collection(self):
+        return mongo.get_collection(self._collection_name)
+
+    def _pop_failed(self, doc_id, upserts):
+        for key in self._failed.keys():
+            if doc_id is None or key[0] == doc_id:
+                upserts.append(key + (self._failed.pop(key),))
+
+    def _write(self, upserts, removes):
+        bulk = self.collection.initialize_unordered_bulk_op()
+        has_ops = False
+
+        for doc_id, period, period_timestamp, bucket_values in upserts:
+            if not bucket_values:
+                continue
+            has_ops = True
+            bulk.find({
+                self._id_field: doc_id,
+                'period': period,
+                'timestamp': period_timestamp,
+            }).upsert().update({'$inc': bucket_values})
+
+        for doc_id, period, max_timestamp in removes:
+            has_ops = True
+            bulk.find({
+                self._id_field: doc_id,
+                'period': period,
+                'timestamp': {
+                    '$lt': max_timestamp,
+                },
+            }).remove()
+
+        if not has_ops:
+            return
+
+        try:
+            bulk.execute()
+        except:
+            # Keep the values to write with the next flush, the $inc
+            # upserts are not retried by the driver so nothing was counted
+            self._lock.acquire()
+            try:
+                for doc_id, period, period_timestamp, bucket_values in \
+                        upserts:
+                    key = (doc_id, period, period_timestamp)
+                    failed_values = self._failed.setdefault(key, {})
+                    for field, value in bucket_values.items():
+                        failed_values[field] = failed_values.get(
+                            field, 0) + value
+            finally:
+                self._lock.release()
+            raise
+
+    def add(self, doc_id, timestamp, values):
+        cur_time = time.time()
+        flush_interval = settings.app.rollup_flush_interval
+        upserts = []
+        removes = []
+
+        self._lock.acquire()
+        try:
+            for period in PERIODS:
+                period_timestamp = get_period_timestamp(
+                    period, timestamp)
+                bucket = self._buckets.get((doc_id, period))
+
+                if bucket and bucket['timestamp'] != period_timestamp:
+                    upserts.append((doc_id, period, bucket['timestamp'],
+                        bucket['values']))
+                    removes.append((doc_id, period,
+                        get_period_max_timestamp(period, timestamp)))
+                    bucket = None
+
+                if not bucket:
+                    bucket = {
+                        'timestamp': period_timestamp,
+                        'values': {},
+                        'flushed': cur_time,
+                    }
+                    self._buckets[(doc_id, period)] = bucket
+
+                bucket_values = bucket['values']
+                for field, value in values.items():
+                    bucket_values[field] = bucket_values.get(field, 0) + value
+
+                # Open buckets are checkpointed so other hosts serving
+                # graphs see data before the period closes
+                if cur_time - bucket['flushed'] >= flush_interval:
+                    upserts.append((doc_id, period, bucket['timestamp'],
+                        bucket_values))
+                    bucket['values'] = {}
+                    bucket['flushed'] = cur_time
+
+            if upserts:
+                self._pop_failed(doc_id, upserts)
+        finally:
+            self._lock.release()
+
+        if not upserts and not removes:
+            return
+
+        self._write(upserts, removes)
+
+    def flush(self, doc_id=None):
+        upserts = []
+
+        self._lock.acquire()
+        try:
+            for key in self._buckets.keys():
+                if doc_id is not None and key[0] != doc_id:
+                    continue
+                bucket = self._buckets.pop(key)
+                upserts.append((key[0], key[1], bucket['timestamp'],
+                    bucket['values']))
+            self._pop_failed(doc_id, upserts)
+        finally:
+            self._lock.release()
+
+        if upserts:
+            self._write(upserts, [])
+
+    def get_pending(self, doc_id, period):
+        self._lock.acquire()
+        try:
+            bucket = self._buckets.get((doc_id, period))
+            if not bucket or not bucket['values']:
+                return None
+            return bucket['timestamp'], bucket['values'].copy()
+        finally:
+            self._lock.release()
+
+def flush_all():
+    for rollup in _rollups:
+        try:
+            rollup.flush()
+        except:
+            logger.exception('Failed to flush rollup', 'rollup',
+                collection=rollup._collection_name,
+            )
+
+def get_series(period, date_end, points, fields, typecode='d'):
+    span, step = PERIOD_RANGES[period]
+    date_start = date_end - span
+    step_secs = int(step.total_seconds())
+    count = int(span.total_seconds()) // step_secs + 1
+    start = int(date_start.strftime('%s'))
+
+    series = {}
+    for field in fields:
+        series[field] = array.array(typecode, [0]) * count
+
+    for timestamp, values in points:
+        index = int((timestamp - date_start).total_seconds()) // step_secs
+        if index < 0 or index >= count:
+            continue
+        for field in fields:
+            series[field][index] = values[field]
+
+    timestamps = xrange(start, start + count * step_secs, step_secs)
+
+    data = {}
+    for field in fields:
+        data[field] = zip(timestamps, series[field].tolist())
+    return data
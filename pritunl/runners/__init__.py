@@ -1,6 +1,10 @@
 from pritunl.runners.settings import start_settings
+from pritunl.runners.messenger import start_messenger
 from pritunl.runners.logger import start_logger
 from pritunl.runners.journal import start_journal
+from pritunl.runners.audit import start_audit
+from pritunl.runners.rollup import start_rollup
+from pritunl.runners.auth import start_auth
 from pritunl.runners.updates import start_updates
 from pritunl.runners.transaction import start_transaction
 from pritunl.runners.task import start_task
@@ -11,14 +15,19 @@ from pritunl.runners.subscription import start_subscription
 from pritunl.runners.server import start_server
 from pritunl.runners.update_server import start_update_server
 from pritunl.runners.instance import start_instance
+from pritunl.runners.heartbeat import start_heartbeat
 from pritunl.runners.time_sync import start_time_sync
 from pritunl.runners.limiter import start_limiter
 from pritunl.runners.listener import start_listener
 
 def start_all():
+    start_messenger()
     start_settings()
     start_logger()
     start_journal()
+    start_audit()
+    start_rollup()
+    start_auth()
     start_updates()
     start_transaction()
     start_task()
@@ -28,6 +37,7 @@ def start_all():
     start_subscription()
     start_server()
     start_instance()
+    start_heartbeat()
     start_time_sync()
     start_limiter()
     start_update_server()
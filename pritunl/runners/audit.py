@@ -0,0 +1,35 @@
+from pritunl.helpers import *
+from pritunl import logger
+from pritunl import audit
+from pritunl import settings
+
+import time
+import threading
+
+@interrupter
+def _audit_runner_thread():
+    audit.writer_running = True
+
+    while True:
+        try:
+            yield interrupter_sleep(settings.app.audit_flush_interval)
+            audit.flush()
+            yield
+
+        except GeneratorExit:
+            audit.writer_running = False
+            try:
+                audit.flush()
+            except:
+                logger.exception('Failed to flush audit events', 'runners',
+                    pending=len(audit.audit_queue),
+                )
+            raise
+        except:
+            logger.exception('Error in audit runner thread', 'runners',
+                pending=len(audit.audit_queue),
+            )
+            time.sleep(1)
+
+def start_audit():
+    threading.Thread(target=_audit_runner_thread).start()
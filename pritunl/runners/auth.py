@@ -0,0 +1,31 @@
+from pritunl.helpers import *
+from pritunl import logger
+from pritunl import auth
+from pritunl import settings
+
+import time
+import threading
+
+@interrupter
+def _auth_runner_thread():
+    auth.administrator.nonce_writer_running = True
+
+    while True:
+        try:
+            yield interrupter_sleep(settings.app.auth_nonce_flush_interval)
+            auth.flush_nonces()
+            yield
+
+        except GeneratorExit:
+            auth.administrator.nonce_writer_running = False
+            try:
+                auth.flush_nonces()
+            except:
+                logger.exception('Failed to flush auth nonces', 'runners')
+            raise
+        except:
+            logger.exception('Error in auth runner thread', 'runners')
+            time.sleep(1)
+
+def start_auth():
+    threading.Thread(target=_auth_runner_thread).start()
@@ -1,6 +1,7 @@
 from pritunl.helpers import *
 from pritunl import event
 from pritunl import logger
+from pritunl import messenger
 
 import time
 import threading
@@ -52,5 +53,26 @@ def _event_runner_thread():
             logger.exception('Error in event runner thread.', 'runners')
             time.sleep(0.5)
 
+@interrupter
+def _event_hub_thread():
+    cursor_id = messenger.get_cursor_id('events')
+    event.hub_reset(cursor_id)
+
+    while True:
+        try:
+            for msg in messenger.subscribe('events', cursor_id=cursor_id):
+                cursor_id = msg['_id']
+                event.hub_dispatch(msg)
+                yield
+        except GeneratorExit:
+            event.hub_stop()
+            raise
+        except:
+            logger.exception('Error in event hub thread', 'runners')
+            time.sleep(0.5)
+
+        yield
+
 def start_event():
     threading.Thread(target=_event_runner_thread).start()
+    threading.Thread(target=_event_hub_thread).start()
@@ -0,0 +1,38 @@
+from pritunl.helpers import *
+from pritunl.server import heartbeat
+from pritunl import settings
+from pritunl import logger
+
+import time
+import threading
+
+@interrupter
+def _heartbeat_thread():
+    next_server_ping = 0
+    next_route_ping = 0
+
+    while True:
+        try:
+            cur_time = time.time()
+
+            if cur_time >= next_server_ping:
+                next_server_ping = cur_time + settings.vpn.server_ping
+                heartbeat.ping_instances()
+
+            yield
+
+            if cur_time >= next_route_ping:
+                next_route_ping = cur_time + settings.vpn.route_ping
+                heartbeat.ping_route_advertisements()
+
+            yield interrupter_sleep(max(0.1, min(
+                next_server_ping, next_route_ping) - time.time()))
+
+        except GeneratorExit:
+            raise
+        except:
+            logger.exception('Error in heartbeat thread', 'runners')
+            time.sleep(1)
+
+def start_heartbeat():
+    threading.Thread(target=_heartbeat_thread).start()
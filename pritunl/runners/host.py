@@ -142,14 +142,15 @@ def _keep_alive_thread():
                 host_event = False
                 event.Event(type=HOSTS_UPDATED)
 
-            monitoring.insert_point('system', {
+            tags = {
                 'host': settings.local.host.name,
-            }, {
-                'cpu_usage': cpu_usage,
-                'mem_usage': mem_usage,
-                'thread_count': thread_count,
-                'open_file_count': open_file_count,
-            })
+            }
+            monitoring.set_gauge('system', tags, 'cpu_usage', cpu_usage)
+            monitoring.set_gauge('system', tags, 'mem_usage', mem_usage)
+            monitoring.set_gauge('system', tags, 'thread_count',
+                thread_count)
+            monitoring.set_gauge('system', tags, 'open_file_count',
+                open_file_count)
 
             settings.local.host_ping_timestamp = ping_timestamp
         except GeneratorExit:
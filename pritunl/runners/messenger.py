@@ -0,0 +1,201 @@
+from pritunl.helpers import *
+from pritunl import messenger
+from pritunl import mongo
+from pritunl import cache
+from pritunl import logger
+from pritunl import settings
+
+import pymongo
+import threading
+import time
+
+PUBLISH_BATCH = 500
+
+def _get_head_id(collection):
+    for i in xrange(2):
+        try:
+            return collection.find({}, {
+                '_id': True,
+            }).sort('$natural', pymongo.DESCENDING).limit(1)[0]['_id']
+        except IndexError:
+            if i:
+                raise
+            else:
+                messenger.publish('messenger', None, block=True)
+
+@interrupter
+def _reader_thread(cursor_id):
+    collection = mongo.get_collection('messages')
+
+    while True:
+        try:
+            if not cursor_id:
+                cursor_id = _get_head_id(collection)
+                messenger.broker_reset(cursor_id)
+
+            yield
+
+            cursor = collection.find({
+                '_id': {'$gt': cursor_id},
+            }, cursor_type=pymongo.cursor.CursorType.TAILABLE_AWAIT).sort(
+                '$natural', pymongo.ASCENDING)
+
+            while cursor.alive:
+                for doc in cursor:
+                    cursor_id = doc['_id']
+                    messenger.broker_dispatch(doc)
+
+                yield
+
+            yield
+        except GeneratorExit:
+            raise
+        except pymongo.errors.AutoReconnect:
+            time.sleep(0.2)
+        except pymongo.errors.OperationFailure:
+            logger.exception('Messenger cursor lost, resetting broker',
+                'runners')
+            cursor_id = None
+            time.sleep(0.3)
+        except:
+            logger.exception('Error in messenger reader thread', 'runners')
+            time.sleep(0.3)
+
+def _write_messages(collection, docs):
+    for i in xrange(3):
+        try:
+            collection.insert(docs, manipulate=False)
+            return True
+        except:
+            if i == 2:
+                logger.exception('Failed to write messages, requeuing',
+                    'runners',
+                    count=len(docs),
+                )
+            else:
+                time.sleep(0.3)
+    return False
+
+def _publisher_thread():
+    collection = mongo.get_collection('messages')
+    publish_queue = messenger.publish_queue
+    pending = []
+
+    while not check_global_interrupt():
+        docs = publish_queue.get(timeout=0.5)
+        if docs is None and not pending:
+            continue
+
+        # Failed docs are sent again first to keep the publish order
+        docs = pending + list(docs or [])
+        while len(docs) < PUBLISH_BATCH:
+            more_docs = publish_queue.get(block=False)
+            if more_docs is None:
+                break
+            docs.extend(more_docs)
+
+        if _write_messages(collection, docs):
+            pending = []
+        else:
+            pending = docs
+            time.sleep(1)
+
+    # Publishes during shutdown are written directly by the caller
+    messenger.publisher_running = False
+
+    docs = pending
+    while True:
+        more_docs = publish_queue.get(block=False)
+        if more_docs is None:
+            break
+        docs.extend(more_docs)
+
+    if docs:
+        try:
+            collection.insert(docs, manipulate=False)
+        except:
+            logger.exception('Failed to write messages on shutdown',
+                'runners',
+                count=len(docs),
+            )
+            raise
+
+def _publish_messages(msgs):
+    for i in xrange(3):
+        try:
+            cache.publish_batch(msgs)
+            return True
+        except:
+            if i == 2:
+                logger.exception('Failed to publish messages, requeuing',
+                    'runners',
+                    count=len(msgs),
+                )
+            else:
+                time.sleep(0.3)
+    return False
+
+def _cache_publisher_thread():
+    publish_queue = cache.publish_queue
+    pending = []
+
+    while not check_global_interrupt():
+        msg = publish_queue.get(timeout=0.5)
+        if msg is None and not pending:
+            continue
+
+        # Coalesce messages from all threads into a single pipeline
+        publish_interval = settings.app.redis_publish_interval
+        if publish_interval:
+            time.sleep(publish_interval)
+
+        # Failed messages are sent again first, the publish script skips
+        # messages that were already written
+        msgs = pending
+        if msg is not None:
+            msgs.append(msg)
+        while len(msgs) < PUBLISH_BATCH:
+            msg = publish_queue.get(block=False)
+            if msg is None:
+                break
+            msgs.append(msg)
+
+        if _publish_messages(msgs):
+            pending = []
+        else:
+            pending = msgs
+            time.sleep(1)
+
+    # Publishes during shutdown are sent directly by the caller
+    cache.publisher_running = False
+
+    msgs = pending
+    while True:
+        msg = publish_queue.get(block=False)
+        if msg is None:
+            break
+        msgs.append(msg)
+
+    if msgs:
+        try:
+            cache.publish_batch(msgs)
+        except:
+            logger.exception('Failed to publish messages on shutdown',
+                'runners',
+                count=len(msgs),
+            )
+            raise
+
+def start_messenger():
+    if cache.has_cache:
+        threading.Thread(target=_cache_publisher_thread).start()
+        cache.publisher_running = True
+        return
+
+    collection = mongo.get_collection('messages')
+    cursor_id = _get_head_id(collection)
+    messenger.broker_reset(cursor_id)
+
+    threading.Thread(target=_reader_thread, args=(cursor_id,)).start()
+    threading.Thread(target=_publisher_thread).start()
+    messenger.publisher_running = True
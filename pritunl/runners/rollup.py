@@ -0,0 +1,25 @@
+from pritunl.helpers import *
+from pritunl import logger
+from pritunl import rollup
+from pritunl import settings
+
+import time
+import threading
+
+@interrupter
+def _rollup_runner_thread():
+    while True:
+        try:
+            yield interrupter_sleep(settings.app.rollup_flush_interval)
+            rollup.flush_all()
+            yield
+
+        except GeneratorExit:
+            rollup.flush_all()
+            raise
+        except:
+            logger.exception('Error in rollup runner thread', 'runners')
+            time.sleep(1)
+
+def start_rollup():
+    threading.Thread(target=_rollup_runner_thread).start()
@@ -1,10 +1,30 @@
+from pritunl.constants import *
 from pritunl import settings
 from pritunl import logger
 from pritunl import server
 from pritunl import listener
 
+import threading
 import time
 
+def _run_fallback(msg):
+    # Only start if the placed hosts failed to fill the replicas
+    try:
+        time.sleep(settings.vpn.placement_fallback_delay)
+
+        svr = server.get_by_id(msg['server_id'])
+        if not svr or svr.status != ONLINE or \
+                svr.instances_count >= svr.replica_count:
+            return
+
+        for instance in svr.instances:
+            if instance['host_id'] == settings.local.host_id:
+                return
+
+        svr.run(send_events=msg.get('send_events'))
+    except:
+        logger.exception('Failed to run server', 'runners')
+
 def _on_msg(msg):
     if msg['message'] != 'start':
         return
@@ -21,7 +41,11 @@ def _on_msg(msg):
         prefered_hosts = msg.get('prefered_hosts')
 
         if prefered_hosts and settings.local.host_id not in prefered_hosts:
-            time.sleep(0.1)
+            # Delay on a separate thread to avoid blocking other listeners
+            thread = threading.Thread(target=_run_fallback, args=(msg,))
+            thread.daemon = True
+            thread.start()
+            return
 
         svr.run(send_events=msg.get('send_events'))
     except:
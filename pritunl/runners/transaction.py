@@ -7,6 +7,29 @@ from pritunl import utils
 
 import threading
 import time
+import collections
+
+def _retry_thread(docs):
+    # Transactions are independent, retries are spread across threads in
+    # priority order
+    while True:
+        try:
+            doc = docs.popleft()
+        except IndexError:
+            return
+
+        logger.info('Transaction timeout retrying...', 'runners',
+            doc=doc,
+        )
+
+        try:
+            transaction.count_retry()
+            tran = transaction.Transaction(doc=doc)
+            tran.run()
+        except:
+            logger.exception('Failed to run transaction', 'runners',
+                transaction_id=doc['_id'],
+            )
 
 @interrupter
 def _check_thread():
@@ -18,18 +41,19 @@ def _check_thread():
                 'ttl_timestamp': {'$lt': utils.now()},
             }
 
-            for doc in collection.find(spec).sort('priority'):
-                logger.info('Transaction timeout retrying...', 'runners',
-                    doc=doc,
-                )
-
-                try:
-                    tran = transaction.Transaction(doc=doc)
-                    tran.run()
-                except:
-                    logger.exception('Failed to run transaction', 'runners',
-                        transaction_id=doc['_id'],
-                    )
+            docs = collections.deque(collection.find(spec).sort('priority'))
+            if docs:
+                threads = []
+                for _ in xrange(min(len(docs),
+                        settings.mongo.tran_retry_threads)):
+                    thread = threading.Thread(target=_retry_thread,
+                        args=(docs,))
+                    thread.daemon = True
+                    thread.start()
+                    threads.append(thread)
+
+                for thread in threads:
+                    thread.join()
 
             yield interrupter_sleep(settings.mongo.tran_ttl)
         except GeneratorExit:
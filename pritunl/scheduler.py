@@ -0,0 +1,118 @@
+from pritunl import callqueue
+from pritunl import logger
+
+import threading
+import itertools
+import heapq
+import time
+
+COMPACT_MIN = 512
+
+class DelayedCall(object):
+    __slots__ = ('run_time', 'func', 'args', 'kwargs', 'cancelled',
+        'scheduler', 'queued')
+
+    def __init__(self, scheduler, run_time, func, args, kwargs):
+        self.scheduler = scheduler
+        self.run_time = run_time
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.cancelled = False
+        self.queued = True
+
+    def cancel(self):
+        with self.scheduler._cond:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            if self.queued:
+                self.scheduler._on_cancel()
+
+class Scheduler(object):
+    def __init__(self, threads=2):
+        self._threads = threads
+        self._heap = []
+        self._cancelled = 0
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._queue = callqueue.CallQueue(checker=lambda: False)
+        self._started = False
+
+    def _start(self):
+        self._started = True
+        self._queue.start(self._threads)
+
+        thread = threading.Thread(target=self._thread)
+        thread.daemon = True
+        thread.start()
+
+    def call_later(self, delay, func, *args, **kwargs):
+        call = DelayedCall(self, time.time() + delay, func, args, kwargs)
+
+        self._cond.acquire()
+        try:
+            if not self._started:
+                self._start()
+
+            heapq.heappush(self._heap,
+                (call.run_time, next(self._counter), call))
+            if self._heap[0][2] is call:
+                self._cond.notify()
+        finally:
+            self._cond.release()
+
+        return call
+
+    def _on_cancel(self):
+        # Must be called with the condition held
+        self._cancelled += 1
+
+        # Drop cancelled calls once they make up most of the heap to
+        # keep frequently rescheduled keys from growing it
+        if self._cancelled > COMPACT_MIN and \
+                self._cancelled > len(self._heap) // 2:
+            self._heap = [x for x in self._heap if not x[2].cancelled]
+            heapq.heapify(self._heap)
+            self._cancelled = 0
+
+    def size(self):
+        return len(self._heap) - self._cancelled
+
+    def _run(self, call):
+        if call.cancelled:
+            return
+        call.func(*call.args, **call.kwargs)
+
+    def _thread(self):
+        while True:
+            try:
+                self._cond.acquire()
+                try:
+                    while True:
+                        if not self._heap:
+                            self._cond.wait()
+                            continue
+
+                        wait = self._heap[0][0] - time.time()
+                        if wait <= 0:
+                            call = heapq.heappop(self._heap)[2]
+                            call.queued = False
+                            if call.cancelled:
+                                self._cancelled -= 1
+                            break
+
+                        self._cond.wait(wait)
+                finally:
+                    self._cond.release()
+
+                if not call.cancelled:
+                    self._queue.put(self._run, call)
+            except:
+                logger.exception('Error in scheduler thread', 'scheduler')
+                time.sleep(0.5)
+
+_scheduler = Scheduler()
+
+def call_later(delay, func, *args, **kwargs):
+    return _scheduler.call_later(delay, func, *args, **kwargs)
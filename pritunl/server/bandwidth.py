@@ -2,12 +2,15 @@ from pritunl.helpers import *
 from pritunl import settings
 from pritunl import mongo
 from pritunl import utils
+from pritunl import rollup
 
 import os
 import json
 import random
 import datetime
 
+_rollup = rollup.Rollup('servers_bandwidth', 'server_id')
+
 class ServerBandwidth(object):
     def __init__(self, server_id):
         self.server_id = server_id
@@ -17,132 +20,54 @@ class ServerBandwidth(object):
         return mongo.get_collection('servers_bandwidth')
 
     def _get_period_timestamp(self, period, timestamp):
-        timestamp -= datetime.timedelta(microseconds=timestamp.microsecond,
-                seconds=timestamp.second)
-
-        if period == '1m':
-            return timestamp
-        elif period == '5m':
-            return timestamp - datetime.timedelta(
-                minutes=timestamp.minute % 5)
-        elif period == '30m':
-            return timestamp - datetime.timedelta(
-                minutes=timestamp.minute % 30)
-        elif period == '2h':
-            return timestamp - datetime.timedelta(
-                hours=timestamp.hour % 2, minutes=timestamp.minute)
-        elif period == '1d':
-            return timestamp - datetime.timedelta(
-                hours=timestamp.hour, minutes=timestamp.minute)
+        return rollup.get_period_timestamp(period, timestamp)
 
     def _get_period_max_timestamp(self, period, timestamp):
-        timestamp -= datetime.timedelta(microseconds=timestamp.microsecond,
-                seconds=timestamp.second)
-
-        if period == '1m':
-            return timestamp - datetime.timedelta(hours=6)
-        elif period == '5m':
-            return timestamp - datetime.timedelta(
-                minutes=timestamp.minute % 5) - datetime.timedelta(days=1)
-        elif period == '30m':
-            return timestamp - datetime.timedelta(
-                minutes=timestamp.minute % 30) - datetime.timedelta(days=7)
-        elif period == '2h':
-            return timestamp - datetime.timedelta(
-                hours=timestamp.hour % 2,
-                minutes=timestamp.minute) - datetime.timedelta(days=30)
-        elif period == '1d':
-            return timestamp - datetime.timedelta(
-                hours=timestamp.hour,
-                minutes=timestamp.minute) - datetime.timedelta(days=365)
+        return rollup.get_period_max_timestamp(period, timestamp)
 
     def add_data(self, timestamp, received, sent):
-        bulk = self.collection.initialize_unordered_bulk_op()
+        _rollup.add(self.server_id, timestamp, {
+            'received': received,
+            'sent': sent,
+        })
 
-        for period in ('1m', '5m', '30m', '2h', '1d'):
-            spec = {
-                'server_id': self.server_id,
-                'period': period,
-                'timestamp': self._get_period_timestamp(period, timestamp),
-            }
-            doc = {'$inc': {
-                'received': received,
-                'sent': sent,
-            }}
-            rem_spec = {
-                'server_id': self.server_id,
-                'period': period,
-                'timestamp': {
-                    '$lt': self._get_period_max_timestamp(period, timestamp),
-                },
-            }
-
-            bulk.find(spec).upsert().update(doc)
-            bulk.find(rem_spec).remove()
-
-        bulk.execute()
+    def flush(self):
+        _rollup.flush(self.server_id)
 
     def get_period(self, period):
         date_end = self._get_period_timestamp(period, utils.now())
-
-        if period == '1m':
-            date_start = date_end - datetime.timedelta(hours=6)
-            date_step = datetime.timedelta(minutes=1)
-        elif period == '5m':
-            date_start = date_end - datetime.timedelta(days=1)
-            date_step = datetime.timedelta(minutes=5)
-        elif period == '30m':
-            date_start = date_end - datetime.timedelta(days=7)
-            date_step = datetime.timedelta(minutes=30)
-        elif period == '2h':
-            date_start = date_end - datetime.timedelta(days=30)
-            date_step = datetime.timedelta(hours=2)
-        elif period == '1d':
-            date_start = date_end - datetime.timedelta(days=365)
-            date_step = datetime.timedelta(days=1)
-        date_cur = date_start
-
-        data = {
-            'received': [],
-            'received_total': 0,
-            'sent': [],
-            'sent_total': 0,
-        }
+        date_start = date_end - rollup.PERIOD_RANGES[period][0]
 
         spec = {
             'server_id': self.server_id,
             'period': period,
+            'timestamp': {'$gte': date_start},
         }
         project = {
+            '_id': False,
             'timestamp': True,
             'received': True,
             'sent': True,
         }
 
-        for doc in self.collection.find(spec, project).sort('timestamp'):
-            if date_cur > doc['timestamp']:
-                continue
-
-            while date_cur < doc['timestamp']:
-                timestamp = int(date_cur.strftime('%s'))
-                data['received'].append((timestamp, 0))
-                data['sent'].append((timestamp, 0))
-                date_cur += date_step
-
-            timestamp = int(doc['timestamp'].strftime('%s'))
-            received = doc['received']
-            sent = doc['sent']
-            data['received'].append((timestamp, received))
-            data['sent'].append((timestamp, sent))
-            data['received_total'] += received
-            data['sent_total'] += sent
-            date_cur += date_step
-
-        while date_cur <= date_end:
-            timestamp = int(date_cur.strftime('%s'))
-            data['received'].append((timestamp, 0))
-            data['sent'].append((timestamp, 0))
-            date_cur += date_step
+        points = {}
+        for doc in self.collection.find(spec, project):
+            points[doc['timestamp']] = doc
+
+        pending = _rollup.get_pending(self.server_id, period)
+        if pending:
+            timestamp, values = pending
+            doc = points.setdefault(timestamp, {
+                'received': 0,
+                'sent': 0,
+            })
+            doc['received'] += values.get('received', 0)
+            doc['sent'] += values.get('sent', 0)
+
+        data = rollup.get_series(period, date_end, points.iteritems(),
+            ('received', 'sent'), 'l')
+        data['received_total'] = sum(x[1] for x in data['received'])
+        data['sent_total'] = sum(x[1] for x in data['sent'])
 
         return data
 
@@ -235,3 +160,4 @@ class ServerBandwidth(object):
         with open(path, 'w') as demo_file:
             demo_file.write(json.dumps(data))
         return data
+
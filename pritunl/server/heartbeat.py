@@ -0,0 +1,174 @@
+from pritunl import settings
+from pritunl import logger
+from pritunl import utils
+from pritunl import mongo
+
+import threading
+import pymongo
+
+_instances = {}
+_lost = set()
+_lock = threading.Lock()
+
+def register(instance):
+    _lock.acquire()
+    try:
+        _instances[instance.id] = instance
+    finally:
+        _lock.release()
+
+def unregister(instance):
+    _lock.acquire()
+    try:
+        _instances.pop(instance.id, None)
+    finally:
+        _lock.release()
+
+def _get_instances():
+    _lock.acquire()
+    try:
+        instances = []
+        for instance in _instances.values():
+            if instance.interrupt:
+                _instances.pop(instance.id, None)
+                continue
+            instances.append(instance)
+        return instances
+    finally:
+        _lock.release()
+
+def _keep_alive_lost(instance):
+    try:
+        instance.keep_alive_lost()
+    except:
+        logger.exception('Failed to stop lost server instance', 'server',
+            server_id=instance.server.id,
+            instance_id=instance.id,
+        )
+    finally:
+        _lock.acquire()
+        try:
+            _lost.discard(instance.id)
+        finally:
+            _lock.release()
+
+def _run_lost(instance):
+    # Skip instances that are already being stopped
+    _lock.acquire()
+    try:
+        if instance.id in _lost:
+            return
+        _lost.add(instance.id)
+    finally:
+        _lock.release()
+
+    thread = threading.Thread(target=_keep_alive_lost, args=(instance,))
+    thread.daemon = True
+    thread.start()
+
+def ping_instances():
+    instances = _get_instances()
+    if not instances:
+        return
+
+    collection = mongo.get_collection('servers')
+    availability_group = settings.local.host.availability_group
+    timestamp = utils.now()
+
+    try:
+        response = collection.bulk_write([
+            pymongo.UpdateOne({
+                '_id': instance.server.id,
+                'availability_group': availability_group,
+                'instances.instance_id': instance.id,
+            }, {'$set': {
+                'instances.$.ping_timestamp': timestamp,
+            }}) for instance in instances
+        ], ordered=False)
+
+        if response.matched_count >= len(instances):
+            for instance in instances:
+                instance.keep_alive_error_count = 0
+            return
+
+        live = set()
+        for doc in collection.find({
+                    '_id': {'$in': list(set(
+                        x.server.id for x in instances))},
+                    'availability_group': availability_group,
+                }, {
+                    '_id': True,
+                    'instances.instance_id': True,
+                }):
+            for doc_instance in doc.get('instances') or []:
+                live.add((doc['_id'], doc_instance.get('instance_id')))
+    except:
+        logger.exception('Failed to update server pings', 'server',
+            instance_count=len(instances),
+        )
+
+        for instance in instances:
+            instance.keep_alive_error_count += 1
+            if instance.keep_alive_error_count >= 10:
+                logger.error(
+                    'Failed to update server ping, stopping server',
+                    'server',
+                    server_id=instance.server.id,
+                )
+                _run_lost(instance)
+        return
+
+    for instance in instances:
+        if (instance.server.id, instance.id) in live:
+            instance.keep_alive_error_count = 0
+        else:
+            _run_lost(instance)
+
+def ping_route_advertisements():
+    pings = []
+    for instance in _get_instances():
+        for ra_id in instance.route_advertisements.copy():
+            pings.append((instance, ra_id))
+
+    if not pings:
+        return
+
+    collection = mongo.get_collection('routes_reserve')
+    timestamp = utils.now()
+
+    response = collection.bulk_write([
+        pymongo.UpdateOne({
+            '_id': ra_id,
+            'instance_id': instance.id,
+        }, {'$set': {
+            'timestamp': timestamp,
+        }}) for instance, ra_id in pings
+    ], ordered=False)
+
+    if response.matched_count >= len(pings):
+        return
+
+    live = set()
+    for doc in collection.find({
+                '_id': {'$in': [x[1] for x in pings]},
+            }, {
+                '_id': True,
+                'instance_id': True,
+            }):
+        live.add((doc['_id'], doc.get('instance_id')))
+
+    for instance, ra_id in pings:
+        if (ra_id, instance.id) in live:
+            continue
+
+        logger.error(
+            'Lost route advertisement reserve',
+            'server',
+            server_id=instance.server.id,
+            instance_id=instance.id,
+            route_id=ra_id,
+        )
+        try:
+            instance.route_advertisements.remove(ra_id)
+        except KeyError:
+            pass
@@ -1,6 +1,7 @@
 from pritunl.server.instance_com import ServerInstanceCom
 from pritunl.server.instance_link import ServerInstanceLink
 from pritunl.server.bridge import add_interface, rem_interface
+from pritunl.server import heartbeat
 
 from pritunl.constants import *
 from pritunl.exceptions import *
@@ -53,6 +54,7 @@ class ServerInstance(object):
         self.tun_nat = False
         self.server_links = []
         self.route_advertisements = set()
+        self.keep_alive_error_count = 0
         self._temp_path = utils.get_temp_path()
         self.ovpn_conf_path = os.path.join(self._temp_path, OVPN_CONF_NAME)
         self.wg_private_key_path = os.path.join(
@@ -476,6 +478,7 @@ class ServerInstance(object):
         self.iptables.ipv6_firewall = ipv6_firewall
         self.iptables.inter_client = self.server.inter_client
         self.iptables.restrict_routes = self.server.restrict_routes
+        self.iptables.ipset = settings.vpn.iptables_ipset
 
         if self.server.wg:
             self.iptables_wg.add_route(self.server.network_wg)
@@ -1031,116 +1034,29 @@ class ServerInstance(object):
         except GeneratorExit:
             self.stop_process()
 
-    @interrupter
-    def _keep_alive_thread(self):
-        try:
-            error_count = 0
-
-            while not self.interrupt:
-                try:
-                    doc = self.collection.find_and_modify({
-                        '_id': self.server.id,
-                        'availability_group': \
-                            settings.local.host.availability_group,
-                        'instances.instance_id': self.id,
-                    }, {'$set': {
-                        'instances.$.ping_timestamp': utils.now(),
-                    }}, fields={
-                        '_id': False,
-                        'instances': True,
-                    }, new=True)
-
-                    yield
-
-                    if not doc:
-                        doc = self.collection.find_one({
-                            '_id': self.server.id,
-                        })
-
-                        doc_hosts = ((doc or {}).get('hosts') or [])
-                        if settings.local.host_id in doc_hosts:
-                            logger.error(
-                                'Instance doc lost, stopping server. ' +
-                                'Check datetime settings',
-                                'server',
-                                server_id=self.server.id,
-                                instance_id=self.id,
-                                cur_timestamp=utils.now(),
-                            )
-
-                        if self.stop_process():
-                            break
-                        else:
-                            time.sleep(1)
-                            continue
-                    else:
-                        error_count = 0
-
-                    yield
-                except GeneratorExit:
-                    self.stop_process()
-                except:
-                    error_count += 1
-                    if error_count >= 10 and self.stop_process():
-                        logger.exception(
-                            'Failed to update server ping, stopping server',
-                            'server',
-                            server_id=self.server.id,
-                        )
-                        break
-
-                    logger.exception('Failed to update server ping',
-                        'server',
-                        server_id=self.server.id,
-                    )
-                    time.sleep(2)
-
-                yield interrupter_sleep(settings.vpn.server_ping)
-        except GeneratorExit:
-            self.stop_process()
-
-    @interrupter
-    def _route_ad_keep_alive_thread(self):
-        try:
-            while not self.interrupt:
-                try:
-                    for ra_id in self.route_advertisements.copy():
-                        yield
-
-                        response = self.routes_collection.update_one({
-                            '_id': ra_id,
-                            'instance_id': self.id,
-                        }, {'$set': {
-                            'timestamp': utils.now(),
-                        }})
+    def keep_alive_lost(self):
+        if self.interrupt:
+            return
 
-                        if not response.modified_count:
-                            logger.error(
-                                'Lost route advertisement reserve',
-                                'server',
-                                server_id=self.server.id,
-                                instance_id=self.id,
-                                route_id=ra_id,
-                            )
-                            try:
-                                self.route_advertisements.remove(ra_id)
-                            except KeyError:
-                                pass
+        doc = self.collection.find_one({
+            '_id': self.server.id,
+        })
 
-                    yield
-                except GeneratorExit:
-                    pass
-                except:
-                    logger.exception(
-                        'Failed to update route advertisement',
-                        'server',
-                        server_id=self.server.id,
-                    )
-                    time.sleep(1)
+        doc_hosts = ((doc or {}).get('hosts') or [])
+        if settings.local.host_id in doc_hosts:
+            logger.error(
+                'Instance doc lost, stopping server. ' +
+                'Check datetime settings',
+                'server',
+                server_id=self.server.id,
+                instance_id=self.id,
+                cur_timestamp=utils.now(),
+            )
 
-                yield interrupter_sleep(settings.vpn.route_ping)
-        except GeneratorExit:
-            pass
+        while not self.interrupt:
+            if self.stop_process():
+                break
+            time.sleep(1)
 
     def _iptables_thread(self):
         if not settings.vpn.iptables_update:
@@ -1151,9 +1067,14 @@ class ServerInstance(object):
 
         while not self.interrupt:
             try:
-                self.iptables.upsert_rules(log=True)
-                if self.server.wg:
-                    self.iptables_wg.upsert_rules(log=True)
+                if settings.vpn.iptables_update_mode == 'snapshot':
+                    self.iptables.reconcile_rules(log=True)
+                    if self.server.wg:
+                        self.iptables_wg.reconcile_rules(log=True)
+                else:
+                    self.iptables.upsert_rules(log=True)
+                    if self.server.wg:
+                        self.iptables_wg.upsert_rules(log=True)
                 if self.interrupter_sleep(
                         settings.vpn.iptables_update_rate):
                     return
@@ -1442,13 +1363,7 @@ class ServerInstance(object):
         thread.daemon = True
         thread.start()
 
-        thread = threading.Thread(target=self._keep_alive_thread)
-        thread.daemon = True
-        thread.start()
-
-        thread = threading.Thread(target=self._route_ad_keep_alive_thread)
-        thread.daemon = True
-        thread.start()
+        heartbeat.register(self)
 
         thread = threading.Thread(target=self._iptables_thread)
         thread.daemon = True
@@ -1572,6 +1487,10 @@ class ServerInstance(object):
                 self.state = 'upsert_iptables_rules_wg'
                 self.iptables_wg.upsert_rules()
 
+            if self.iptables.ipset:
+                self.state = 'init_ipsets'
+                self.iptables.init_ipsets()
+
             if self.is_interrupted():
                 return
 
@@ -1748,6 +1667,16 @@ class ServerInstance(object):
 
             self.interrupt = True
             self.sock_interrupt = True
+            heartbeat.unregister(self)
+
+            try:
+                self.server.bandwidth.flush()
+            except:
+                logger.exception('Failed to flush server bandwidth',
+                    'server',
+                    server_id=self.server.id,
+                    instance_id=self.id,
+                )
 
             try:
                 self.bridge_stop()
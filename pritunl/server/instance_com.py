@@ -244,20 +244,16 @@ class ServerInstanceCom(object):
                 self.bytes_sent = 0
                 self.bytes_lock.release()
 
-                monitoring.insert_point('server_bandwidth', {
+                tags = {
                     'host': settings.local.host.name,
                     'server': self.server.name,
-                }, {
-                    'bytes_sent': bytes_sent,
-                    'bytes_recv': bytes_recv,
-                })
-
-                monitoring.insert_point('server', {
-                    'host': settings.local.host.name,
-                    'server': self.server.name,
-                }, {
-                    'device_count': self.clients.clients.count({}),
-                })
+                }
+                monitoring.add_counter('server_bandwidth', tags,
+                    'bytes_sent', bytes_sent)
+                monitoring.add_counter('server_bandwidth', tags,
+                    'bytes_recv', bytes_recv)
+                monitoring.set_gauge('server', tags, 'device_count',
+                    self.clients.clients.count({}))
 
                 if bytes_recv != 0 or bytes_sent != 0:
                     self.server.bandwidth.add_data(
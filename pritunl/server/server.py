@@ -19,6 +19,7 @@ from pritunl import messenger
 from pritunl import organization
 from pritunl import ipaddress
 from pritunl import journal
+from pritunl import tombstone
 
 import os
 import subprocess
@@ -1211,6 +1212,7 @@ class Server(mongo.MongoObject):
         })
         self.remove_primary_user()
 
+        tombstone.add(tombstone.SERVER, self.id)
         mongo.MongoObject.remove(self)
 
         return link_ids
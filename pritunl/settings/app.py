@@ -6,6 +6,7 @@ class SettingsApp(SettingsGroupMongo):
         'secondary_mongodb_uri': None,
         'redis_uri': None,
         'redis_timeout': 6,
+        'redis_publish_interval': 0.005,
         'server_debug': False,
         'server_ssl': True,
         'server_port': 443,
@@ -19,18 +20,37 @@ class SettingsApp(SettingsGroupMongo):
         'demo_mode': False,
         'allow_insecure_session': False,
         'auditing': None,
+        'audit_buffer_size': 10000,
+        'audit_batch_size': 500,
+        'audit_flush_interval': 1,
+        'audit_overflow': 'inline',
+        'proc_max_workers': 32,
+        'gc_delay': 60,
+        'gc_chunk_size': 500,
+        'gc_pass_chunks': 200,
+        'gc_full_scan': False,
         'monitoring': None,
         'plugin_requred': None,
         'plugin_directory': '/var/lib/pritunl/plugins',
         'plugin_queue_size': 512,
         'plugin_queue_threads': 10,
+        'plugin_batch_size': 100,
+        'plugin_overflow': 'drop_oldest',
+        'plugin_caller_timeout': 30,
+        'plugin_caller_threads': 16,
         'influxdb_uri': None,
         'influxdb_prefix': 'pritunl_',
         'influxdb_interval': 3,
+        'influxdb_buffer_size': 50000,
+        'influxdb_spill_path': None,
+        'influxdb_spill_size': 52428800,
+        'rollup_flush_interval': 300,
         'settings_check_interval': 60,
         'key_link_timeout': 86400,
         'key_link_timeout_short': 600,
         'password_len_limit': 128,
+        'hash_verify_processes': 2,
+        'hash_verify_timeout': 30,
         'public_ip_server': 'https://app4.pritunl.com/ip',
         'public_ip6_server': 'https://app6.pritunl.com/ip',
         'notification_server': 'https://app.pritunl.com/notification',
@@ -60,6 +80,11 @@ class SettingsApp(SettingsGroupMongo):
         'auth_expire_window': 86400,
         'auth_limiter_ttl': 600,
         'auth_limiter_count_max': 20,
+        'admin_session_cache_ttl': 10,
+        'admin_session_cache_size': 10000,
+        'auth_nonce_async': False,
+        'auth_nonce_cache_size': 100000,
+        'auth_nonce_flush_interval': 1,
         'wg_public_key_ttl': 604800,
         'org_pool_size': 1,
         'user_pool_size': 6,
@@ -83,6 +108,8 @@ class SettingsApp(SettingsGroupMongo):
         'sso_client_cache_window': 21600,
         'sso_match': None,
         'sso_timeout': 60,
+        'sso_pool_size': 10,
+        'sso_lookup_cache_ttl': 30,
         'sso_org': None,
         'sso_azure_mode': 'org',
         'sso_azure_directory_id': None,
@@ -116,6 +143,8 @@ class SettingsApp(SettingsGroupMongo):
         'sso_radius_host': None,
         'sso_radius_secret': None,
         'sso_radius_timeout': None,
+        'sso_radius_hedge_delay': None,
+        'sso_radius_down_ttl': 30,
         'sso_duo_host': None,
         'sso_duo_token': None,
         'sso_duo_secret': None,
@@ -6,16 +6,24 @@ class SettingsGroupMongo(SettingsGroupBase):
     type = GROUP_MONGO
 
     def __init__(self):
+        self.previous = {}
         self.changed = set()
         self.unseted = set()
 
     def __setattr__(self, name, value):
         if name != 'fields' and name in self.fields:
             self.changed.add(name)
+            self._set_previous(name)
         object.__setattr__(self, name, value)
 
+    def _set_previous(self, name):
+        if name not in self.previous:
+            self.previous[name] = self.__dict__.get(name, self.fields[name])
+
     def unset(self, name):
         self.unseted.add(name)
+        if name in self.fields:
+            self._set_previous(name)
         try:
             delattr(self, name)
         except AttributeError:
@@ -46,3 +54,15 @@ class SettingsGroupMongo(SettingsGroupBase):
 
         if len(doc) > 1:
             return doc
+
+    def pop_changes(self):
+        changes = {}
+
+        for field, val in self.previous.items():
+            cur_val = getattr(self, field)
+            if cur_val != val:
+                changes[field] = cur_val
+
+        self.previous = {}
+
+        return changes
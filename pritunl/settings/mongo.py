@@ -5,6 +5,8 @@ class SettingsMongo(SettingsGroupMongo):
     fields = {
         'tran_max_attempts': 6,
         'tran_ttl': 10,
+        'tran_retry_threads': 4,
+        'index_build_threads': 4,
         'queue_max_attempts': 3,
         'queue_ttl': 15,
         'task_max_attempts': 3,
@@ -8,6 +8,8 @@ from pritunl.settings.vpn import SettingsVpn
 from pritunl.constants import *
 from pritunl.helpers import *
 
+import bson
+
 module_classes = (
     SettingsApp,
     SettingsConf,
@@ -21,6 +23,8 @@ class Settings(object):
     def __init__(self):
         self._running = False
         self._loaded = False
+        self._watchers = []
+        self._versions = {}
         self._init_modules()
 
     @cached_static_property
@@ -37,15 +41,77 @@ class Settings(object):
 
         return groups
 
+    def watch(self, group, fields, callback):
+        self._watchers.append((
+            group,
+            frozenset(fields) if fields else None,
+            callback,
+        ))
+
+    def get_version(self, group):
+        return self._versions.get(group)
+
+    def _notify(self, group, changes):
+        if not changes:
+            return
+
+        for watch_group, fields, callback in self._watchers:
+            if watch_group != group:
+                continue
+
+            if fields is None:
+                watch_changes = changes
+            else:
+                watch_changes = {x: changes[x] for x in fields
+                    if x in changes}
+                if not watch_changes:
+                    continue
+
+            try:
+                callback(watch_changes)
+            except:
+                from pritunl import logger
+                logger.exception('Settings watcher failed', 'settings',
+                    group=group,
+                    fields=watch_changes.keys(),
+                )
+
+    def _apply(self, group_name, values, version=None, replace=False):
+        group = getattr(self, group_name)
+        changes = {}
+
+        if replace:
+            for field, val in group.fields.items():
+                if field in values:
+                    continue
+                if field in group.__dict__:
+                    if group.__dict__.pop(field) != val:
+                        changes[field] = val
+
+        for field, val in values.items():
+            if group.__dict__.get(field, group.fields.get(field)) != val:
+                changes[field] = val
+            group.__dict__[field] = val
+
+        if version is not None:
+            self._versions[group_name] = version
+
+        self._notify(group_name, changes)
+
     def on_msg(self, msg):
         docs = msg['message']
 
         for doc in docs:
-            group = getattr(self, doc['_id'])
+            if doc['_id'] not in self.groups:
+                continue
+
+            values = {}
             for field, val in doc.items():
-                if field == '_id':
+                if field == '_id' or field == '_version':
                     continue
-                setattr(group, field, val)
+                values[field] = val
+
+            self._apply(doc['_id'], values, version=doc.get('_version'))
 
     def commit(self, init=False):
         from pritunl import messenger
@@ -53,6 +119,8 @@ class Settings(object):
 
         docs = []
         has_docs = False
+        changes = {}
+        version = bson.ObjectId()
         tran = transaction.Transaction()
         collection = tran.collection(self.collection.name_str)
 
@@ -64,6 +132,7 @@ class Settings(object):
             doc = group_cls.get_commit_doc(init)
             if doc:
                 has_docs = True
+                doc['_version'] = version
                 collection.bulk().find({
                     '_id': doc['_id'],
                 }).upsert().update({
@@ -78,14 +147,20 @@ class Settings(object):
                     '_id': doc_id,
                 }).upsert().update({
                     '$unset': unset_doc,
+                    '$set': {
+                        '_version': version,
+                    },
                 })
 
-                doc = doc or {'_id': doc_id}
+                doc = doc or {'_id': doc_id, '_version': version}
                 for key in unset_doc:
                     doc[key] = getattr(group_cls, key)
 
             if doc:
                 docs.append(doc)
+                self._versions[group] = version
+
+            changes[group] = group_cls.pop_changes()
 
         messenger.publish('setting', docs, transaction=tran)
 
@@ -95,29 +170,44 @@ class Settings(object):
         collection.bulk_execute()
         tran.commit()
 
+        for group, group_changes in changes.items():
+            self._notify(group, group_changes)
+
     def _load_mongo(self):
         for cls in module_classes:
             if cls.type != GROUP_MONGO:
                 continue
             setattr(self, cls.group, cls())
 
-        self.reload_mongo()
+        self.reload_mongo(True)
 
         self._loaded = True
 
-    def reload_mongo(self):
-        for doc in self.collection.find():
+    def reload_mongo(self, force=False):
+        spec = {}
+
+        if not force:
+            stale = []
+            for doc in self.collection.find({}, {
+                        '_version': True,
+                    }):
+                version = doc.get('_version')
+                if doc['_id'] in self.groups and (version is None or
+                        version != self._versions.get(doc['_id'])):
+                    stale.append(doc['_id'])
+
+            if not stale:
+                return
+
+            spec['_id'] = {'$in': stale}
+
+        for doc in self.collection.find(spec):
             group_name = doc.pop('_id')
             if group_name not in self.groups:
                 continue
 
-            group = getattr(self, group_name)
-
-            data = {}
-            data.update(group.fields)
-            data.update(doc)
-
-            group.__dict__.update(data)
+            version = doc.pop('_version', None)
+            self._apply(group_name, doc, version=version, replace=True)
 
     def _init_modules(self):
         for cls in module_classes:
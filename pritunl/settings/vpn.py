@@ -17,6 +17,11 @@ class SettingsVpn(SettingsGroupMongo):
         'log_lines': 5000,
         'server_ping': 10,
         'server_ping_ttl': 30,
+        'placement_cpu_weight': 1.0,
+        'placement_mem_weight': 1.0,
+        'placement_server_weight': 5.0,
+        'placement_device_weight': 0.05,
+        'placement_fallback_delay': 2,
         'route_ping': 10,
         'route_ping_ttl': 30,
         'dns_mapping_push_all': True,
@@ -26,6 +31,10 @@ class SettingsVpn(SettingsGroupMongo):
         'link_timeout': 20,
         'iptables_update': False,
         'iptables_update_rate': 900,
+        'iptables_update_mode': 'snapshot',
+        'iptables_restore_timeout': 30,
+        'iptables_ipset': False,
+        'client_conf_cache_ttl': 30,
         'bandwidth_update_rate': 15,
         'nat_routes': True,
         'ipv6_prefix': 'fd00',
@@ -7,6 +7,7 @@ from pritunl.setup.mongo import setup_mongo, upsert_indexes
 from pritunl.setup.boto_conf import setup_boto_conf
 from pritunl.setup.cache import setup_cache
 from pritunl.setup.temp_path import setup_temp_path
+from pritunl.setup.static import setup_static
 from pritunl.setup.logger import setup_logger
 from pritunl.setup.signal_handler import setup_signal_handler
 from pritunl.setup.public_ip import setup_public_ip
@@ -14,6 +15,7 @@ from pritunl.setup.poolers import setup_poolers
 from pritunl.setup.host import setup_host
 from pritunl.setup.server_listeners import setup_server_listeners
 from pritunl.setup.settings import setup_settings
+from pritunl.setup.auth import setup_auth
 from pritunl.setup.dns import setup_dns
 from pritunl.setup.ndppd import setup_ndppd
 from pritunl.setup.monitoring import setup_monitoring
@@ -36,11 +38,13 @@ def setup_all():
     try:
         setup_clean()
         setup_temp_path()
+        setup_static()
         setup_signal_handler()
         setup_vault()
         setup_server()
         setup_mongo()
         setup_settings()
+        setup_auth()
         setup_boto_conf()
         setup_public_ip()
         setup_host()
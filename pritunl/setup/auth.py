@@ -0,0 +1,4 @@
+from pritunl import auth
+
+def setup_auth():
+    auth.init_verify_pool()
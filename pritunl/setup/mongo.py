@@ -9,6 +9,8 @@ from pritunl import utils
 import pymongo
 import pymongo.helpers
 import time
+import sys
+import threading
 import collections
 
 def _get_read_pref(name):
@@ -25,25 +27,120 @@ def _get_read_pref(name):
             pymongo.read_preferences.ReadPreference.NEAREST,
     }.get(name)
 
+INDEX_OPTIONS = ('unique', 'sparse', 'expireAfterSeconds',
+    'partialFilterExpression')
+
 coll_indexes = collections.defaultdict(set)
+_index_builds = collections.OrderedDict()
 
 def upsert_index(coll_name, index, **kwargs):
-    coll = mongo.get_collection(coll_name)
-
     keys = pymongo.helpers._index_list(index)
     name = pymongo.helpers._gen_index_name(keys)
     coll_indexes[coll_name].add(name)
 
+    # Later definitions of the same index replace earlier ones
+    if coll_name not in _index_builds:
+        _index_builds[coll_name] = collections.OrderedDict()
+    _index_builds[coll_name][name] = (keys, kwargs)
+
+def _index_matches(info, keys, kwargs):
+    if not info or [tuple(x) for x in info['key']] != \
+            [tuple(x) for x in keys]:
+        return False
+
+    for option in INDEX_OPTIONS:
+        cur_value = info.get(option)
+        value = kwargs.get(option)
+        if option in ('unique', 'sparse'):
+            cur_value = bool(cur_value)
+            value = bool(value)
+        elif option == 'expireAfterSeconds' and cur_value is not None:
+            cur_value = int(cur_value)
+        if cur_value != value:
+            return False
+
+    return True
+
+def _build_coll_indexes(coll_name, builds):
+    coll = mongo.get_collection(coll_name)
+    built = 0
+    skipped = 0
+
     try:
-        coll.create_index(index, **kwargs)
-    except:
-        try:
-            keys = pymongo.helpers._index_list(index)
-            name = pymongo.helpers._gen_index_name(keys)
+        index_info = coll.index_information()
+    except pymongo.errors.OperationFailure:
+        index_info = {}
+
+    for name, (keys, kwargs) in builds.items():
+        info = index_info.get(name)
+        if _index_matches(info, keys, kwargs):
+            skipped += 1
+            continue
+
+        start = time.time()
+        if info:
+            # Options changed, index must be rebuilt
             coll.drop_index(name)
+
+        try:
+            coll.create_index(keys, **kwargs)
         except:
-            pass
-        coll.create_index(index, **kwargs)
+            try:
+                coll.drop_index(name)
+            except:
+                pass
+            coll.create_index(keys, **kwargs)
+
+        built += 1
+        logger.info('Built mongodb index', 'setup',
+            collection=coll_name,
+            index=name,
+            duration=int((time.time() - start) * 1000),
+        )
+
+    return built, skipped
+
+def _build_thread(pending, results, errors):
+    while True:
+        try:
+            coll_name, builds = pending.popleft()
+        except IndexError:
+            return
+
+        try:
+            results.append(_build_coll_indexes(coll_name, builds))
+        except:
+            errors.append(sys.exc_info())
+
+def build_indexes():
+    # Compare wanted indexes with the existing indexes and only build the
+    # missing or changed ones, collections are built in parallel
+    pending = collections.deque(_index_builds.items())
+    _index_builds.clear()
+    results = []
+    errors = []
+    start = time.time()
+
+    threads = []
+    for _ in xrange(max(1, min(settings.mongo.index_build_threads,
+            len(pending)))):
+        thread = threading.Thread(target=_build_thread,
+            args=(pending, results, errors))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+
+    logger.info('Updated mongodb indexes', 'setup',
+        built=sum(x[0] for x in results),
+        skipped=sum(x[1] for x in results),
+        duration=int((time.time() - start) * 1000),
+    )
 
 def drop_index(coll, index, **kwargs):
     try:
@@ -125,6 +222,10 @@ def upsert_indexes():
         ('org_id', pymongo.ASCENDING),
         ('name', pymongo.ASCENDING),
     ], background=True)
+    upsert_index('users', [
+        ('org_id', pymongo.ASCENDING),
+        ('_id', pymongo.ASCENDING),
+    ], background=True)
     upsert_index('users', [
         ('name', pymongo.ASCENDING),
         ('auth_type', pymongo.ASCENDING),
@@ -204,6 +305,12 @@ def upsert_indexes():
     ], background=True)
     upsert_index('servers_ip_pool', 'user_id',
         background=True)
+    upsert_index('servers_ip_pool', [
+        ('org_id', pymongo.ASCENDING),
+        ('_id', pymongo.ASCENDING),
+    ], background=True)
+    upsert_index('tombstones', 'timestamp',
+        background=True)
     upsert_index('links_hosts', 'link_id',
         background=True)
     upsert_index('links_hosts', [
@@ -296,6 +403,8 @@ def upsert_indexes():
     upsert_index('sso_passcode_cache', 'timestamp',
         background=True, expireAfterSeconds=settings.app.sso_cache_timeout)
 
+    build_indexes()
+
     try:
         clean_indexes()
     except:
@@ -429,6 +538,7 @@ def setup_mongo():
         'sso_client_cache': 2,
         'sso_passcode_cache': 2,
         'vxlans': 1,
+        'tombstones': 1,
         'logs': 1,
         'log_entries': 1,
     }
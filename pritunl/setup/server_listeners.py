@@ -1,8 +1,11 @@
 from pritunl import listener
 
 def setup_server_listeners():
+    from pritunl import auth
     from pritunl import clients
     from pritunl import vxlan
     listener.add_listener('port_forwarding', clients.on_port_forwarding)
     listener.add_listener('client', clients.on_client)
+    listener.add_listener('events', clients.on_event)
     listener.add_listener('vxlan', vxlan.on_vxlan)
+    listener.add_listener('administrators', auth.on_admin_msg)
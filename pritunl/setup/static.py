@@ -0,0 +1,6 @@
+from pritunl import settings
+from pritunl import static
+
+def setup_static():
+    if settings.conf.static_cache:
+        static.bundle.build(settings.conf.www_path)
@@ -6,4 +6,5 @@ from pritunl.sso.google import verify_google
 from pritunl.sso.radius import verify_radius
 from pritunl.sso.okta import auth_okta, auth_okta_secondary
 from pritunl.sso.onelogin import auth_onelogin, auth_onelogin_secondary
+from pritunl.sso.session import get_stats
 from pritunl.sso.utils import *
@@ -1,11 +1,11 @@
 from pritunl import settings
 from pritunl import logger
+from pritunl.sso import session
 
 import json
-import requests
 
-def verify_authzero(user_name):
-    response = requests.post(
+def _get_access_token():
+    response = session.post('authzero',
         'https://%s.auth0.com/oauth/token' % settings.app.sso_authzero_domain,
         headers={
             'Content-Type': 'application/json',
@@ -23,17 +23,27 @@ def verify_authzero(user_name):
     if response.status_code != 200:
         logger.error('Bad status from Auth0 api',
             'sso',
-            user_name=user_name,
             status_code=response.status_code,
             response=response.content,
         )
-        return False, []
+        return None
 
     data = response.json()
 
-    access_token = data['access_token']
+    return data['access_token'], data.get('expires_in')
+
+def verify_authzero(user_name):
+    token_key = (
+        settings.app.sso_authzero_domain,
+        settings.app.sso_authzero_app_id,
+        settings.app.sso_authzero_app_secret,
+    )
+    access_token = session.get_token('authzero', token_key,
+        _get_access_token)
+    if not access_token:
+        return False, []
 
-    response = requests.get(
+    response = session.get('authzero',
         'https://%s.auth0.com/api/v2/users' % (
             settings.app.sso_authzero_domain,
         ),
@@ -47,6 +57,9 @@ def verify_authzero(user_name):
         timeout=30,
     )
 
+    if response.status_code == 401:
+        session.clear_token('authzero', token_key)
+
     if response.status_code != 200:
         logger.error('Bad status from Auth0 api',
             'sso',
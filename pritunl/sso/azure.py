@@ -1,11 +1,11 @@
 from pritunl import settings
 from pritunl import logger
+from pritunl.sso import session
 
-import requests
 import urllib
 
-def verify_azure(user_name):
-    response = requests.post(
+def _get_access_token():
+    response = session.post('azure',
         'https://login.microsoftonline.com/%s/oauth2/token' % \
             settings.app.sso_azure_directory_id,
         headers={
@@ -26,13 +26,23 @@ def verify_azure(user_name):
             status_code=response.status_code,
             response=response.content,
         )
-        return False, []
+        return None
 
     data = response.json()
 
-    access_token = data['access_token']
+    return data['access_token'], data.get('expires_in')
 
-    response = requests.get(
+def verify_azure(user_name):
+    token_key = (
+        settings.app.sso_azure_directory_id,
+        settings.app.sso_azure_app_id,
+        settings.app.sso_azure_app_secret,
+    )
+    access_token = session.get_token('azure', token_key, _get_access_token)
+    if not access_token:
+        return False, []
+
+    response = session.get('azure',
         'https://graph.windows.net/%s/users/%s' % (
             settings.app.sso_azure_directory_id,
             urllib.quote(user_name),
@@ -46,6 +56,9 @@ def verify_azure(user_name):
         timeout=30,
     )
 
+    if response.status_code == 401:
+        session.clear_token('azure', token_key)
+
     if response.status_code != 200:
         logger.error('Bad status from Azure api',
             'sso',
@@ -64,7 +77,7 @@ def verify_azure(user_name):
         )
         return False, []
 
-    response = requests.get(
+    response = session.get('azure',
         'https://graph.windows.net/%s/users/%s/memberOf' % (
             settings.app.sso_azure_directory_id,
             urllib.quote(user_name),
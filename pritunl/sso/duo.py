@@ -2,13 +2,13 @@ from pritunl.exceptions import *
 from pritunl.constants import *
 from pritunl import settings
 from pritunl import logger
+from pritunl.sso import session
 
 import base64
 import email
 import hmac
 import hashlib
 import urllib
-import requests
 
 def _sign(method, path, params):
     now = email.Utils.formatdate()
@@ -80,7 +80,7 @@ class Duo(object):
         url = 'https://%s/auth/v2/auth' % settings.app.sso_duo_host
 
         try:
-            response = requests.post(url,
+            response = session.post('duo', url,
                 headers=headers,
                 params=params,
                 timeout=30,
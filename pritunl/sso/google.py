@@ -1,10 +1,29 @@
 from pritunl import settings
+from pritunl.sso import session
 
 import json
 import StringIO
 import apiclient.discovery
 import oauth2client.service_account
 
+_credentials = {}
+_discovery_cache = session.DiscoveryCache()
+
+def _get_credentials(google_key, google_email):
+    data = json.loads(google_key)
+
+    credentials = oauth2client.service_account. \
+        ServiceAccountCredentials.from_p12_keyfile_buffer(
+        data['client_email'],
+        StringIO.StringIO(data['private_key']),
+        'notasecret',
+        scopes=[
+            'https://www.googleapis.com/auth/admin.directory.group.readonly',
+        ],
+    )
+
+    return credentials.create_delegated(google_email)
+
 def verify_google(user_email):
     user_domain = user_email.split('@')[-1]
 
@@ -20,22 +39,20 @@ def verify_google(user_email):
     if not google_key or not google_email:
         return True, []
 
-    data = json.loads(google_key)
+    cred_key = (google_key, google_email)
+    credentials = _credentials.get(cred_key)
+    if not credentials:
+        credentials = _get_credentials(google_key, google_email)
+        _credentials.clear()
+        _credentials[cred_key] = credentials
 
-    credentials = oauth2client.service_account. \
-        ServiceAccountCredentials.from_p12_keyfile_buffer(
-        data['client_email'],
-        StringIO.StringIO(data['private_key']),
-        'notasecret',
-        scopes=[
-            'https://www.googleapis.com/auth/admin.directory.group.readonly',
-        ],
-    )
-
-    credentials = credentials.create_delegated(google_email)
+    groups = session.cache_get('google', user_email)
+    if groups is not None:
+        return True, list(groups)
 
     service = apiclient.discovery.build(
-        'admin', 'directory_v1', credentials=credentials)
+        'admin', 'directory_v1', credentials=credentials,
+        cache=_discovery_cache)
 
     results = service.groups().list(userKey=user_email).execute()
 
@@ -43,4 +60,6 @@ def verify_google(user_email):
     for group in results.get('groups') or []:
         groups.append(group['name'].replace(' ', ''))
 
+    session.cache_set('google', user_email, list(groups))
+
     return True, groups
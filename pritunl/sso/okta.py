@@ -1,19 +1,26 @@
 from pritunl import settings
 from pritunl import logger
+from pritunl.sso import session
 
 import urllib
 import httplib
 import time
 import urlparse
-import requests
 
 def _getokta_url():
     parsed = urlparse.urlparse(settings.app.sso_saml_url)
     return '%s://%s' % (parsed.scheme, parsed.netloc)
 
 def get_user_id(username):
+    # Include the tenant and token to not return ids from old settings
+    cache_key = (_getokta_url(), settings.app.sso_okta_token, username)
+
+    user_id = session.cache_get('okta', cache_key)
+    if user_id:
+        return user_id
+
     try:
-        response = requests.get(
+        response = session.get('okta',
             _getokta_url() + '/api/v1/users/%s' % urllib.quote(username),
             headers={
                 'Accept': 'application/json',
@@ -51,6 +58,8 @@ def get_user_id(username):
         )
         return None
 
+    session.cache_set('okta', cache_key, user_id)
+
     return user_id
 
 def auth_okta(username):
@@ -63,7 +72,7 @@ def auth_okta(username):
         return True
 
     try:
-        response = requests.get(
+        response = session.get('okta',
             _getokta_url() + \
             '/api/v1/apps/%s/users/%s' % (okta_app_id, user_id),
             headers={
@@ -121,7 +130,7 @@ def auth_okta_secondary(username, passcode, remote_ip, okta_mode):
         return False
 
     try:
-        response = requests.get(
+        response = session.get('okta',
             _getokta_url() + '/api/v1/users/%s/factors' % user_id,
             headers={
                 'Accept': 'application/json',
@@ -199,7 +208,7 @@ def auth_okta_secondary(username, passcode, remote_ip, okta_mode):
     )
 
     try:
-        response = requests.post(
+        response = session.post('okta',
             _getokta_url() + '/api/v1/users/%s/factors/%s/verify' % (
                 user_id, factor_id),
             headers={
@@ -282,7 +291,7 @@ def auth_okta_secondary(username, passcode, remote_ip, okta_mode):
         time.sleep(settings.app.sso_okta_poll_rate)
 
         try:
-            response = requests.get(
+            response = session.get('okta',
                 poll_url,
                 headers={
                     'Accept': 'application/json',
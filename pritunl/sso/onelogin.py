@@ -2,18 +2,18 @@ from pritunl.constants import *
 from pritunl import settings
 from pritunl import logger
 from pritunl import utils
+from pritunl.sso import session
 
 import time
 import urllib
 import httplib
-import requests
 import xml.etree.ElementTree
 
 def _get_base_url():
     return 'https://api.%s.onelogin.com' % settings.app.sso_onelogin_region
 
-def _get_access_token():
-    response = requests.post(
+def _fetch_access_token():
+    response = session.post('onelogin',
         _get_base_url() + '/auth/oauth2/token',
         headers={
             'Authorization': 'client_id:%s, client_secret:%s' % (
@@ -34,13 +34,52 @@ def _get_access_token():
         )
         return None
 
-    return response.json()['data'][0]['access_token']
+    data = response.json()['data'][0]
+
+    return data['access_token'], data.get('expires_in')
+
+def _get_token_key():
+    return (
+        settings.app.sso_onelogin_region,
+        settings.app.sso_onelogin_id,
+        settings.app.sso_onelogin_secret,
+    )
+
+def _get_access_token():
+    return session.get_token('onelogin', _get_token_key(),
+        _fetch_access_token)
+
+def _clear_access_token():
+    session.clear_token('onelogin', _get_token_key())
+
+def _api_request(method, path, headers=None, token_retry=True, **kwargs):
+    for i in xrange(2):
+        access_token = _get_access_token()
+        if not access_token:
+            return None
+
+        req_headers = {
+            'Authorization': 'bearer:%s' % access_token,
+        }
+        if headers:
+            req_headers.update(headers)
+
+        response = session.request('onelogin', method,
+            _get_base_url() + path,
+            headers=req_headers,
+            **kwargs
+        )
+
+        # Cached token was revoked, fetch a new token and retry once
+        if response.status_code != 401 or not token_retry or i:
+            return response
+        _clear_access_token()
 
 def auth_onelogin(username):
     if not settings.app.sso_onelogin_id or \
             not settings.app.sso_onelogin_secret:
         try:
-            response = requests.get(
+            response = session.get('onelogin',
                 ONELOGIN_URL + '/api/v3/users/username/%s' % (
                     urllib.quote(username)),
                 auth=(settings.app.sso_onelogin_key, 'x'),
@@ -75,20 +114,16 @@ def auth_onelogin(username):
             )
         return False
 
-    access_token = _get_access_token()
-    if not access_token:
-        return False
-
-    response = requests.get(
-        _get_base_url() + '/api/1/users',
+    response = _api_request('GET', '/api/1/users',
         headers={
-            'Authorization': 'bearer:%s' % access_token,
             'Content-Type': 'application/json',
         },
         params={
             'username': username,
         },
     )
+    if response is None:
+        return False
 
     if response.status_code != 200:
         logger.error('OneLogin api error', 'sso',
@@ -123,12 +158,9 @@ def auth_onelogin(username):
 
     user_id = user['id']
 
-    response = requests.get(
-        _get_base_url() + '/api/1/users/%d/apps' % user_id,
-        headers={
-            'Authorization': 'bearer:%s' % access_token,
-        },
-    )
+    response = _api_request('GET', '/api/1/users/%d/apps' % user_id)
+    if response is None:
+        return False
 
     if response.status_code != 200:
         logger.error('OneLogin api error', 'sso',
@@ -157,25 +189,19 @@ def auth_onelogin(username):
     return False
 
 def auth_onelogin_secondary(username, passcode, remote_ip, onelogin_mode):
-    access_token = _get_access_token()
-    if not access_token:
-        return False
-
     if 'passcode' in onelogin_mode and not passcode:
         logger.error('OneLogin passcode empty', 'sso',
             username=username,
         )
         return False
 
-    response = requests.get(
-        _get_base_url() + '/api/1/users',
-        headers={
-            'Authorization': 'bearer:%s' % access_token,
-        },
+    response = _api_request('GET', '/api/1/users',
         params={
             'username': username,
         },
     )
+    if response is None:
+        return False
 
     if response.status_code != 200:
         logger.error('OneLogin api error', 'sso',
@@ -201,12 +227,10 @@ def auth_onelogin_secondary(username, passcode, remote_ip, onelogin_mode):
 
     user_id = user['id']
 
-    response = requests.get(
-        _get_base_url() + '/api/1/users/%d/otp_devices' % user_id,
-        headers={
-            'Authorization': 'bearer:%s' % access_token,
-        },
-    )
+    response = _api_request('GET',
+        '/api/1/users/%d/otp_devices' % user_id)
+    if response is None:
+        return False
 
     if response.status_code != 200:
         logger.error('OneLogin api error', 'sso',
@@ -249,11 +273,9 @@ def auth_onelogin_secondary(username, passcode, remote_ip, onelogin_mode):
 
     state_token = None
     if needs_trigger or 'push' in onelogin_mode:
-        response = requests.post(
-            _get_base_url() + '/api/1/users/%d/otp_devices/%d/trigger' % (
-                user_id, device_id),
+        response = _api_request('POST',
+            '/api/1/users/%d/otp_devices/%d/trigger' % (user_id, device_id),
             headers={
-                'Authorization': 'bearer:%s' % access_token,
                 'Content-Type': 'application/json',
                 'X-Forwarded-For': remote_ip,
             },
@@ -261,6 +283,8 @@ def auth_onelogin_secondary(username, passcode, remote_ip, onelogin_mode):
                 'ipaddr': remote_ip,
             },
         )
+        if response is None:
+            return False
 
         if response.status_code != 200:
             logger.error('OneLogin api error', 'sso',
@@ -291,11 +315,10 @@ def auth_onelogin_secondary(username, passcode, remote_ip, onelogin_mode):
             )
             return False
 
-        response = requests.post(
-            _get_base_url() + '/api/1/users/%d/otp_devices/%d/verify' % (
-                user_id, device_id),
+        # Verify returns 401 when the passcode is rejected
+        response = _api_request('POST',
+            '/api/1/users/%d/otp_devices/%d/verify' % (user_id, device_id),
             headers={
-                'Authorization': 'bearer:%s' % access_token,
                 'Content-Type': 'application/json',
                 'X-Forwarded-For': remote_ip,
             },
@@ -303,7 +326,10 @@ def auth_onelogin_secondary(username, passcode, remote_ip, onelogin_mode):
                 'state_token': state_token,
                 'otp_token': passcode,
             },
+            token_retry=False,
         )
+        if response is None:
+            return False
 
         if response.status_code != 200 and response.status_code != 401:
             logger.error('OneLogin api error', 'sso',
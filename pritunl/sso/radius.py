@@ -1,60 +1,258 @@
 from pritunl.constants import *
 from pritunl import settings
 from pritunl import logger
+from pritunl.sso import session
 from pritunl.pyrad import client
 from pritunl.pyrad import packet
 from pritunl.pyrad import dictionary
 
 import StringIO
+import threading
+import socket
+import time
 
-def verify_radius(username, password):
-    hosts = settings.app.sso_radius_host.split(',')
+_dictionary = None
+_client = None
+_client_lock = threading.Lock()
+_host_down = {}
+
+class _RadiusRequest(object):
+    def __init__(self, pkt):
+        self.pkt = pkt
+        self.replies = []
+        self.lock = threading.Lock()
+        self.event = threading.Event()
+
+class _RadiusClient(object):
+    def __init__(self):
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._lock = threading.Condition()
+        self._requests = {}
+        self._next_id = 0
+
+        thread = threading.Thread(target=self._recv_thread)
+        thread.daemon = True
+        thread.start()
+
+    def _recv_thread(self):
+        while True:
+            try:
+                raw_reply, addr = self._sock.recvfrom(4096)
+                if len(raw_reply) < 20:
+                    continue
+
+                self._lock.acquire()
+                try:
+                    req = self._requests.get(ord(raw_reply[1]))
+                finally:
+                    self._lock.release()
+
+                if not req:
+                    continue
+
+                try:
+                    reply = req.pkt.CreateReply(packet=raw_reply)
+                    if not req.pkt.VerifyReply(reply, raw_reply):
+                        continue
+                except packet.PacketError:
+                    continue
+
+                req.lock.acquire()
+                try:
+                    req.replies.append((addr, reply))
+                    req.event.set()
+                finally:
+                    req.lock.release()
+            except:
+                logger.exception('Error in radius receive thread', 'sso')
+                time.sleep(0.5)
+
+    def _acquire_id(self, req, timeout):
+        end_time = time.time() + timeout
+
+        self._lock.acquire()
+        try:
+            while len(self._requests) >= 256:
+                remaining = end_time - time.time()
+                if remaining <= 0:
+                    raise client.Timeout
+                self._lock.wait(remaining)
+
+            while self._next_id in self._requests:
+                self._next_id = (self._next_id + 1) % 256
+
+            pkt_id = self._next_id
+            self._next_id = (self._next_id + 1) % 256
+            self._requests[pkt_id] = req
+            return pkt_id
+        finally:
+            self._lock.release()
+
+    def _release_id(self, pkt_id):
+        self._lock.acquire()
+        try:
+            self._requests.pop(pkt_id, None)
+            self._lock.notify()
+        finally:
+            self._lock.release()
+
+    def send(self, pkt, hosts, timeout, retries, hedge_delay):
+        req = _RadiusRequest(pkt)
+        pkt.id = self._acquire_id(req, timeout)
+
+        try:
+            raw_pkt = pkt.RequestPacket()
+            pending = list(hosts)
+            active = {}
+            last_start = None
+            rejected = None
+
+            while True:
+                cur_time = time.time()
+
+                if pending and (not active or (hedge_delay is not None and
+                        cur_time - last_start >= hedge_delay)):
+                    addr = pending.pop(0)
+                    try:
+                        self._sock.sendto(raw_pkt, addr)
+                        active[addr] = [cur_time, cur_time, 1]
+                    except socket.error:
+                        rejected = None
+                        _set_host_down(addr)
+                    last_start = cur_time
+                    continue
+
+                if not active:
+                    if rejected:
+                        return rejected
+                    raise client.Timeout
+
+                req.lock.acquire()
+                try:
+                    req.event.clear()
+                    replies, req.replies = req.replies, []
+                finally:
+                    req.lock.release()
+
+                for addr, reply in replies:
+                    host_state = active.pop(addr, None)
+                    if not host_state:
+                        continue
+
+                    _set_host_up(addr)
+                    session.record('radius', cur_time - host_state[0],
+                        reply.code != packet.AccessAccept)
 
-    for i, host in enumerate(hosts):
-        host = host.split(':')
+                    if reply.code == packet.AccessAccept:
+                        return reply
+                    rejected = reply
+
+                wait_time = timeout
+                for addr, host_state in active.items():
+                    start_time, send_time, attempts = host_state
+                    if cur_time - send_time >= timeout:
+                        if attempts >= retries:
+                            # Only return a reject if a host answered last
+                            active.pop(addr)
+                            rejected = None
+                            _set_host_down(addr)
+                            session.record('radius',
+                                cur_time - start_time, True)
+                            continue
+
+                        self._sock.sendto(raw_pkt, addr)
+                        host_state[1] = cur_time
+                        host_state[2] += 1
+                        send_time = cur_time
+
+                    wait_time = min(wait_time,
+                        send_time + timeout - cur_time)
+
+                if pending and active and hedge_delay is not None:
+                    wait_time = min(wait_time,
+                        last_start + hedge_delay - cur_time)
+
+                if active:
+                    req.event.wait(max(0.001, wait_time))
+        finally:
+            self._release_id(pkt.id)
+
+def _set_host_down(addr):
+    _host_down[addr] = time.time() + settings.app.sso_radius_down_ttl
+
+def _set_host_up(addr):
+    _host_down.pop(addr, None)
+
+def _get_hosts():
+    cur_time = time.time()
+    hosts = []
+    down_hosts = []
+
+    for host in settings.app.sso_radius_host.split(','):
+        host = host.strip().split(':')
         if len(host) > 1:
             port = int(host[1])
         else:
             port = 1645
         host = host[0]
 
-        conn = client.Client(
-            server=host,
-            authport=port,
-            secret=settings.app.sso_radius_secret.encode(),
-            dict=dictionary.Dictionary(
-                StringIO.StringIO(RADIUS_DICTONARY)),
-        )
+        try:
+            addr = (socket.gethostbyname(host), port)
+        except socket.error:
+            addr = (host, port)
+
+        if _host_down.get(addr, 0) > cur_time:
+            down_hosts.append(addr)
+        else:
+            hosts.append(addr)
 
-        if settings.app.sso_radius_timeout:
-            conn.timeout = settings.app.sso_radius_timeout
+    # Down hosts are only tried after all healthy hosts have failed
+    return hosts + down_hosts
 
-        req = conn.CreateAuthPacket(
-            code=packet.AccessRequest,
-            User_Name=(
-                settings.app.sso_radius_prefix or '') + username.encode(),
-        )
-        req['User-Password'] = req.PwCrypt(password)
+def _get_client():
+    global _dictionary
+    global _client
 
-        try:
-            reply = conn.SendPacket(req)
-        except:
-            if i == len(hosts) - 1:
-                raise
-            else:
-                continue
-
-        if reply.code != packet.AccessAccept:
-            if i == len(hosts) - 1:
-                logger.warning('Radius server rejected authentication', 'sso',
-                    username=username,
-                    reply_code=reply.code,
-                )
-                return False, None, None
-            else:
-                continue
-
-        break
+    if _client:
+        return _client
+
+    _client_lock.acquire()
+    try:
+        if not _client:
+            _dictionary = dictionary.Dictionary(
+                StringIO.StringIO(RADIUS_DICTONARY))
+            _client = _RadiusClient()
+    finally:
+        _client_lock.release()
+
+    return _client
+
+def verify_radius(username, password):
+    conn = _get_client()
+
+    req = packet.AuthPacket(
+        code=packet.AccessRequest,
+        secret=settings.app.sso_radius_secret.encode(),
+        dict=_dictionary,
+        User_Name=(
+            settings.app.sso_radius_prefix or '') + username.encode(),
+    )
+    req['User-Password'] = req.PwCrypt(password)
+
+    reply = conn.send(
+        req,
+        _get_hosts(),
+        settings.app.sso_radius_timeout or 5,
+        3,
+        settings.app.sso_radius_hedge_delay,
+    )
+
+    if reply.code != packet.AccessAccept:
+        logger.warning('Radius server rejected authentication', 'sso',
+            username=username,
+            reply_code=reply.code,
+        )
+        return False, None, None
 
     org_names = []
     try:
@@ -0,0 +1,163 @@
+from pritunl import settings
+from pritunl import monitoring
+
+import threading
+import time
+import collections
+import heapq
+import requests
+import requests.adapters
+
+CACHE_MAX_SIZE = 4096
+CACHE_EVICT_SIZE = 256
+TOKEN_EXPIRE_MARGIN = 60
+
+_lock = threading.Lock()
+_sessions = {}
+_tokens = {}
+_cache = {}
+_stats = collections.defaultdict(lambda: {
+    'count': 0,
+    'errors': 0,
+    'total_time': 0.,
+    'max_time': 0.,
+})
+
+def _get_session(provider):
+    session = _sessions.get(provider)
+    if session:
+        return session
+
+    _lock.acquire()
+    try:
+        session = _sessions.get(provider)
+        if not session:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=4,
+                pool_maxsize=settings.app.sso_pool_size,
+            )
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _sessions[provider] = session
+    finally:
+        _lock.release()
+
+    return session
+
+def record(provider, elapsed, error):
+    _lock.acquire()
+    try:
+        stats = _stats[provider]
+        stats['count'] += 1
+        stats['total_time'] += elapsed
+        stats['max_time'] = max(stats['max_time'], elapsed)
+        if error:
+            stats['errors'] += 1
+    finally:
+        _lock.release()
+
+    tags = {
+        'host': settings.local.host.name,
+        'provider': provider,
+    }
+    monitoring.add_timing('sso', tags, 'response_time',
+        int(elapsed * 1000))
+    monitoring.add_counter('sso', tags, 'count')
+    if error:
+        monitoring.add_counter('sso', tags, 'errors')
+
+def request(provider, method, url, **kwargs):
+    start = time.time()
+    error = True
+
+    try:
+        response = _get_session(provider).request(method, url, **kwargs)
+        error = response.status_code >= 400
+        return response
+    finally:
+        record(provider, time.time() - start, error)
+
+def get(provider, url, **kwargs):
+    return request(provider, 'GET', url, **kwargs)
+
+def post(provider, url, **kwargs):
+    return request(provider, 'POST', url, **kwargs)
+
+def get_token(provider, key, fetch):
+    token_key = (provider, key)
+
+    token = _tokens.get(token_key)
+    if token and time.time() < token[1]:
+        return token[0]
+
+    result = fetch()
+    if not result:
+        return None
+    access_token, expires_in = result
+
+    if expires_in:
+        _tokens[token_key] = (
+            access_token,
+            time.time() + max(0, int(expires_in) - TOKEN_EXPIRE_MARGIN),
+        )
+
+    return access_token
+
+def clear_token(provider, key):
+    _tokens.pop((provider, key), None)
+
+def cache_get(provider, key):
+    value = _cache.get((provider, key))
+    if value and time.time() < value[1]:
+        return value[0]
+
+def cache_set(provider, key, value):
+    ttl = settings.app.sso_lookup_cache_ttl
+    if not ttl:
+        return
+
+    cur_time = time.time()
+    if len(_cache) >= CACHE_MAX_SIZE:
+        _lock.acquire()
+        try:
+            for cache_key, cache_val in _cache.items():
+                if cur_time >= cache_val[1]:
+                    _cache.pop(cache_key, None)
+
+            # Evict the entries closest to expiring
+            overflow = len(_cache) - CACHE_MAX_SIZE + CACHE_EVICT_SIZE
+            if overflow > 0:
+                for cache_key, _ in heapq.nsmallest(overflow,
+                        _cache.items(), key=lambda x: x[1][1]):
+                    _cache.pop(cache_key, None)
+        finally:
+            _lock.release()
+
+    _cache[(provider, key)] = (value, cur_time + ttl)
+
+def get_stats():
+    stats = {}
+
+    _lock.acquire()
+    try:
+        for provider, provider_stats in _stats.items():
+            count = provider_stats['count']
+            stats[provider] = {
+                'count': count,
+                'errors': provider_stats['errors'],
+                'avg_time': provider_stats['total_time'] / count \
+                    if count else 0,
+                'max_time': provider_stats['max_time'],
+            }
+    finally:
+        _lock.release()
+
+    return stats
+
+class DiscoveryCache(object):
+    def get(self, url):
+        return cache_get('google_discovery', url)
+
+    def set(self, url, content):
+        _cache[('google_discovery', url)] = (content, time.time() + 86400)
@@ -0,0 +1,139 @@
+from pritunl.constants import *
+from pritunl import logger
+
+import os
+import re
+import gzip
+import mmap
+import hashlib
+import datetime
+import mimetypes
+import threading
+import collections
+import StringIO
+import werkzeug.http
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+StaticEntry = collections.namedtuple('StaticEntry', [
+    'bundle',
+    'mime_type',
+    'mtime',
+    'last_modified',
+    'etag',
+    'data',
+    'gzip_data',
+    'br_data',
+])
+
+STATIC_REF_RE = re.compile(r'((?:src|href)=")(/?s/)([^"?#]+)(")')
+
+_index = {}
+_build_lock = threading.Lock()
+
+def _gzip(data):
+    gzip_data = StringIO.StringIO()
+    with gzip.GzipFile(fileobj=gzip_data, mode='wb', compresslevel=9,
+            mtime=0) as gzip_file:
+        gzip_file.write(data)
+    return gzip_data.getvalue()
+
+def _iter_files(root):
+    for dir_path, _, file_names in os.walk(root):
+        for file_name in file_names:
+            if os.path.splitext(file_name)[1] not in STATIC_FILE_EXTENSIONS:
+                continue
+            yield os.path.normpath(os.path.join(dir_path, file_name))
+
+def _rewrite_refs(root, data, etags):
+    # Pin static references in html pages to the content hash so browsers
+    # can cache the referenced file without revalidating
+    def _replace(match):
+        ref_path = os.path.normpath(os.path.join(root, match.group(3)))
+        etag = etags.get(ref_path)
+        if not etag:
+            return match.group(0)
+        return '%s%s%s?v=%s%s' % (match.group(1), match.group(2),
+            match.group(3), etag, match.group(4))
+
+    return STATIC_REF_RE.sub(_replace, data)
+
+def build(root):
+    global _index
+
+    root = os.path.normpath(root)
+    files = []
+    etags = {}
+
+    with _build_lock:
+        paths = sorted(_iter_files(root),
+            key=lambda x: os.path.splitext(x)[1] == '.html')
+
+        for path in paths:
+            try:
+                with open(path, 'rb') as static_file:
+                    data = static_file.read()
+                mtime = datetime.datetime.utcfromtimestamp(
+                    int(os.path.getmtime(path)))
+            except (IOError, OSError):
+                logger.exception('Failed to read static file', 'static',
+                    path=path,
+                )
+                continue
+
+            if path.endswith('.html'):
+                data = _rewrite_refs(root, data, etags)
+
+            etag = hashlib.sha1(data).hexdigest()
+            etags[path] = etag
+
+            variants = [data, _gzip(data)]
+            if brotli:
+                variants.append(brotli.compress(data))
+            else:
+                variants.append(None)
+
+            files.append((path, mtime, etag, variants))
+
+        size = sum(len(x) for _, _, _, variants in files
+            for x in variants if x)
+        bundle = mmap.mmap(-1, max(size, 1))
+        index = {}
+
+        for path, mtime, etag, variants in files:
+            offsets = []
+            for data in variants:
+                if data is None:
+                    offsets.append(None)
+                    continue
+                offsets.append((bundle.tell(), len(data)))
+                bundle.write(data)
+
+            index[path] = StaticEntry(
+                bundle=bundle,
+                mime_type=mimetypes.guess_type(
+                    os.path.basename(path))[0] or 'text/plain',
+                mtime=mtime,
+                last_modified=werkzeug.http.http_date(mtime),
+                etag=etag,
+                data=offsets[0],
+                gzip_data=offsets[1],
+                br_data=offsets[2],
+            )
+
+        _index = index
+
+    logger.info('Static bundle loaded', 'static',
+        file_count=len(index),
+        bundle_size=size,
+    )
+
+def get_entry(path):
+    return _index.get(path)
+
+def read(entry, entry_data):
+    offset, size = entry_data
+    return entry.bundle[offset:offset + size]
@@ -1,5 +1,5 @@
 from pritunl.static.utils import *
-from pritunl.cachelocal import cache_db
+from pritunl.static import bundle
 
 from pritunl.constants import *
 from pritunl.exceptions import *
@@ -34,39 +34,36 @@ class StaticFile(object):
         self.path = path
         self.cache = cache
         self.gzip = gzip
-        self.data = None
+        self.entry = None
+        self._data = None
         self.mime_type = None
         self.last_modified = None
+        self.mtime = None
         self.etag = None
         self.load_file()
 
-    def get_cache_key(self):
-        return 'file_%s' % self.path
+    @property
+    def data(self):
+        if self._data is None and self.entry:
+            self._data = bundle.read(self.entry, self.entry.gzip_data \
+                if self.gzip else self.entry.data)
+        return self._data
 
-    def set_cache(self):
-        cache_db.dict_set(self.get_cache_key(), 'data', self.data or '')
-        cache_db.dict_set(self.get_cache_key(), 'mime_type',
-            self.mime_type or '')
-        cache_db.dict_set(self.get_cache_key(), 'last_modified',
-            self.last_modified)
-        cache_db.dict_set(self.get_cache_key(), 'etag', self.etag or '')
-
-    def get_cache(self):
-        self.data = cache_db.dict_get(self.get_cache_key(), 'data')
-        self.mime_type = cache_db.dict_get(self.get_cache_key(), 'mime_type')
-        self.last_modified = cache_db.dict_get(self.get_cache_key(),
-            'last_modified')
-        self.etag = cache_db.dict_get(self.get_cache_key(), 'etag')
+    @data.setter
+    def data(self, value):
+        self._data = value
 
     def load_file(self):
-        if settings.conf.static_cache and cache_db.exists(
-                self.get_cache_key()):
-            self.get_cache()
-            return
+        if settings.conf.static_cache:
+            self.entry = bundle.get_entry(self.path)
+            if self.entry:
+                self.mime_type = self.entry.mime_type
+                self.last_modified = self.entry.last_modified
+                self.mtime = self.entry.mtime
+                self.etag = self.entry.etag
+                return
 
         if not os.path.isfile(self.path):
-            if settings.conf.static_cache:
-                self.set_cache()
             return
 
         file_basename = os.path.basename(self.path)
@@ -86,21 +83,55 @@ class StaticFile(object):
 
         self.mime_type = mimetypes.guess_type(file_basename)[0] or 'text/plain'
         self.last_modified = werkzeug.http.http_date(file_mtime)
+        self.mtime = file_mtime
         self.etag = generate_etag(file_basename, file_size, file_mtime)
-        if settings.conf.static_cache:
-            self.set_cache()
+
+    def is_modified(self):
+        if_none_match = flask.request.if_none_match
+        if if_none_match:
+            return not if_none_match.contains(self.etag)
+
+        if_modified_since = flask.request.if_modified_since
+        if if_modified_since and self.mtime:
+            return self.mtime.replace(microsecond=0) > \
+                if_modified_since.replace(tzinfo=None)
+
+        return True
 
     def get_response(self):
         if not self.last_modified:
             flask.abort(404)
-        response = flask.Response(response=self.data, mimetype=self.mime_type)
-
-        if self.gzip:
-            response.headers.add('Content-Encoding', 'gzip')
 
-        if settings.conf.static_cache and self.cache:
-            response.headers.add('Cache-Control',
-                'max-age=%s, public' % settings.app.static_cache_time)
+        cache = settings.conf.static_cache and self.cache
+        if cache and not self.is_modified():
+            response = flask.Response(status=304)
+        else:
+            content_encoding = None
+            data = self._data
+            if data is None and self.entry and self.gzip and \
+                    self.entry.br_data and 'br' in \
+                    flask.request.accept_encodings:
+                data = bundle.read(self.entry, self.entry.br_data)
+                content_encoding = 'br'
+            elif self.gzip:
+                data = self.data
+                content_encoding = 'gzip'
+            else:
+                data = self.data
+
+            response = flask.Response(response=data,
+                mimetype=self.mime_type)
+            if content_encoding:
+                response.headers.add('Content-Encoding', content_encoding)
+            response.headers.add('Vary', 'Accept-Encoding')
+
+        if cache:
+            if self.entry and flask.request.args.get('v') == self.etag:
+                response.headers.add('Cache-Control',
+                    'max-age=31536000, public, immutable')
+            else:
+                response.headers.add('Cache-Control',
+                    'max-age=%s, public' % settings.app.static_cache_time)
             response.headers.add('ETag', '"%s"' % self.etag)
         else:
             response.headers.add('Cache-Control',
@@ -1,6 +1,7 @@
 import pritunl.tasks.acme_update
 import pritunl.tasks.clean_ip_pool
 import pritunl.tasks.clean_users
+import pritunl.tasks.clean_tombstones
 import pritunl.tasks.clean_network_links
 import pritunl.tasks.clean_network_lock
 import pritunl.tasks.pooler
@@ -1,4 +1,5 @@
 from pritunl.helpers import *
+from pritunl import settings
 from pritunl import mongo
 from pritunl import task
 
@@ -14,13 +15,14 @@ class TaskCleanIpPool(task.Task):
         return mongo.get_collection('servers')
 
     def task(self):
-        server_ids = self.server_collection.find({}, {
-            '_id': True,
-        }).distinct('_id')
+        if settings.app.gc_full_scan:
+            server_ids = self.server_collection.find({}, {
+                '_id': True,
+            }).distinct('_id')
 
-        self.pool_collection.remove({
-            'server_id': {'$nin': server_ids},
-        })
+            self.pool_collection.remove({
+                'server_id': {'$nin': server_ids},
+            })
 
         response = self.pool_collection.aggregate([
             {'$match': {
@@ -54,6 +56,9 @@ class TaskCleanIpPool(task.Task):
                     'user_id': '',
                 }})
 
+        if not settings.app.gc_full_scan:
+            return
+
         response = self.pool_collection.aggregate([
             {'$match': {
                 'user_id': {'$exists': True},
@@ -1,4 +1,5 @@
 from pritunl.helpers import *
+from pritunl import settings
 from pritunl import mongo
 from pritunl import task
 
@@ -22,6 +23,9 @@ class TaskCleanServers(task.Task):
         return mongo.get_collection('servers')
 
     def task(self):
+        if not settings.app.gc_full_scan:
+            return
+
         user_ids = set(self.user_collection.find().distinct('_id'))
         org_ids = set(self.org_collection.find().distinct('_id'))
         server_ids = set(self.server_collection.find().distinct('_id'))
@@ -0,0 +1,12 @@
+from pritunl.helpers import *
+from pritunl import task
+from pritunl import tombstone
+
+class TaskCleanTombstones(task.Task):
+    type = 'clean_tombstones'
+    ttl = 300
+
+    def task(self):
+        tombstone.run_pass()
+
+task.add_task(TaskCleanTombstones, minutes=xrange(0, 60, 2))
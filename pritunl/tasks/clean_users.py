@@ -1,4 +1,5 @@
 from pritunl.helpers import *
+from pritunl import settings
 from pritunl import mongo
 from pritunl import task
 
@@ -28,6 +29,9 @@ class TaskCleanUsers(task.Task):
         }).distinct('org_id'))
 
     def task(self):
+        if not settings.app.gc_full_scan:
+            return
+
         # Remove users from orgs that dont exists check twice to reduce
         # possibility of deleting a ca user durning org creation
         user_org_ids = self._get_user_org_ids()
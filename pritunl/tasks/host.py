@@ -61,10 +61,10 @@ class TaskHost(task.Task):
 
             yield
 
-            monitoring.insert_point('cluster', {}, {
-                'server_count': server_count,
-                'device_count': device_count,
-            })
+            monitoring.set_gauge('cluster', {}, 'server_count',
+                server_count)
+            monitoring.set_gauge('cluster', {}, 'device_count',
+                device_count)
         except GeneratorExit:
             raise
         except:
@@ -0,0 +1,203 @@
+from pritunl.helpers import *
+from pritunl import settings
+from pritunl import mongo
+from pritunl import logger
+from pritunl import monitoring
+from pritunl import utils
+
+import datetime
+import time
+
+ORGANIZATION = 'organization'
+SERVER = 'server'
+HOST = 'host'
+
+_resource_collections = {
+    ORGANIZATION: 'organizations',
+    SERVER: 'servers',
+    HOST: 'hosts',
+}
+
+_stats = {
+    'passes': 0,
+    'added': 0,
+    'completed': 0,
+    'skipped': 0,
+    'chunks': 0,
+    'documents': 0,
+    'last_pass_time': None,
+    'last_pass_duration': 0,
+}
+
+def _get_tags():
+    host = getattr(settings.local, 'host', None)
+    return {
+        'host': host.name if host else None,
+    }
+
+def _count(field, value=1):
+    _stats[field] += value
+    monitoring.add_counter('gc', _get_tags(), field, value)
+
+def get_stats():
+    stats = _stats.copy()
+    stats['pending'] = mongo.get_collection('tombstones').count()
+    return stats
+
+def _get_stages(resource_type, resource_id):
+    # Each stage is a (collection, spec, update) tuple, stages without an
+    # update remove the matched documents
+    if resource_type == ORGANIZATION:
+        return [
+            ('users', {
+                'org_id': resource_id,
+            }, None),
+            ('servers_ip_pool', {
+                'org_id': resource_id,
+            }, {'$unset': {
+                'org_id': '',
+                'user_id': '',
+            }}),
+            ('servers', {
+                'organizations': resource_id,
+            }, {'$pull': {
+                'organizations': resource_id,
+            }}),
+            ('servers', {
+                'primary_organization': resource_id,
+            }, {'$set': {
+                'primary_organization': None,
+                'primary_user': None,
+            }}),
+        ]
+    elif resource_type == SERVER:
+        return [
+            ('servers_ip_pool', {
+                'server_id': resource_id,
+            }, None),
+            ('users', {
+                'resource_id': resource_id,
+            }, None),
+            ('servers', {
+                'links.server_id': resource_id,
+            }, {'$pull': {
+                'links': {'server_id': resource_id},
+            }}),
+        ]
+    elif resource_type == HOST:
+        return [
+            ('users', {
+                'resource_id': resource_id,
+            }, None),
+            ('servers', {
+                'hosts': resource_id,
+            }, {'$pull': {
+                'hosts': resource_id,
+            }}),
+        ]
+    raise TypeError('Invalid tombstone type')
+
+def add(resource_type, resource_id):
+    mongo.get_collection('tombstones').insert({
+        'type': resource_type,
+        'resource_id': resource_id,
+        'timestamp': utils.now(),
+        'stage': 0,
+        'cursor': None,
+    })
+    _count('added')
+
+def _run_chunk(doc, chunk_size):
+    stages = _get_stages(doc['type'], doc['resource_id'])
+    stage = doc.get('stage') or 0
+    cursor = doc.get('cursor')
+
+    if stage >= len(stages):
+        return None, None, 0
+
+    coll_name, spec, update = stages[stage]
+    collection = mongo.get_collection(coll_name)
+
+    spec = spec.copy()
+    if cursor is not None:
+        spec['_id'] = {'$gt': cursor}
+
+    doc_ids = [x['_id'] for x in collection.find(spec, {
+        '_id': True,
+    }).sort('_id', 1).limit(chunk_size)]
+
+    if doc_ids:
+        spec['_id'] = {'$in': doc_ids}
+        if update is None:
+            collection.remove(spec)
+        else:
+            collection.update(spec, update, multi=True)
+
+    if len(doc_ids) < chunk_size:
+        return stage + 1, None, len(doc_ids)
+    return stage, doc_ids[-1], len(doc_ids)
+
+def _is_removed(doc):
+    coll_name = _resource_collections.get(doc['type'])
+    if not coll_name:
+        return True
+    return not mongo.get_collection(coll_name).find_one({
+        '_id': doc['resource_id'],
+    }, {
+        '_id': True,
+    })
+
+def run_pass():
+    tombstone_collection = mongo.get_collection('tombstones')
+    chunk_size = settings.app.gc_chunk_size
+    chunks_max = settings.app.gc_pass_chunks
+    chunks = 0
+    start = time.time()
+
+    # Skip recent tombstones to give the removal time to complete
+    spec = {
+        'timestamp': {'$lt': utils.now() - datetime.timedelta(
+            seconds=settings.app.gc_delay)},
+    }
+
+    for doc in tombstone_collection.find(spec).sort('timestamp', 1):
+        if chunks >= chunks_max:
+            break
+
+        if not _is_removed(doc):
+            logger.warning('Tombstone resource still exists', 'gc',
+                resource_type=doc['type'],
+                resource_id=doc['resource_id'],
+            )
+            tombstone_collection.remove(doc['_id'])
+            _count('skipped')
+            continue
+
+        stage_count = len(_get_stages(doc['type'], doc['resource_id']))
+
+        while chunks < chunks_max:
+            stage, cursor, doc_count = _run_chunk(doc, chunk_size)
+            chunks += 1
+            _count('chunks')
+            if doc_count:
+                _count('documents', doc_count)
+
+            if stage is None or stage >= stage_count:
+                tombstone_collection.remove(doc['_id'])
+                _count('completed')
+                break
+
+            doc['stage'] = stage
+            doc['cursor'] = cursor
+            tombstone_collection.update({
+                '_id': doc['_id'],
+            }, {'$set': {
+                'stage': stage,
+                'cursor': cursor,
+            }})
+
+    duration = int((time.time() - start) * 1000)
+    _count('passes')
+    _stats['last_pass_time'] = int(start)
+    _stats['last_pass_duration'] = duration
+    monitoring.add_timing('gc', _get_tags(), 'duration', duration)
@@ -1,2 +1,3 @@
-from pritunl.transaction.transaction import Transaction
+from pritunl.transaction.transaction import Transaction, count_retry, \
+    get_stats
 from pritunl.transaction.collection import TransactionCollection
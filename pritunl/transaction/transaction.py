@@ -6,12 +6,98 @@ from pritunl import settings
 from pritunl import mongo
 from pritunl import logger
 from pritunl import utils
+from pritunl import monitoring
 
-import collections
 import datetime
 import bson
 import zlib
 import json
+import time
+
+_stats = {
+    'committed': 0,
+    'rolled_back': 0,
+    'retried': 0,
+    'failed': 0,
+    'actions': 0,
+    'merged_actions': 0,
+    'round_trips': 0,
+}
+
+def _get_tags():
+    host = getattr(settings.local, 'host', None)
+    return {
+        'host': host.name if host else None,
+    }
+
+def _count(field, value=1):
+    _stats[field] += value
+    monitoring.add_counter('transaction', _get_tags(), field, value)
+
+def count_retry():
+    _count('retried')
+
+def get_stats():
+    return _stats.copy()
+
+def _get_spec(spec):
+    if spec is None:
+        return {}
+    elif not isinstance(spec, dict):
+        return {'_id': spec}
+    return spec
+
+def _get_bulk_op(actions):
+    # Single write actions that can be run as part of an ordered bulk
+    # operation, chained or read actions are run directly
+    if len(actions) != 1:
+        return
+
+    func, args, kwargs = actions[0]
+    args = args or []
+    kwargs = kwargs or {}
+
+    if func == 'remove':
+        if len(args) > 1 or set(kwargs) - {'multi'}:
+            return
+        spec = _get_spec(args[0] if args else None)
+        if kwargs.get('multi', True):
+            return lambda bulk: bulk.find(spec).remove()
+        return lambda bulk: bulk.find(spec).remove_one()
+
+    if func not in ('update', 'update_one', 'replace_one') or \
+            len(args) != 2 or not isinstance(args[1], dict) or \
+            set(kwargs) - {'upsert', 'multi'}:
+        return
+
+    spec = _get_spec(args[0])
+    doc = args[1]
+    upsert = kwargs.get('upsert', False)
+    operators = any(x.startswith('$') for x in doc)
+
+    if func == 'update':
+        if not operators:
+            if kwargs.get('multi'):
+                return
+            func = 'replace_one'
+        elif kwargs.get('multi'):
+            func = 'update'
+        else:
+            func = 'update_one'
+    elif func == 'update_one' and not operators:
+        return
+    elif func == 'replace_one' and operators:
+        return
+    elif 'multi' in kwargs:
+        return
+
+    def bulk_op(bulk):
+        bulk_find = bulk.find(spec)
+        if upsert:
+            bulk_find = bulk_find.upsert()
+        getattr(bulk_find, func)(doc)
+
+    return bulk_op
 
 class Transaction(mongo.MongoObject):
     fields = {
@@ -105,22 +191,68 @@ class Transaction(mongo.MongoObject):
             func, args, kwargs = action
             obj = getattr(obj, func)(*args or [], **kwargs or {})
 
+    def _run_merged_actions(self, collection_name, merged):
+        if not merged:
+            return
+
+        collection = mongo.get_collection(collection_name)
+
+        if len(merged) == 1:
+            self._run_collection_actions(collection, merged[0][0])
+        else:
+            bulk = collection.initialize_ordered_bulk_op()
+            for _, bulk_op in merged:
+                bulk_op(bulk)
+            bulk.execute()
+            _count('merged_actions', len(merged))
+
+        _count('round_trips')
+
     def _run_actions(self):
-        collection_bulks = collections.defaultdict(
-            lambda: collection.initialize_ordered_bulk_op())
+        collection_bulks = {}
+        merge_name = None
+        merged = []
 
         for action_set in self.action_sets:
             collection_name, bulk, actions, _, _ = action_set
-            collection = mongo.get_collection(collection_name)
 
             if bulk:
-                collection = collection_bulks[collection_name]
-            elif actions == BULK_EXECUTE:
-                collection = collection_bulks.pop(collection_name)
-                collection.execute()
+                bulk_obj = collection_bulks.get(collection_name)
+                if bulk_obj is None:
+                    bulk_obj = mongo.get_collection(
+                        collection_name).initialize_ordered_bulk_op()
+                    collection_bulks[collection_name] = bulk_obj
+                self._run_collection_actions(bulk_obj, actions)
+                _count('actions', len(actions))
+                continue
+
+            bulk_op = None
+            if actions != BULK_EXECUTE:
+                _count('actions', len(actions))
+                bulk_op = _get_bulk_op(actions)
+
+            # Consecutive writes to the same collection are sent as one
+            # ordered bulk operation, order across collections is kept
+            if bulk_op:
+                if merge_name != collection_name:
+                    self._run_merged_actions(merge_name, merged)
+                    merge_name = collection_name
+                    merged = []
+                merged.append((actions, bulk_op))
                 continue
 
-            self._run_collection_actions(collection, actions)
+            self._run_merged_actions(merge_name, merged)
+            merge_name = None
+            merged = []
+
+            if actions == BULK_EXECUTE:
+                collection_bulks.pop(collection_name).execute()
+            else:
+                self._run_collection_actions(
+                    mongo.get_collection(collection_name), actions)
+            _count('round_trips')
+
+        self._run_merged_actions(merge_name, merged)
 
     def run_actions(self, update_db=True):
         if update_db:
@@ -152,9 +284,11 @@ class Transaction(mongo.MongoObject):
                     self.rollback_actions()
                 return
 
+        start = time.time()
         try:
             self._run_actions()
         except:
+            _count('failed')
             logger.exception('Error occurred running ' +
                 'transaction actions', 'transaction',
                 transaction_id=self.id,
@@ -171,6 +305,11 @@ class Transaction(mongo.MongoObject):
         })
         if not response['updatedExisting']:
             return
+
+        _count('committed')
+        monitoring.add_timing('transaction', _get_tags(), 'duration',
+            int((time.time() - start) * 1000))
+
         self.run_post_actions()
 
     def _rollback_actions(self):
@@ -198,6 +337,8 @@ class Transaction(mongo.MongoObject):
         if not response['updatedExisting']:
             return
 
+        _count('rolled_back')
+
         try:
             self._rollback_actions()
         except:
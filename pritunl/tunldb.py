@@ -1,3 +1,5 @@
+from pritunl import scheduler
+
 import Queue
 import time
 import collections
@@ -28,6 +30,7 @@ TRANSACTION_METHODS = {
 }
 CHANNEL_TTL = 120
 CHANNEL_BUFFER = 128
+LOG_COMPACT_SIZE = 4194304
 
 class TunlDB(object):
     def __init__(self):
@@ -40,9 +43,17 @@ class TunlDB(object):
             lambda: {'subs': set(), 'msgs': collections.deque(
                 maxlen=CHANNEL_BUFFER), 'timer': None})
         self._commit_log = []
+        self._dirty = set()
+        self._dirty_lock = threading.Lock()
+        self._export_lock = threading.Lock()
 
-    def _put_queue(self):
+    def _put_queue(self, key):
         if self._path:
+            self._dirty_lock.acquire()
+            try:
+                self._dirty.add(key)
+            finally:
+                self._dirty_lock.release()
             self._set_queue.put('set')
 
     def _export_thread(self):
@@ -57,7 +68,7 @@ class TunlDB(object):
                     self._set_queue.get(timeout=0.01)
                 except Queue.Empty:
                     pass
-            self.export_data()
+            self.export_log()
 
     def _validate(self, value):
         if value is not None and not isinstance(value, basestring):
@@ -73,29 +84,42 @@ class TunlDB(object):
             export_thread.daemon = True
             export_thread.start()
 
+    def _get_data(self, key):
+        data = self._data.get(key)
+        if data and data['ttl'] and data['ttl'] <= int(time.time() * 1000):
+            self.remove(key)
+            return None
+        return data
+
+    def _expire_key(self, key):
+        self._get_data(key)
+
     def set(self, key, value):
         self._validate(value)
         self._data[key]['val'] = value
-        self._put_queue()
+        self._put_queue(key)
 
     def get(self, key):
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             return data['val']
 
     def exists(self, key):
-        return key in self._data
+        return self._get_data(key) is not None
 
     def rename(self, key, new_key):
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             self._data[new_key]['val'] = data['val']
             self.remove(key)
-            self._put_queue()
+            self._put_queue(new_key)
 
     def remove(self, key):
         self._data.pop(key, None)
-        self._put_queue()
+        cur_timer = self._timers.pop(key, None)
+        if cur_timer:
+            cur_timer.cancel()
+        self._put_queue(key)
 
     def expire(self, key, ttl):
         ttl_time = int(time.time() * 1000) + int(ttl * 1000)
@@ -103,17 +127,14 @@ class TunlDB(object):
         cur_timer = self._timers.pop(key, None)
         if cur_timer:
             cur_timer.cancel()
-        timer = threading.Timer(ttl, self.remove, (key,))
-        timer.daemon = True
-        self._timers[key] = timer
-        timer.start()
+        self._timers[key] = scheduler.call_later(ttl, self._expire_key, key)
 
         self._data[key]['ttl'] = ttl_time
-        self._put_queue()
+        self._put_queue(key)
 
     def increment(self, key):
         value = '1'
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 value = str(int(data['val']) + 1)
@@ -122,12 +143,12 @@ class TunlDB(object):
                 data['val'] = value
         else:
             self._data[key]['val'] = value
-        self._put_queue()
+        self._put_queue(key)
         return value
 
     def decrement(self, key):
         value = '-1'
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 value = str(int(data['val']) - 1)
@@ -136,7 +157,7 @@ class TunlDB(object):
                 data['val'] = value
         else:
             self._data[key]['val'] = value
-        self._put_queue()
+        self._put_queue(key)
         return value
 
     def keys(self):
@@ -144,7 +165,7 @@ class TunlDB(object):
 
     def set_add(self, key, element):
         self._validate(element)
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 data['val'].add(element)
@@ -152,30 +173,30 @@ class TunlDB(object):
                 data['val'] = {element}
         else:
             self._data[key]['val'] = {element}
-        self._put_queue()
+        self._put_queue(key)
 
     def set_remove(self, key, element):
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 data['val'].remove(element)
-                self._put_queue()
+                self._put_queue(key)
             except (KeyError, AttributeError):
                 pass
 
     def set_pop(self, key):
         value = None
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 value = data['val'].pop()
-                self._put_queue()
+                self._put_queue(key)
             except (KeyError, AttributeError):
                 pass
         return value
 
     def set_exists(self, key, element):
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 return element in data['val']
@@ -184,7 +205,7 @@ class TunlDB(object):
         return False
 
     def set_elements(self, key):
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 return data['val'].copy()
@@ -193,7 +214,7 @@ class TunlDB(object):
         return set()
 
     def set_iter(self, key):
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 for value in data['val'].copy():
@@ -202,7 +223,7 @@ class TunlDB(object):
                 pass
 
     def set_length(self, key):
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 return len(data['val'])
@@ -212,7 +233,7 @@ class TunlDB(object):
 
     def list_lpush(self, key, value):
         self._validate(value)
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 data['val'].appendleft(value)
@@ -220,11 +241,11 @@ class TunlDB(object):
                 data['val'] = collections.deque([value])
         else:
             self._data[key]['val'] = collections.deque([value])
-        self._put_queue()
+        self._put_queue(key)
 
     def list_rpush(self, key, value):
         self._validate(value)
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 data['val'].append(value)
@@ -232,32 +253,32 @@ class TunlDB(object):
                 data['val'] = collections.deque([value])
         else:
             self._data[key]['val'] = collections.deque([value])
-        self._put_queue()
+        self._put_queue(key)
 
     def list_lpop(self, key):
         value = None
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 value = data['val'].popleft()
-                self._put_queue()
+                self._put_queue(key)
             except (AttributeError, IndexError):
                 pass
         return value
 
     def list_rpop(self, key):
         value = None
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 value = data['val'].pop()
-                self._put_queue()
+                self._put_queue(key)
             except (AttributeError, IndexError):
                 pass
         return value
 
     def list_index(self, key, index):
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 return data['val'][index]
@@ -265,7 +286,7 @@ class TunlDB(object):
                 pass
 
     def list_elements(self, key):
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 return list(data['val'])
@@ -274,7 +295,7 @@ class TunlDB(object):
         return []
 
     def list_iter(self, key):
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 for value in copy.copy(data['val']):
@@ -283,7 +304,7 @@ class TunlDB(object):
                 pass
 
     def list_iter_range(self, key, start, stop=None):
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 for value in itertools.islice(
@@ -294,7 +315,7 @@ class TunlDB(object):
 
     def list_remove(self, key, value, count=1):
         self._validate(value)
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             if count:
                 try:
@@ -307,10 +328,10 @@ class TunlDB(object):
                         data['val'].remove(value)
                 except (AttributeError, ValueError):
                     pass
-            self._put_queue()
+            self._put_queue(key)
 
     def list_length(self, key):
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 return len(data['val'])
@@ -320,7 +341,7 @@ class TunlDB(object):
 
     def dict_set(self, key, field, value):
         self._validate(value)
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 data['val'][field] = value
@@ -328,10 +349,10 @@ class TunlDB(object):
                 data['val'] = {field: value}
         else:
             self._data[key]['val'] = {field: value}
-        self._put_queue()
+        self._put_queue(key)
 
     def dict_get(self, key, field):
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 return data['val'].get(field)
@@ -339,16 +360,16 @@ class TunlDB(object):
                 pass
 
     def dict_remove(self, key, field):
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 data['val'].pop(field, None)
             except AttributeError:
                 pass
-            self._put_queue()
+            self._put_queue(key)
 
     def dict_keys(self, key):
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 return set(data['val'])
@@ -357,7 +378,7 @@ class TunlDB(object):
         return set()
 
     def dict_values(self, key):
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 return set(data['val'].values())
@@ -366,7 +387,7 @@ class TunlDB(object):
         return set()
 
     def dict_iter(self, key):
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             data_copy = data['val'].copy()
             try:
@@ -376,7 +397,7 @@ class TunlDB(object):
                 pass
 
     def dict_get_all(self, key):
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 return data['val'].copy()
@@ -431,10 +452,8 @@ class TunlDB(object):
         cur_timer = self._channels[channel]['timer']
         if cur_timer:
             cur_timer.cancel()
-        timer = threading.Timer(CHANNEL_TTL, self._clear_channel, (channel,))
-        timer.daemon = True
-        self._channels[channel]['timer'] = timer
-        timer.start()
+        self._channels[channel]['timer'] = scheduler.call_later(
+            CHANNEL_TTL, self._clear_channel, channel)
 
         self._channels[channel]['msgs'].append((uuid.uuid4().hex, message))
         for subscriber in self._channels[channel]['subs'].copy():
@@ -450,11 +469,77 @@ class TunlDB(object):
             self._commit_log.remove(trans)
         except ValueError:
             pass
-        self._put_queue()
+        self._put_queue(None)
+
+    def _export_key(self, key):
+        if key is None:
+            return ['commit_log', copy.copy(self._commit_log)]
+
+        data = self._data.get(key)
+        if data is None:
+            return ['remove', key]
+
+        key_val = data['val']
+        key_type = type(key_val).__name__
+        if key_type == 'set' or key_type == 'deque':
+            key_val = list(key_val)
+        return ['set', key, key_type, data['ttl'], key_val]
+
+    def _import_key(self, key, key_type, key_ttl, key_val):
+        if key_type == 'set':
+            key_val = set(key_val)
+        elif key_type == 'deque':
+            key_val = collections.deque(key_val)
+
+        self._data[key] = {
+            'ttl': key_ttl,
+            'val': key_val,
+        }
+
+    def export_log(self):
+        if not self._path:
+            return
+
+        self._export_lock.acquire()
+        try:
+            self._dirty_lock.acquire()
+            try:
+                dirty = self._dirty
+                self._dirty = set()
+            finally:
+                self._dirty_lock.release()
+
+            if not dirty:
+                return
+
+            log_path = self._path + '.log'
+            with open(log_path, 'a') as log_file:
+                os.chmod(log_path, 0600)
+                for key in dirty:
+                    log_file.write(json.dumps(self._export_key(key)) + '\n')
+                log_size = log_file.tell()
+
+            try:
+                snapshot_size = os.path.getsize(self._path)
+            except OSError:
+                snapshot_size = 0
+
+            if log_size > max(LOG_COMPACT_SIZE, snapshot_size):
+                self._export_snapshot()
+        finally:
+            self._export_lock.release()
 
     def export_data(self):
         if not self._path:
             return
+
+        self._export_lock.acquire()
+        try:
+            self._export_snapshot()
+        finally:
+            self._export_lock.release()
+
+    def _export_snapshot(self):
         temp_path = self._path + '_%s.tmp' % uuid.uuid4().hex
         try:
             data = self._data.copy()
@@ -487,48 +572,67 @@ class TunlDB(object):
                 pass
             raise
 
+        # Snapshot includes every logged change, later changes are still
+        # in the dirty set and will start a new log
+        try:
+            os.remove(self._path + '.log')
+        except OSError:
+            pass
+
     def import_data(self):
+        commit_log = []
+
         if os.path.isfile(self._path):
             with open(self._path, 'r') as db_file:
                 import_data = json.loads(db_file.read())
-                data = import_data['data']
-
-                for key_data in data:
-                    key = key_data[0]
-                    key_type = key_data[1]
-                    key_ttl = key_data[2]
-                    key_val = key_data[3]
-
-                    if key_type == 'set':
-                        key_val = set(key_val)
-                    elif key_type == 'deque':
-                        key_val = collections.deque(key_val)
-
-                    self._data[key] = {
-                        'ttl': key_ttl,
-                        'val': key_val,
-                    }
-
-                if 'timers' in import_data:
-                    for key in import_data['timers']:
-                        if key not in self._data:
-                            continue
-                        ttl = self._data[key]['ttl']
-                        if not ttl:
-                            continue
-                        ttl -= int(time.time() * 1000)
-                        ttl /= 1000.0
-                        if ttl >= 0:
-                            timer = threading.Timer(ttl, self.remove, (key,))
-                            timer.daemon = True
-                            self._timers[key] = timer
-                            timer.start()
-                        else:
-                            self.remove(key)
-
-                if 'commit_log' in import_data:
-                    for tran in import_data['commit_log']:
-                        self._apply_trans(tran)
+
+                for key_data in import_data['data']:
+                    self._import_key(*key_data)
+
+                commit_log = import_data.get('commit_log') or []
+
+        log_path = self._path + '.log'
+        if os.path.isfile(log_path):
+            with open(log_path, 'r+') as log_file:
+                offset = 0
+                while True:
+                    line = log_file.readline()
+                    if not line:
+                        break
+
+                    try:
+                        if not line.endswith('\n'):
+                            raise ValueError('Missing newline')
+                        record = json.loads(line)
+                    except ValueError:
+                        # Partial write from an interrupted export, drop it
+                        # so new records are not appended to the same line
+                        log_file.seek(offset)
+                        log_file.truncate()
+                        break
+                    offset = log_file.tell()
+
+                    if record[0] == 'set':
+                        self._import_key(*record[1:])
+                    elif record[0] == 'remove':
+                        self._data.pop(record[1], None)
+                    elif record[0] == 'commit_log':
+                        commit_log = record[1]
+
+        cur_time = int(time.time() * 1000)
+        for key in list(self._data):
+            ttl = self._data[key]['ttl']
+            if not ttl:
+                continue
+            ttl = (ttl - cur_time) / 1000.0
+            if ttl >= 0:
+                self._timers[key] = scheduler.call_later(
+                    ttl, self._expire_key, key)
+            else:
+                self.remove(key)
+
+        for tran in commit_log:
+            self._apply_trans(tran)
 
 class TunlDBTransaction(object):
     def __init__(self, cache):
@@ -9,39 +9,37 @@ from pritunl.constants import *
 from pritunl import logger
 from pritunl import utils
 
+import time
+
+UPGRADE_STEPS = (
+    ('1.4', upgrade_1_4),
+    ('1.5', upgrade_1_5),
+    ('1.17', upgrade_1_17),
+    ('1.18', upgrade_1_18),
+    ('1.24', upgrade_1_24),
+)
+
 def upgrade_server():
     upgraded = False
 
     if not SE_MODE:
-        if utils.get_db_ver_int() < utils.get_int_ver('1.4.0.0'):
-            upgraded = True
-            logger.info('Running 1.4 database upgrade', 'upgrade')
-            upgrade_1_4()
-            utils.set_db_ver('1.4.0.0', '1.4.0.0')
+        for version, upgrade_func in UPGRADE_STEPS:
+            db_ver = version + '.0.0'
+            if utils.get_db_ver_int() >= utils.get_int_ver(db_ver):
+                continue
 
-        if utils.get_db_ver_int() < utils.get_int_ver('1.5.0.0'):
             upgraded = True
-            logger.info('Running 1.5 database upgrade', 'upgrade')
-            upgrade_1_5()
-            utils.set_db_ver('1.5.0.0', '1.5.0.0')
+            logger.info('Running %s database upgrade' % version, 'upgrade')
 
-        if utils.get_db_ver_int() < utils.get_int_ver('1.17.0.0'):
-            upgraded = True
-            logger.info('Running 1.17 database upgrade', 'upgrade')
-            upgrade_1_17()
-            utils.set_db_ver('1.17.0.0', '1.17.0.0')
+            start = time.time()
+            upgrade_func()
+            utils.set_db_ver(db_ver, db_ver)
+            clear_progress()
 
-        if utils.get_db_ver_int() < utils.get_int_ver('1.18.0.0'):
-            upgraded = True
-            logger.info('Running 1.18 database upgrade', 'upgrade')
-            upgrade_1_18()
-            utils.set_db_ver('1.18.0.0', '1.18.0.0')
-
-        if utils.get_db_ver_int() < utils.get_int_ver('1.24.0.0'):
-            upgraded = True
-            logger.info('Running 1.24 database upgrade', 'upgrade')
-            upgrade_1_24()
-            utils.set_db_ver('1.24.0.0', '1.24.0.0')
+            logger.info('Database upgrade complete', 'upgrade',
+                version=version,
+                duration=int((time.time() - start) * 1000),
+            )
 
     if not upgraded and utils.get_db_ver(False):
         logger.info('No upgrade needed', 'upgrade')
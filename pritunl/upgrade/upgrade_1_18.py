@@ -1,7 +1,6 @@
-from pritunl.upgrade.utils import get_collection
+from pritunl.upgrade.utils import get_collection, migrate_docs
 
 def upgrade_1_18():
-    servers_collection = get_collection('servers')
     settings_collection = get_collection('settings')
 
     nat = True
@@ -9,7 +8,7 @@ def upgrade_1_18():
     if doc:
         nat = doc.get('nat_routes', True)
 
-    for doc in servers_collection.find({}):
+    def _handler(doc):
         routes = []
 
         if doc.get('mode') == 'all_traffic':
@@ -24,8 +23,12 @@ def upgrade_1_18():
                 'nat': nat,
             })
 
-        servers_collection.update({
-            '_id': doc['_id'],
-        }, {'$set': {
+        return {'$set': {
             'routes': routes,
-        }})
+        }}
+
+    migrate_docs('upgrade_1_18', 'servers', {}, {
+        '_id': True,
+        'mode': True,
+        'local_networks': True,
+    }, _handler)
@@ -1,24 +1,20 @@
-from pritunl.upgrade.utils import get_collection
+from pritunl.upgrade.utils import migrate_docs
 
 from pritunl import utils
 
 def upgrade_1_4():
-    ip_pool_collection = get_collection('servers_ip_pool')
-
-    docs = ip_pool_collection.find({}, {
-        '_id': True,
-        'network': True,
-    })
-
-    for doc in docs:
+    def _handler(doc):
         if not doc.get('network'):
-            continue
+            return
 
         if isinstance(doc['network'], (int, long)):
-            continue
+            return
 
-        ip_pool_collection.update({
-            '_id': doc['_id'],
-        }, {'$set': {
+        return {'$set': {
             'network': utils.fnv32a(doc['network'])
-        }})
+        }}
+
+    migrate_docs('upgrade_1_4', 'servers_ip_pool', {}, {
+        '_id': True,
+        'network': True,
+    }, _handler)
@@ -4,6 +4,9 @@ from pritunl import utils
 from pritunl import logger
 
 import pymongo
+import time
+
+MIGRATE_CHUNK_SIZE = 1000
 
 _prefix = None
 _database = None
@@ -26,6 +29,68 @@ def database_clean_up():
 def get_collection(collection):
     return getattr(_database, _prefix + collection)
 
+def get_progress(step):
+    doc = get_collection('settings').find_one({'_id': 'upgrade'}) or {}
+    return doc.get('cursors', {}).get(step)
+
+def set_progress(step, cursor):
+    get_collection('settings').update({
+        '_id': 'upgrade',
+    }, {'$set': {
+        'cursors.' + step: cursor,
+    }}, upsert=True)
+
+def clear_progress():
+    get_collection('settings').remove({'_id': 'upgrade'})
+
+def migrate_docs(step, collection, spec, fields, handler):
+    # Rewrite documents in _id order with chunked bulk writes, the last
+    # _id of each chunk is stored to resume an interrupted upgrade
+    coll = get_collection(collection)
+    cursor = get_progress(step)
+    count = 0
+    start = time.time()
+
+    if cursor is not None:
+        logger.info('Resuming database migration', 'upgrade',
+            step=step,
+            cursor=cursor,
+        )
+
+    while True:
+        chunk_spec = spec.copy()
+        if cursor is not None:
+            chunk_spec['_id'] = {'$gt': cursor}
+
+        docs = list(coll.find(chunk_spec, fields).sort(
+            '_id', pymongo.ASCENDING).limit(MIGRATE_CHUNK_SIZE))
+        if not docs:
+            break
+
+        requests = []
+        for doc in docs:
+            update = handler(doc)
+            if update:
+                requests.append(pymongo.UpdateOne({
+                    '_id': doc['_id'],
+                }, update))
+
+        if requests:
+            coll.bulk_write(requests, ordered=False)
+            count += len(requests)
+
+        cursor = docs[-1]['_id']
+        set_progress(step, cursor)
+
+        if len(docs) < MIGRATE_CHUNK_SIZE:
+            break
+
+    logger.info('Database migration complete', 'upgrade',
+        step=step,
+        updated=count,
+        duration=int((time.time() - start) * 1000),
+    )
+
 def setup_cert():
     server_cert = None
     server_key = None
@@ -11,6 +11,7 @@ from pritunl import ipaddress
 from pritunl import sso
 from pritunl import auth
 from pritunl import plugins
+from pritunl import audit
 
 import tarfile
 import zipfile
@@ -1140,11 +1141,31 @@ class User(mongo.MongoObject):
             hash_func = auth.hash_pin_v1
         elif hash_ver == '2':
             hash_func = auth.hash_pin_v2
+        elif hash_ver == '3':
+            hash_func = auth.hash_pin_v3
         else:
             raise ValueError('Unknown hash version')
 
         test_hash = base64.b64encode(hash_func(pin_salt, test_pin))
-        return test_hash == pin_hash
+        if not utils.const_compare(test_hash, pin_hash):
+            return False
+
+        if hash_ver != '3':
+            self.rehash_pin(test_pin)
+
+        return True
+
+    def rehash_pin(self, pin):
+        pin_hash = auth.generate_hash_pin_v3(pin)
+
+        self.collection.update({
+            '_id': self.id,
+            'pin': self.pin,
+        }, {'$set': {
+            'pin': pin_hash,
+        }})
+        self.pin = pin_hash
+        self.changed.discard('pin')
 
     def set_pin(self, pin):
         if not pin:
@@ -1153,7 +1174,7 @@ class User(mongo.MongoObject):
             return changed
 
         changed = not self.check_pin(pin)
-        self.pin = auth.generate_hash_pin_v2(pin)
+        self.pin = auth.generate_hash_pin_v3(pin)
         return changed
 
     def verify_sig(self, digest, signature):
@@ -1253,7 +1274,7 @@ class User(mongo.MongoObject):
         if self.org:
             org_name = self.org.name
 
-        self.audit_collection.insert({
+        audit.add({
             'user_id': self.id,
             'user_name': self.name,
             'org_id': self.org_id,
@@ -1262,10 +1283,7 @@ class User(mongo.MongoObject):
             'type': event_type,
             'remote_addr': remote_addr,
             'message': event_msg,
-        })
-
-        plugins.event(
-            'audit_event',
+        }, dict(
             host_id=settings.local.host_id,
             host_name=settings.local.host.name,
             user_id=self.id,
@@ -1277,7 +1295,7 @@ class User(mongo.MongoObject):
             remote_addr=remote_addr,
             message=event_msg,
             **kwargs
-        )
+        ))
 
     def get_audit_events(self):
         if settings.app.demo_mode:
@@ -162,89 +162,16 @@ def set_db_ver(version, version_min=None):
     return doc.get('version')
 
 def check_output(*args, **kwargs):
-    if 'stdout' in kwargs or 'stderr' in kwargs:
-        raise ValueError('Output arguments not allowed, it will be overridden')
-
-    try:
-        ignore_states = kwargs.pop('ignore_states')
-    except KeyError:
-        ignore_states = None
-
-    process = subprocess.Popen(stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-        *args, **kwargs)
-
-    stdoutdata, stderrdata = process.communicate()
-    return_code = process.poll()
-
-    if return_code:
-        cmd = kwargs.get('args', args[0])
-
-        if ignore_states:
-            for ignore_state in ignore_states:
-                if ignore_state in stdoutdata or ignore_state in stderrdata:
-                    return stdoutdata
-
-        raise subprocess.CalledProcessError(
-            return_code, cmd, output=stdoutdata)
-
-    return stdoutdata
+    from pritunl.utils.proc import exec_cmd
+    return exec_cmd(*args, **kwargs)
 
 def check_output_logged(*args, **kwargs):
-    if 'stdout' in kwargs or 'stderr' in kwargs:
-        raise ValueError('Output arguments not allowed, it will be overridden')
-
-    try:
-        ignore_states = kwargs.pop('ignore_states')
-    except KeyError:
-        ignore_states = None
-
-    try:
-        com_input = kwargs.pop('input')
-        stdin = subprocess.PIPE
-    except KeyError:
-        com_input = None
-        stdin = None
-
-    process = subprocess.Popen(
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        stdin=stdin,
-        *args, **kwargs)
-
-    stdoutdata, stderrdata = process.communicate(input=com_input)
-    return_code = process.poll()
-
-    if return_code:
-        from pritunl import logger
-        cmd = kwargs.get('args', args[0])
-
-        if ignore_states:
-            for ignore_state in ignore_states:
-                if ignore_state in stdoutdata or ignore_state in stderrdata:
-                    return stdoutdata
-
-        logger.error('Popen returned error exit code', 'utils',
-            cmd=cmd,
-            return_code=return_code,
-            stdout=stdoutdata,
-            stderr=stderrdata,
-        )
-
-        raise subprocess.CalledProcessError(
-            return_code, cmd, output=stdoutdata)
-
-    return stdoutdata
+    from pritunl.utils.proc import exec_cmd
+    return exec_cmd(log=True, *args, **kwargs)
 
 def check_call_silent(*args, **kwargs):
-    if 'stdout' in kwargs or 'stderr' in kwargs:
-        raise ValueError('Output arguments not allowed, it will be overridden')
-
-    process = subprocess.Popen(stdout=_null, stderr=_null, *args, **kwargs)
-    return_code = process.wait()
-
-    if return_code:
-        cmd = kwargs.get('args', args[0])
-        raise subprocess.CalledProcessError(return_code, cmd)
+    from pritunl.utils.proc import exec_cmd
+    exec_cmd(silent=True, *args, **kwargs)
 
 def find_caller():
     try:
@@ -486,13 +486,31 @@ def check_network_overlap(test_network, networks):
 
     return False
 
+_safe_priv_subnets = None
+
+def get_safe_priv_subnets():
+    global _safe_priv_subnets
+
+    networks = _safe_priv_subnets
+    if networks is None:
+        networks = [ipaddress.IPNetwork(x)
+            for x in settings.vpn.safe_priv_subnets]
+        _safe_priv_subnets = networks
+
+    return networks
+
+def _on_safe_priv_subnets_change(changes):
+    global _safe_priv_subnets
+    _safe_priv_subnets = None
+
+settings.watch('vpn', ('safe_priv_subnets',), _on_safe_priv_subnets_change)
+
 def check_network_private(test_network):
     test_net = ipaddress.IPNetwork(test_network)
     test_start = test_net.network
     test_end = test_net.broadcast
 
-    for network in settings.vpn.safe_priv_subnets:
-        network = ipaddress.IPNetwork(network)
+    for network in get_safe_priv_subnets():
         net_start = network.network
         net_end = network.broadcast
 
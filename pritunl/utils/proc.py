@@ -1,89 +1,307 @@
 from pritunl.constants import *
+from pritunl import settings
 
+import os
+import errno
+import select
 import subprocess
 import threading
+import time
 
-class Process(object):
-    def __init__(self, *args, **kwargs):
-        if 'stdout' in kwargs or 'stderr' in kwargs:
-            raise ValueError('Output arguments not allowed, '
-                'it will be overridden')
+PROC_LATENCY_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+_null = open(os.devnull, 'w')
+_slots = None
+_slots_lock = threading.Lock()
+_stats = {}
+_stats_lock = threading.Lock()
 
+def _get_slots():
+    global _slots
+
+    if _slots is None:
+        _slots_lock.acquire()
         try:
-            self._ignore_states = kwargs.pop('ignore_states')
-        except KeyError:
-            self._ignore_states = None
+            if _slots is None:
+                _slots = threading.BoundedSemaphore(
+                    settings.app.proc_max_workers)
+        finally:
+            _slots_lock.release()
 
-        self._args = args
-        self._kwargs = kwargs
-        self._process = None
-        self._event = threading.Event()
-        self._stdoutdata = None
-        self._stderrdata = None
-        self._return_code = None
+    return _slots
+
+def _on_max_workers_change(changes):
+    global _slots
+    _slots = None
+
+settings.watch('app', ('proc_max_workers',), _on_max_workers_change)
+
+def _record(cmd, duration, error=False, timeout=False):
+    from pritunl import monitoring
+
+    name = os.path.basename(cmd[0]) if cmd else 'unknown'
+    duration_ms = int(duration * 1000)
+
+    _stats_lock.acquire()
+    try:
+        stats = _stats.get(name)
+        if not stats:
+            stats = {
+                'count': 0,
+                'errors': 0,
+                'timeouts': 0,
+                'total_time': 0,
+                'max_time': 0,
+                'buckets': [0] * (len(PROC_LATENCY_BUCKETS) + 1),
+            }
+            _stats[name] = stats
+
+        stats['count'] += 1
+        stats['total_time'] += duration_ms
+        stats['max_time'] = max(stats['max_time'], duration_ms)
+        if error:
+            stats['errors'] += 1
+        if timeout:
+            stats['timeouts'] += 1
 
-    def _proc_thread(self):
-        from pritunl import logger
-        cmd = None
+        for i, bucket in enumerate(PROC_LATENCY_BUCKETS):
+            if duration_ms <= bucket:
+                stats['buckets'][i] += 1
+                break
+        else:
+            stats['buckets'][-1] += 1
+    finally:
+        _stats_lock.release()
 
+    host = getattr(settings.local, 'host', None)
+    tags = {
+        'host': host.name if host else None,
+        'cmd': name,
+    }
+    monitoring.add_timing('proc', tags, 'duration', duration_ms)
+    if error:
+        monitoring.add_counter('proc', tags, 'errors')
+    if timeout:
+        monitoring.add_counter('proc', tags, 'timeouts')
+
+def get_proc_stats():
+    _stats_lock.acquire()
+    try:
+        stats = {}
+        for name, cmd_stats in _stats.items():
+            cmd_stats = cmd_stats.copy()
+            cmd_stats['buckets'] = dict(zip(
+                [str(x) for x in PROC_LATENCY_BUCKETS] + ['inf'],
+                cmd_stats['buckets'],
+            ))
+            stats[name] = cmd_stats
+        return stats
+    finally:
+        _stats_lock.release()
+
+def _poll(poller, deadline):
+    while True:
         try:
-            cmd = self._kwargs.get('args', self._args[0])
+            if deadline is None:
+                return poller.poll()
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return None
+            return poller.poll(remaining * 1000)
+        except select.error as error:
+            if error.args[0] != errno.EINTR:
+                raise
 
-            self._process = subprocess.Popen(
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                *self._args, **self._kwargs
-            )
+def _wait(process, deadline):
+    if deadline is None:
+        return process.wait()
 
-            stdoutdata, stderrdata = self._process.communicate()
-            return_code = self._process.poll()
+    delay = 0.001
+    while True:
+        return_code = process.poll()
+        if return_code is not None:
+            return return_code
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return None
+        delay = min(delay * 2, remaining, 0.05)
+        time.sleep(delay)
 
-            self._stdoutdata = stdoutdata
-            self._stderrdata = stderrdata
-            self._return_code = return_code
+def _communicate(process, com_input, deadline):
+    poller = select.poll()
+    pipes = {}
+    output = {}
+    stdout_fd = process.stdout.fileno() if process.stdout else None
+    stderr_fd = process.stderr.fileno() if process.stderr else None
 
-            self._event.set()
-        except:
-            logger.exception('Popen exception', 'utils',
-                cmd=cmd,
-            )
+    if process.stdin:
+        if com_input:
+            pipes[process.stdin.fileno()] = process.stdin
+            poller.register(process.stdin, select.POLLOUT)
+        else:
+            process.stdin.close()
 
-    def run(self, timeout=None):
-        from pritunl import logger
+    for pipe in (process.stdout, process.stderr):
+        if pipe:
+            pipes[pipe.fileno()] = pipe
+            output[pipe.fileno()] = []
+            poller.register(pipe, select.POLLIN | select.POLLPRI)
+
+    input_offset = 0
+    while pipes:
+        ready = _poll(poller, deadline)
+        if ready is None:
+            return None, None
+
+        for fd, mode in ready:
+            if mode & select.POLLOUT:
+                chunk = com_input[input_offset:input_offset + select.PIPE_BUF]
+                try:
+                    input_offset += os.write(fd, chunk)
+                except OSError as error:
+                    if error.errno != errno.EPIPE:
+                        raise
+                    input_offset = len(com_input)
+
+                if input_offset >= len(com_input):
+                    poller.unregister(fd)
+                    pipes.pop(fd).close()
+            elif mode & (select.POLLIN | select.POLLPRI):
+                data = os.read(fd, 32768)
+                if data:
+                    output[fd].append(data)
+                else:
+                    poller.unregister(fd)
+                    pipes.pop(fd).close()
+            else:
+                poller.unregister(fd)
+                pipes.pop(fd).close()
 
-        thread = threading.Thread(target=self._proc_thread)
-        thread.daemon = True
-        thread.start()
+    stdoutdata = ''.join(output[stdout_fd]) if stdout_fd else None
+    stderrdata = ''.join(output[stderr_fd]) if stderr_fd else None
 
-        self._event.wait(timeout)
+    return stdoutdata, stderrdata
 
-        cmd = self._kwargs.get('args', self._args[0])
+def exec_cmd(*args, **kwargs):
+    if 'stdout' in kwargs or 'stderr' in kwargs:
+        raise ValueError('Output arguments not allowed, it will be overridden')
 
-        if not self._event.is_set():
+    ignore_states = kwargs.pop('ignore_states', None)
+    timeout = kwargs.pop('timeout', None)
+    silent = kwargs.pop('silent', False)
+    log = kwargs.pop('log', False)
+    com_input = kwargs.pop('input', None)
+
+    cmd = kwargs.get('args', args[0] if args else None)
+    deadline = time.time() + timeout if timeout else None
+    stdoutdata = None
+    stderrdata = None
+    return_code = None
+
+    slots = _get_slots()
+    slots.acquire()
+    start = time.time()
+    try:
+        if silent:
+            process = subprocess.Popen(stdout=_null, stderr=_null,
+                *args, **kwargs)
+        else:
+            process = subprocess.Popen(
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                stdin=subprocess.PIPE if com_input is not None else None,
+                *args, **kwargs)
+
+            stdoutdata, stderrdata = _communicate(
+                process, com_input, deadline)
+
+        if stdoutdata is not None or silent:
+            return_code = _wait(process, deadline)
+
+        if return_code is None:
+            try:
+                process.kill()
+            except OSError:
+                pass
+            process.wait()
+    except:
+        _record(cmd, time.time() - start, error=True)
+        raise
+    finally:
+        slots.release()
+
+    if return_code is None:
+        _record(cmd, time.time() - start, error=True, timeout=True)
+
+        if log:
+            from pritunl import logger
             logger.error('Popen process timeout', 'utils',
                 cmd=cmd,
                 timeout=timeout,
             )
-            try:
-                self._process.kill()
-            except:
-                pass
 
-            raise subprocess.CalledProcessError(-99, cmd, output='')
-        elif self._return_code:
-            if self._ignore_states:
-                for ignore_state in self._ignore_states:
-                    if ignore_state in self._stdoutdata or \
-                            ignore_state in self._stderrdata:
-                        return self._stdoutdata
+        raise subprocess.CalledProcessError(-99, cmd, output='')
+
+    _record(cmd, time.time() - start, error=bool(return_code))
 
+    if return_code:
+        if ignore_states and not silent:
+            for ignore_state in ignore_states:
+                if ignore_state in stdoutdata or ignore_state in stderrdata:
+                    return stdoutdata
+
+        if log:
+            from pritunl import logger
             logger.error('Popen returned error exit code', 'utils',
                 cmd=cmd,
                 timeout=timeout,
-                return_code=self._return_code,
-                stdout=self._stdoutdata,
-                stderr=self._stderrdata,
+                return_code=return_code,
+                stdout=stdoutdata,
+                stderr=stderrdata,
             )
 
-            raise subprocess.CalledProcessError(
-                self._return_code, cmd, output=self._stdoutdata)
+        raise subprocess.CalledProcessError(
+            return_code, cmd, output=stdoutdata)
+
+    return stdoutdata
+
+def ip_batch(commands, ipv6=False, timeout=None, log=True):
+    cmd = ['ip']
+    if ipv6:
+        cmd.append('-6')
+    cmd += ['-force', '-batch', '-']
+
+    return exec_cmd(cmd,
+        input=''.join(' '.join(x) + '\n' for x in commands),
+        timeout=timeout,
+        log=log,
+    )
+
+def iptables_restore(lines, ipv6=False, timeout=None):
+    return exec_cmd(
+        ['ip6tables-restore' if ipv6 else 'iptables-restore', '--noflush'],
+        input=''.join(x + '\n' for x in lines),
+        timeout=timeout,
+        log=True,
+    )
+
+def ipset_restore(lines, timeout=None):
+    return exec_cmd(
+        ['ipset', 'restore', '-exist'],
+        input=''.join(x + '\n' for x in lines),
+        timeout=timeout,
+        log=True,
+    )
+
+class Process(object):
+    def __init__(self, *args, **kwargs):
+        if 'stdout' in kwargs or 'stderr' in kwargs:
+            raise ValueError('Output arguments not allowed, '
+                'it will be overridden')
+
+        self._args = args
+        self._kwargs = kwargs
+
+    def run(self, timeout=None):
+        return exec_cmd(timeout=timeout, log=True,
+            *self._args, **self._kwargs)
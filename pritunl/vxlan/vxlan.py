@@ -225,23 +225,10 @@ class Vxlan(object):
             return
 
         try:
-            utils.check_call_silent([
-                'ip',
-                'link',
-                'set',
-                'down',
-                self.iface_name,
-            ])
-        except subprocess.CalledProcessError:
-            pass
-
-        try:
-            utils.check_call_silent([
-                'ip',
-                'link',
-                'del',
-                self.iface_name,
-            ])
+            utils.ip_batch([
+                ['link', 'set', 'down', self.iface_name],
+                ['link', 'del', self.iface_name],
+            ], log=False)
         except subprocess.CalledProcessError:
             pass
 
@@ -0,0 +1,76 @@
+import base64
+import hashlib
+import os
+import time
+import threading
+import multiprocessing
+
+ITERATIONS = 100000
+DURATION = 5
+THREADS = 4
+
+def hash_pin_v2(salt, pin):
+    pass_hash = hashlib.sha512()
+    pass_hash.update(pin)
+    pass_hash.update(base64.b64decode(salt))
+    hash_digest = pass_hash.digest()
+
+    for _ in xrange(ITERATIONS):
+        pass_hash = hashlib.sha512()
+        pass_hash.update(hash_digest)
+        hash_digest = pass_hash.digest()
+
+    return hash_digest
+
+def hash_pin_v3(salt, pin):
+    return hashlib.pbkdf2_hmac('sha512', pin, base64.b64decode(salt),
+        ITERATIONS)
+
+def run(name, verify):
+    salt = base64.b64encode(os.urandom(16))
+    counts = []
+    delays = []
+    done = threading.Event()
+
+    def probe():
+        while not done.is_set():
+            start = time.time()
+            time.sleep(0.001)
+            delays.append(time.time() - start - 0.001)
+
+    def worker():
+        count = 0
+        start = time.time()
+        while time.time() - start < DURATION:
+            verify(salt, '123456')
+            count += 1
+        counts.append(count)
+
+    probe_thread = threading.Thread(target=probe)
+    probe_thread.start()
+
+    threads = [threading.Thread(target=worker) for _ in xrange(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    done.set()
+    probe_thread.join()
+
+    delays.sort()
+    print '%-20s %8.2f verifies/sec  other thread stall p99 %6.1fms ' \
+        'max %6.1fms' % (
+        name,
+        sum(counts) / float(DURATION),
+        delays[int(len(delays) * 0.99)] * 1000,
+        delays[-1] * 1000,
+    )
+
+if __name__ == '__main__':
+    pool = multiprocessing.Pool(THREADS)
+
+    run('v2 python loop', hash_pin_v2)
+    run('v2 process pool', lambda salt, pin: pool.apply_async(
+        hash_pin_v2, (salt, pin)).get(60))
+    run('v3 pbkdf2_hmac', hash_pin_v3)
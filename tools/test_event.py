@@ -0,0 +1,104 @@
+from pritunl import event
+
+import unittest
+import threading
+import datetime
+import time
+
+class EventHubPoll(unittest.TestCase):
+    def setUp(self):
+        event.hub_reset(0)
+
+    def tearDown(self):
+        event.hub_stop()
+
+    def _dispatch(self, doc_id, event_type, resource_id=None):
+        event.hub_dispatch({
+            '_id': doc_id,
+            'channel': 'events',
+            'timestamp': datetime.datetime.utcnow(),
+            'message': (event_type, resource_id),
+        })
+
+    def _start_polls(self, count, cursor):
+        results = [None] * count
+        threads = []
+
+        def poll(index):
+            results[index] = event.get_events(cursor=cursor)
+
+        for i in xrange(count):
+            thread = threading.Thread(target=poll, args=(i,))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        return results, threads
+
+    def _join(self, threads):
+        for thread in threads:
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+
+    def _ids(self, events):
+        return [(x['id'], x['type'], x['resource_id']) for x in events]
+
+    def test_waiting_pollers(self):
+        results, threads = self._start_polls(20, 0)
+        time.sleep(0.2)
+
+        self._dispatch(1, 'users_updated', 'org1')
+        self._join(threads)
+
+        for events in results:
+            self.assertEqual(self._ids(events),
+                [(1, 'users_updated', 'org1')])
+
+    def test_duplicate_events(self):
+        self._dispatch(1, 'users_updated', 'org1')
+        self._dispatch(2, 'users_updated', 'org1')
+        self._dispatch(3, 'servers_updated')
+
+        self.assertEqual(self._ids(event.get_events(cursor=0)), [
+            (2, 'users_updated', 'org1'),
+            (3, 'servers_updated', None),
+        ])
+        self.assertEqual(self._ids(event.get_events(cursor=2)), [
+            (3, 'servers_updated', None),
+        ])
+
+    def test_arrival_order(self):
+        # Ids from a host with a skewed clock sort before the cursor
+        self._dispatch(5, 'users_updated', 'org1')
+        self._dispatch(3, 'servers_updated')
+        self._dispatch(4, 'hosts_updated')
+
+        self.assertEqual(self._ids(event.get_events(cursor=5)), [
+            (3, 'servers_updated', None),
+            (4, 'hosts_updated', None),
+        ])
+        self.assertEqual(self._ids(event.get_events(cursor=3)), [
+            (4, 'hosts_updated', None),
+        ])
+
+    def test_redelivered_event(self):
+        self._dispatch(1, 'users_updated', 'org1')
+        self._dispatch(2, 'servers_updated')
+        self._dispatch(1, 'users_updated', 'org1')
+
+        self.assertEqual(event._hub_get_events(2, 0, None, False), [])
+
+    def test_unknown_cursor(self):
+        self._dispatch(1, 'users_updated', 'org1')
+
+        self.assertIsNone(event._hub_get_events(7, 0, None, False))
+
+        for i in xrange(event.HUB_BUFFER):
+            self._dispatch(i + 2, 'users_updated', 'org1')
+
+        self.assertIsNone(event._hub_get_events(0, 0, None, False))
+        self.assertEqual(event._hub_get_events(1, 0, None, False)[0]['_id'],
+            2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+from pritunl.tunldb import TunlDB
+
+import unittest
+import tempfile
+import shutil
+import json
+import os
+
+class TunlDBLog(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'tunldb')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _load(self):
+        db = TunlDB()
+        db.persist(self.path, auto_export=False)
+        return db
+
+    def test_partial_log_line(self):
+        good_data = json.dumps(['set', 'key1', 'str', None, 'val1']) + '\n'
+
+        with open(self.path + '.log', 'w') as log_file:
+            log_file.write(good_data)
+            log_file.write('["set", "key2", "str", nu')
+
+        db = self._load()
+        self.assertEqual(db.get('key1'), 'val1')
+        self.assertIsNone(db.get('key2'))
+
+        with open(self.path + '.log', 'r') as log_file:
+            self.assertEqual(log_file.read(), good_data)
+
+        db.set('key3', 'val3')
+        db.export_log()
+
+        db = self._load()
+        self.assertEqual(db.get('key1'), 'val1')
+        self.assertEqual(db.get('key3'), 'val3')
+
+    def test_missing_newline(self):
+        with open(self.path + '.log', 'w') as log_file:
+            log_file.write(json.dumps(['set', 'key1', 'str', None, 'val1']))
+
+        db = self._load()
+        self.assertIsNone(db.get('key1'))
+        self.assertEqual(os.path.getsize(self.path + '.log'), 0)
+
+        db.set('key2', 'val2')
+        db.export_log()
+
+        db = self._load()
+        self.assertEqual(db.get('key2'), 'val2')
+
+if __name__ == '__main__':
+    unittest.main()